@@ -12,5 +12,11 @@ start cmd /k "call venv311\Scripts\activate && celery -A smartVision beat -l inf
 REM Start Celery worker in a new terminal
 start cmd /k "call venv311\Scripts\activate && celery -A smartVision worker --loglevel=info"
 
+REM Start camera ingest supervisor in a new terminal
+start cmd /k "call venv311\Scripts\activate && python manage.py run_ingest"
+
+REM Start batched inference server in a new terminal
+start cmd /k "call venv311\Scripts\activate && python manage.py run_inference"
+
 REM Start MediaMTX in a new terminal
 start cmd /k "%~dp0\mediamtx\mediamtx.exe"
\ No newline at end of file
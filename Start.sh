@@ -11,5 +11,11 @@ celery -A smartVision worker -l info &
 echo "Starting Celery Beat..."
 celery -A smartVision beat -l info &
 
+echo "Starting camera ingest supervisor..."
+python manage.py run_ingest &
+
+echo "Starting batched inference server..."
+python manage.py run_inference &
+
 # Wait so container stays alive
 wait -n
@@ -0,0 +1,177 @@
+# ============================================================================
+# BENCHMARK/BACKENDS.PY - Do the ONNX / OpenVINO exports match PyTorch?
+# Runs every model of the pipeline with the torch backend (reference) and
+# with each exported backend on the same frames, matches detections
+# (same class, IoU >= iou_threshold) and reports recall / precision /
+# keypoint error against torch, plus p50/p95 latency per image, alone and
+# in batches. Run it with `python manage.py check_backends`.
+# ============================================================================
+import glob
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from gismap.benchmark.ingest import environment
+from gismap.detectors import MODEL_PATHS, YOLODetector, detections_from_result, keypoints_from_result
+from gismap.frame_buffer import LEVEL_DETECT, read_latest_frame
+from gismap.tracking import box_iou, greedy_match
+
+logger = logging.getLogger(__name__)
+
+MODEL_IMGSZ = {"best": (640, 384), "box": (640, 384), "pose": 640, "fire": 640}
+MODEL_CONF = {"best": 0.25, "box": 0.25, "pose": 0.5, "fire": 0.25}
+
+
+# ============================================================================
+# Frames
+# ============================================================================
+def load_images(directory: str, limit: int = 50) -> List[np.ndarray]:
+    paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(directory, f"*.{ext}")))
+    images = [cv2.imread(p) for p in paths[:limit]]
+    return [img for img in images if img is not None]
+
+
+def grab_camera_frames(camera_id: int, count: int = 20, interval: float = 0.5) -> List[np.ndarray]:
+    """Distinct frames from the camera's shared-memory ring (ingest must be running)."""
+    frames, last_seq = [], None
+    deadline = time.monotonic() + count * interval * 4
+    while len(frames) < count and time.monotonic() < deadline:
+        latest = read_latest_frame(camera_id, copy=True, level=LEVEL_DETECT)
+        if latest is not None and latest[0] != last_seq:
+            last_seq = latest[0]
+            frames.append(latest[2])
+        time.sleep(interval)
+    return frames
+
+
+# ============================================================================
+# Parity
+# ============================================================================
+def match_detections(reference: List[Dict], candidate: List[Dict], iou_threshold: float = 0.5) -> int:
+    """Greedy matching (best IoU first) of detections of the same class."""
+    if not reference or not candidate:
+        return 0
+    ious = box_iou(np.array([d["bbox"] for d in reference], np.float32),
+                   np.array([d["bbox"] for d in candidate], np.float32))
+    same_class = np.array([[r["class_name"] == c["class_name"] for c in candidate] for r in reference])
+    return len(greedy_match(np.where(same_class, ious, 0.0), iou_threshold))
+
+
+def keypoint_error(reference: List[List], candidate: List[List]) -> Optional[float]:
+    """
+    Mean pixel distance between keypoints, per frame, of the persons matched
+    by order of detection (both backends sort by confidence).
+    """
+    errors = []
+    for ref_persons, cand_persons in zip(reference, candidate):
+        for ref, cand in zip(ref_persons, cand_persons):
+            ref, cand = np.asarray(ref, np.float32), np.asarray(cand, np.float32)
+            visible = (ref > 0).any(axis=1) & (cand > 0).any(axis=1)
+            if visible.any():
+                errors.append(float(np.linalg.norm(ref[visible] - cand[visible], axis=1).mean()))
+    return round(float(np.mean(errors)), 2) if errors else None
+
+
+def parity(reference: List[List[Dict]], candidate: List[List[Dict]], iou_threshold: float = 0.5) -> Dict:
+    matched = sum(match_detections(r, c, iou_threshold) for r, c in zip(reference, candidate))
+    n_ref = sum(len(r) for r in reference)
+    n_cand = sum(len(c) for c in candidate)
+    return {
+        "reference_detections": n_ref,
+        "detections": n_cand,
+        "matched": matched,
+        "recall": round(matched / n_ref, 4) if n_ref else 1.0,
+        "precision": round(matched / n_cand, 4) if n_cand else 1.0,
+    }
+
+
+# ============================================================================
+# Latency
+# ============================================================================
+def latency(detector: YOLODetector, frames: List[np.ndarray], conf: float, batch_size: int,
+            repeats: int = 3) -> Dict:
+    """p50 / p95 milliseconds per image, over `repeats` passes on the frames."""
+    per_image_ms = []
+    for _ in range(repeats):
+        for start in range(0, len(frames), batch_size):
+            batch = frames[start:start + batch_size]
+            started = time.perf_counter()
+            detector.predict(batch, conf)
+            per_image_ms.append((time.perf_counter() - started) * 1000 / len(batch))
+    values = np.asarray(per_image_ms)
+    return {
+        "batch_size": batch_size,
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "fps": round(1000 / float(values.mean()), 1),
+    }
+
+
+def run_model(detector: YOLODetector, name: str, frames: List[np.ndarray]):
+    """Per frame, detections (or keypoints for the pose model)."""
+    results = []
+    for frame in frames:
+        result = detector.predict([frame], MODEL_CONF[name])[0]
+        if name == "pose":
+            results.append((detections_from_result(result, detector.names), keypoints_from_result(result)))
+        else:
+            results.append((detections_from_result(result, detector.names), None))
+    return results
+
+
+# ============================================================================
+# Check
+# ============================================================================
+def check_backends(frames: List[np.ndarray], backends=("onnx", "openvino"), models=None, int8: bool = False,
+                   threads: int = 0, iou_threshold: float = 0.5, min_recall: float = 0.9,
+                   min_precision: float = 0.9, batch_sizes=(1, 8)) -> Dict:
+    """
+    JSON report {"environment", "config", "models": {model: {backend: {...}}}, "passed"}.
+    A backend fails when its recall or precision against torch is below the minimum.
+    """
+    models = list(models or MODEL_PATHS)
+    report = {
+        "environment": environment(),
+        "config": {"frames": len(frames), "backends": list(backends), "int8": int8, "threads": threads,
+                   "iou_threshold": iou_threshold, "min_recall": min_recall, "min_precision": min_precision},
+        "models": {},
+        "passed": True,
+    }
+    for name in models:
+        results = {}
+        reference = None
+        for backend in ("torch",) + tuple(b for b in backends if b != "torch"):
+            try:
+                started = time.perf_counter()
+                detector = YOLODetector(MODEL_PATHS[name], imgsz=MODEL_IMGSZ[name], backend=backend,
+                                        int8=int8 and backend != "torch", threads=threads)
+                load_s = time.perf_counter() - started
+            except Exception as e:
+                logger.error(f"❌ {name} / {backend}: {e}")
+                results[backend] = {"error": str(e), "passed": False}
+                report["passed"] = False
+                continue
+
+            outputs = run_model(detector, name, frames)
+            entry = {
+                "load_s": round(load_s, 2),
+                "latency": [latency(detector, frames, MODEL_CONF[name], size) for size in batch_sizes],
+            }
+            if backend == "torch":
+                reference = outputs
+            elif reference is not None:
+                entry["parity"] = parity([r[0] for r in reference], [o[0] for o in outputs], iou_threshold)
+                if name == "pose":
+                    entry["parity"]["keypoint_error_px"] = keypoint_error([r[1] for r in reference],
+                                                                          [o[1] for o in outputs])
+                entry["passed"] = (entry["parity"]["recall"] >= min_recall
+                                   and entry["parity"]["precision"] >= min_precision)
+                report["passed"] = report["passed"] and entry["passed"]
+            results[backend] = entry
+            del detector
+        report["models"][name] = results
+    return report
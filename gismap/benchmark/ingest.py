@@ -0,0 +1,309 @@
+# ============================================================================
+# BENCHMARK/INGEST.PY - How many cameras can one node ingest?
+# Starts N stand-in cameras (ffmpeg looping a test clip, published on the
+# local mediamtx RTSP server or read as files), runs them through the real
+# ingest path (CameraIngest -> frame bus) and measures frames/s, CPU per
+# camera, Redis traffic and frame age as seen by a frame bus consumer.
+# Run it with `python manage.py bench_ingest`; the JSON report only
+# depends on the config, the clip and the machine, so releases compare.
+# ============================================================================
+import asyncio
+import hashlib
+import logging
+import os
+import platform
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import psutil
+import redis
+
+from gismap.frame_buffer import release_reader
+from gismap.frame_bus import STREAM_KEY, FrameBusConsumer
+from gismap.ingest import CameraIngest
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+REPORT_VERSION = 1
+CLIP_DIR = os.path.join(os.path.dirname(__file__), "clips")
+DEFAULT_CLIP = os.path.join(CLIP_DIR, "testsrc2_1280x720_25fps.mp4")
+# Bench cameras use ids no Camera row will reach, so real streams are untouched
+BENCH_CAMERA_BASE = 900000
+
+
+# ============================================================================
+# Stand-in cameras
+# ============================================================================
+def ensure_clip(path: str = DEFAULT_CLIP, width: int = 1280, height: int = 720, fps: int = 25,
+                duration: int = 20, gop: int = 50) -> str:
+    """
+    Generate the reference clip once (H.264, GOP like a typical camera).
+    Single-threaded x264 makes the bitstream identical from run to run.
+    """
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}",
+        "-c:v", "libx264", "-preset", "veryfast", "-threads", "1",
+        "-pix_fmt", "yuv420p", "-g", str(gop), "-bf", "2",
+        path,
+    ]
+    logger.info(f"[BENCH] Generating reference clip {path}")
+    subprocess.run(cmd, check=True)
+    return path
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StandInSources:
+    """
+    N cameras playing `clip` in real time.
+
+    source="rtsp": one ffmpeg publisher per camera on the RTSP server
+    (mediamtx, rtsp://localhost:8554 by default), ingest reads RTSP.
+    source="file": ingest reads the clip itself (no server needed).
+    """
+
+    def __init__(self, clip: str, count: int, source: str = "rtsp",
+                 rtsp_server: str = "rtsp://localhost:8554"):
+        self.clip = clip
+        self.count = count
+        self.source = source
+        self.rtsp_server = rtsp_server.rstrip("/")
+        self.processes: List[subprocess.Popen] = []
+
+    @property
+    def input_options(self) -> List[str]:
+        """ffmpeg input options of the ingest: a file is played in real time, looped."""
+        return ["-re", "-stream_loop", "-1"] if self.source == "file" else []
+
+    @property
+    def urls(self) -> List[str]:
+        if self.source == "file":
+            return [self.clip] * self.count
+        return [f"{self.rtsp_server}/bench_{i}" for i in range(self.count)]
+
+    def start(self, settle: float = 2.0):
+        if self.source == "file":
+            return
+        for url in self.urls:
+            cmd = [
+                "ffmpeg", "-hide_banner", "-loglevel", "error",
+                "-re", "-stream_loop", "-1", "-i", self.clip,
+                "-c", "copy", "-f", "rtsp", "-rtsp_transport", "tcp", url,
+            ]
+            self.processes.append(subprocess.Popen(cmd, stdin=subprocess.DEVNULL,
+                                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        # Let the server register the paths before readers connect
+        time.sleep(settle)
+        dead = [p.args[-1] for p in self.processes if p.poll() is not None]
+        if dead:
+            self.stop()
+            raise RuntimeError(f"RTSP publishers exited (is mediamtx running on {self.rtsp_server}?): {dead}")
+
+    def stop(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        self.processes.clear()
+
+
+# ============================================================================
+# Measurements
+# ============================================================================
+class FrameAgeSampler:
+    """Reads every bench camera through the frame bus, like an analytic would."""
+
+    def __init__(self, camera_ids: List[int], group: str = "bench"):
+        self.camera_ids = camera_ids
+        self.group = group
+        self.ages: Dict[int, List[float]] = {camera_id: [] for camera_id in camera_ids}
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def _run(self, camera_id: int):
+        bus = FrameBusConsumer(camera_id, group=self.group, block_ms=200)
+        while not self._stop.is_set():
+            entry = bus.read()
+            if entry is None:
+                continue
+            self.ages[camera_id].append(time.time() - entry["timestamp"])
+            bus.ack(entry["id"])
+
+    def start(self):
+        for camera_id in self.camera_ids:
+            thread = threading.Thread(target=self._run, args=(camera_id,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=2)
+
+
+def age_summary(ages_s: List[float]) -> Dict:
+    if not ages_s:
+        return {"samples": 0, "p50_ms": None, "p95_ms": None, "max_ms": None}
+    ages_ms = np.asarray(ages_s) * 1000
+    return {
+        "samples": int(ages_ms.size),
+        "p50_ms": round(float(np.percentile(ages_ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ages_ms, 95)), 2),
+        "max_ms": round(float(ages_ms.max()), 2),
+    }
+
+
+def process_cpu_seconds(pid: Optional[int]) -> float:
+    if pid is None:
+        return 0.0
+    try:
+        times = psutil.Process(pid).cpu_times()
+    except psutil.Error:
+        return 0.0
+    return times.user + times.system
+
+
+def redis_net_bytes() -> Dict[str, int]:
+    stats = redis_client.info("stats")
+    return {"in": int(stats.get("total_net_input_bytes", 0)),
+            "out": int(stats.get("total_net_output_bytes", 0))}
+
+
+def environment() -> Dict:
+    try:
+        ffmpeg_version = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg_version = None
+    try:
+        redis_version = redis_client.info("server").get("redis_version")
+    except redis.RedisError:
+        redis_version = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": psutil.cpu_count(logical=True),
+        "cpu_count_physical": psutil.cpu_count(logical=False),
+        "ffmpeg": ffmpeg_version,
+        "redis": redis_version,
+    }
+
+
+def cleanup_bench_streams(camera_ids: List[int]):
+    for camera_id in camera_ids:
+        release_reader(camera_id)
+    try:
+        redis_client.delete(*[STREAM_KEY.format(camera_id=camera_id) for camera_id in camera_ids])
+    except redis.RedisError as e:
+        logger.error(f"[BENCH] Redis cleanup error: {e}")
+
+
+# ============================================================================
+# Run
+# ============================================================================
+async def run_benchmark(cameras: int = 4, duration: float = 30.0, warmup: float = 5.0,
+                        width: int = 1280, height: int = 720, fps: int = 1,
+                        output_format: str = "rawvideo", decode_mode: str = "all", lowres: int = 0,
+                        source: str = "rtsp", rtsp_server: str = "rtsp://localhost:8554",
+                        clip: Optional[str] = None) -> Dict:
+    clip = ensure_clip(clip or DEFAULT_CLIP)
+    config = {
+        "cameras": cameras, "duration_s": duration, "warmup_s": warmup,
+        "width": width, "height": height, "fps": fps,
+        "output_format": output_format, "decode_mode": decode_mode, "lowres": lowres,
+        "source": source,
+    }
+    camera_ids = [BENCH_CAMERA_BASE + i for i in range(cameras)]
+    sources = StandInSources(clip, cameras, source=source, rtsp_server=rtsp_server)
+    sources.start()
+
+    ingests = [
+        CameraIngest(camera_id, url, width, height, fps, output_format,
+                     start_detection=False, decode_mode=decode_mode, lowres=lowres,
+                     input_options=sources.input_options)
+        for camera_id, url in zip(camera_ids, sources.urls)
+    ]
+    sampler = FrameAgeSampler(camera_ids)
+    me = psutil.Process()
+    try:
+        for ingest in ingests:
+            ingest.start()
+        await asyncio.sleep(warmup)
+
+        sampler.start()
+        frames_start = [ingest.publisher.frames_published for ingest in ingests]
+        pids_start = [ingest.process.pid if ingest.process else None for ingest in ingests]
+        ffmpeg_start = [process_cpu_seconds(pid) for pid in pids_start]
+        python_start = sum(me.cpu_times()[:2])
+        net_start = redis_net_bytes()
+        started = time.monotonic()
+
+        await asyncio.sleep(duration)
+
+        elapsed = time.monotonic() - started
+        frames_end = [ingest.publisher.frames_published for ingest in ingests]
+        pids_end = [ingest.process.pid if ingest.process else None for ingest in ingests]
+        ffmpeg_end = [process_cpu_seconds(pid) for pid in pids_end]
+        python_cpu = sum(me.cpu_times()[:2]) - python_start
+        net_end = redis_net_bytes()
+    finally:
+        sampler.stop()
+        await asyncio.gather(*(ingest.stop() for ingest in ingests), return_exceptions=True)
+        sources.stop()
+        cleanup_bench_streams(camera_ids)
+
+    per_camera = []
+    all_ages = []
+    for i, ingest in enumerate(ingests):
+        frames = frames_end[i] - frames_start[i]
+        # A restarted ffmpeg resets its counters: that camera's CPU is unknown
+        restarted = pids_start[i] is None or pids_start[i] != pids_end[i]
+        ffmpeg_cpu = None if restarted else ffmpeg_end[i] - ffmpeg_start[i]
+        ages = sampler.ages[ingest.camera_id]
+        all_ages.extend(ages)
+        per_camera.append({
+            "camera": i,
+            "frames": frames,
+            "fps": round(frames / elapsed, 3),
+            "restarts": ingest.restarts,
+            "ffmpeg_cpu_percent": round(100 * ffmpeg_cpu / elapsed, 2) if ffmpeg_cpu is not None else None,
+            "frame_age": age_summary(ages),
+        })
+
+    ffmpeg_total = sum(c["ffmpeg_cpu_percent"] or 0.0 for c in per_camera)
+    # Python side (publish + bench sampler) is shared by all cameras
+    python_percent = 100 * python_cpu / elapsed
+    return {
+        "benchmark": "ingest",
+        "version": REPORT_VERSION,
+        "config": config,
+        "clip": {"name": os.path.basename(clip), "sha256": file_sha256(clip)},
+        "environment": environment(),
+        "results": {
+            "elapsed_s": round(elapsed, 3),
+            "total_fps": round(sum(c["fps"] for c in per_camera), 3),
+            "cpu_percent_per_camera": round((ffmpeg_total + python_percent) / max(cameras, 1), 2),
+            "ingest_python_cpu_percent": round(python_percent, 2),
+            "redis_bytes_per_s": {
+                "in": round((net_end["in"] - net_start["in"]) / elapsed, 1),
+                "out": round((net_end["out"] - net_start["out"]) / elapsed, 1),
+            },
+            "frame_age": age_summary(all_ages),
+            "cameras": per_camera,
+        },
+    }
@@ -0,0 +1,75 @@
+# ============================================================================
+# BENCHMARK/STARTUP.PY - What does a worker pay before its first task?
+# Imports the Celery app and every task module in a fresh interpreter (as a
+# worker does at start), then measures the time, the resident memory and
+# which models got loaded: none should, they belong to the model registry.
+# Optionally warms models up afterwards to time each of them.
+# Run it with `python manage.py bench_startup`.
+# ============================================================================
+import json
+import subprocess
+import sys
+from typing import Dict, Iterable, List, Optional
+
+from gismap.benchmark.ingest import environment
+
+TASK_MODULES = (
+    "gismap.tasks.streaming_tasks",
+    "gismap.tasks.notification_tasks",
+    "gismap.tasks.ocr_task",
+    "gismap.tasks.yolo_detect_task",
+    "gismap.tasks.fire_clip_tasks",
+)
+
+# Run in the child process: stdout carries the JSON result only
+_PROBE = r"""
+import importlib, json, os, sys, time
+import psutil
+started = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "smartVision.settings")
+import django
+django.setup()
+import smartVision.celery
+imports_s = {}
+for module in MODULES:
+    t = time.perf_counter()
+    importlib.import_module(module)
+    imports_s[module] = round(time.perf_counter() - t, 3)
+from gismap.model_registry import registry
+result = {
+    "startup_s": round(time.perf_counter() - started, 3),
+    "imports_s": imports_s,
+    "rss_mb": round(psutil.Process().memory_info().rss / 2**20, 1),
+    "heavy_modules": sorted(m for m in ("torch", "ultralytics", "clip", "onnxruntime", "openvino") if m in sys.modules),
+    "models_loaded": registry.loaded(),
+}
+if WARMUP:
+    result["warmup_s"] = registry.warmup(WARMUP)
+    result["rss_after_warmup_mb"] = round(psutil.Process().memory_info().rss / 2**20, 1)
+sys.stdout.write("\n" + json.dumps(result))
+"""
+
+
+def measure_startup(modules: Iterable[str] = TASK_MODULES, warmup: Optional[List[str]] = None,
+                    runs: int = 3) -> Dict:
+    """
+    Median over `runs` fresh interpreters. "passed" is False when importing
+    the task modules loaded a model.
+    """
+    code = f"MODULES = {list(modules)!r}\nWARMUP = {list(warmup or [])!r}\n" + _PROBE
+    samples = []
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"Startup probe failed: {proc.stderr.strip().splitlines()[-1:]}")
+        samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    samples.sort(key=lambda sample: sample["startup_s"])
+    median = samples[len(samples) // 2]
+    return {
+        "environment": environment(),
+        "runs": runs,
+        "startup_s": [sample["startup_s"] for sample in samples],
+        "median": median,
+        "passed": not any(sample["models_loaded"] for sample in samples),
+    }
@@ -0,0 +1,73 @@
+# ============================================================================
+# BLOB_STORE.PY - Short-lived binary blobs (plate crops...) in Redis
+# Images are encoded once (PNG / JPEG) and stored under a random key with a
+# TTL; Celery messages only carry the key, never the pixels. Consumers read
+# the bytes back with get_blob(); expired keys just return None.
+# ============================================================================
+import logging
+import uuid
+from typing import Optional
+
+import cv2
+import numpy as np
+import redis
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+BLOB_KEY = "blob:{kind}:{blob_id}"
+STATS_KEY = "stats:blobs"
+DEFAULT_TTL = 120  # secondes: large devant l'attente d'un worker OCR
+
+
+def put_blob(data: bytes, kind: str = "crop", ttl: int = DEFAULT_TTL) -> Optional[str]:
+    """Store bytes, return their key (None when Redis is unavailable)."""
+    key = BLOB_KEY.format(kind=kind, blob_id=uuid.uuid4().hex)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.set(key, data, ex=ttl)
+        pipe.hincrby(STATS_KEY, f"{kind}:puts", 1)
+        pipe.hincrby(STATS_KEY, f"{kind}:bytes", len(data))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"❌ Blob store write error: {e}")
+        return None
+    return key
+
+
+def put_image(image: np.ndarray, kind: str = "crop", ext: str = ".png", quality: int = 95,
+              ttl: int = DEFAULT_TTL) -> Optional[str]:
+    """
+    Encode an image once and store it. PNG is lossless (OCR reads the exact
+    pixels), ".jpg" is smaller for images only looked at by people.
+    """
+    if image is None or image.size == 0:
+        return None
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if ext == ".jpg" else [cv2.IMWRITE_PNG_COMPRESSION, 1]
+    ok, buffer = cv2.imencode(ext, np.ascontiguousarray(image), params)
+    if not ok:
+        logger.error(f"❌ {ext} encoding failed for a {kind} blob")
+        return None
+    return put_blob(buffer.tobytes(), kind=kind, ttl=ttl)
+
+
+def get_blob(key: str, delete: bool = False) -> Optional[bytes]:
+    """Bytes of a blob, None if it expired; `delete` frees it right away (single consumer)."""
+    try:
+        if delete:
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.get(key)
+            pipe.delete(key)
+            data = pipe.execute()[0]
+        else:
+            data = redis_client.get(key)
+    except redis.RedisError as e:
+        logger.error(f"❌ Blob store read error for {key}: {e}")
+        return None
+    if data is None:
+        try:
+            redis_client.hincrby(STATS_KEY, "expired", 1)
+        except redis.RedisError:
+            pass
+    return data
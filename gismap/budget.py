@@ -0,0 +1,210 @@
+# ============================================================================
+# BUDGET.PY - Inference budget shared by all cameras (INFERENCE_BUDGET_FPS)
+# Each detection loop paces itself with InferenceBudget.wait() instead of a
+# fixed sleep. Cameras publish their state in one Redis hash (budget:cameras)
+# and every loop computes the same allocation from it:
+#     quiet cameras       heartbeat rate (BUDGET_HEARTBEAT_FPS)
+#     active cameras      the rest of the budget, by weight, up to BUDGET_MAX_FPS
+# A camera is active when it saw objects recently (decaying peak of the
+# objects per frame), raised an alert within BUDGET_ALERT_HOLD_S, or was
+# marked "high" priority by an operator (Camera.inference_priority, live
+# via Redis).
+# Effective FPS (frames actually processed) is published for the dashboard.
+# ============================================================================
+import json
+import logging
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+CAMERAS_KEY = "budget:cameras"        # camera_id -> JSON state of its loop
+PRIORITY_KEY = "budget:priority"      # camera_id -> operator priority
+ALERT_KEY = "budget:alert:{camera_id}"
+
+PRIORITY_LOW, PRIORITY_NORMAL, PRIORITY_HIGH = 0, 1, 2
+PRIORITY_WEIGHTS = {PRIORITY_LOW: 0.5, PRIORITY_NORMAL: 1.0, PRIORITY_HIGH: 2.0}
+STATE_TTL = 10.0  # secondes: une caméra sans nouvelles sort du partage
+
+
+def mark_alert(camera_id, hold_s: Optional[float] = None):
+    """An alert was raised on this camera: full rate for the next hold_s seconds."""
+    hold_s = hold_s or getattr(settings, "BUDGET_ALERT_HOLD_S", 300)
+    try:
+        redis_client.set(ALERT_KEY.format(camera_id=camera_id), int(time.time()), ex=int(hold_s))
+    except redis.RedisError as e:
+        logger.error(f"[{camera_id}] Redis budget alert error: {e}")
+
+
+def set_priority(camera_id, priority: int):
+    try:
+        redis_client.hset(PRIORITY_KEY, camera_id, int(priority))
+    except redis.RedisError as e:
+        logger.error(f"[{camera_id}] Redis budget priority error: {e}")
+
+
+def allocate(cameras: Dict, total_fps: float, max_fps: float, heartbeat_fps: float) -> Dict:
+    """
+    {camera_id: fps} from {camera_id: (weight, active)}. Every camera gets
+    the heartbeat; what is left is water-filled over the active ones by
+    weight, none above max_fps. Same input, same result on every worker.
+    """
+    fps = {camera_id: heartbeat_fps for camera_id in cameras}
+    left = max(total_fps - heartbeat_fps * len(cameras), 0.0)
+    open_ = {camera_id: weight for camera_id, (weight, active) in cameras.items() if active and weight > 0}
+    while open_ and left > 1e-6:
+        total_weight = sum(open_.values())
+        capped = {}
+        for camera_id, weight in open_.items():
+            room = max_fps - fps[camera_id]
+            if left * weight / total_weight >= room:
+                capped[camera_id] = room
+        if not capped:
+            for camera_id, weight in open_.items():
+                fps[camera_id] += left * weight / total_weight
+            break
+        for camera_id, room in capped.items():
+            fps[camera_id] += room
+            left -= room
+            del open_[camera_id]
+    return fps
+
+
+class InferenceBudget:
+    """
+    Pacing of one camera's detection loop:
+        budget.wait()              before reading the next frame
+        budget.observe(n, alert)   after a frame (n objects found)
+    """
+
+    def __init__(self, camera_id, priority: int = PRIORITY_NORMAL, refresh_s: float = 1.0,
+                 busy_objects: float = 3.0, activity_half_life_s: float = 10.0):
+        self.camera_id = camera_id
+        self.priority = priority
+        self.total_fps = float(getattr(settings, "INFERENCE_BUDGET_FPS", 40))
+        self.max_fps = float(getattr(settings, "BUDGET_MAX_FPS", 10))
+        self.heartbeat_fps = float(getattr(settings, "BUDGET_HEARTBEAT_FPS", 1))
+        self.refresh_s = refresh_s
+        # Objects per frame at which a camera counts as fully busy
+        self.busy_objects = busy_objects
+        self.activity_half_life_s = activity_half_life_s
+        self.activity = 0.0
+        self.alert = False
+        self.fps = self.max_fps
+        self.effective_fps = 0.0
+        self._activity_at = time.time()
+        self._refreshed_at = 0.0
+        self._last_start: Optional[float] = None
+        # Slot start of the frame being processed (None: no frame since the last observe)
+        # and of the previous processed frame, for the effective fps
+        self._frame_start: Optional[float] = None
+        self._processed_start: Optional[float] = None
+        set_priority(camera_id, priority)
+
+    # ------------------------------------------------------------------
+    def observe(self, objects: int = 0, alert: bool = False):
+        now = time.time()
+        # Counted once per processed frame (alerts may observe the same frame again);
+        # reads that returned no frame never get here
+        if self._frame_start is not None:
+            if self._processed_start is not None:
+                interval = self._frame_start - self._processed_start
+                # Smoothed over ~10 frames
+                self.effective_fps += 0.1 * (1.0 / max(interval, 1e-3) - self.effective_fps)
+            self._processed_start, self._frame_start = self._frame_start, None
+        # Decaying peak: busy as soon as something shows up, quiet again after a few half-lives
+        decay = 0.5 ** ((now - self._activity_at) / self.activity_half_life_s)
+        self.activity = max(self.activity * decay, float(objects))
+        self._activity_at = now
+        if alert:
+            mark_alert(self.camera_id)
+            self.alert = True
+
+    def level(self) -> float:
+        """0 (quiet) .. 1 (busy) from the decayed peak number of objects per frame."""
+        return min(self.activity / self.busy_objects, 1.0)
+
+    def weight(self) -> Tuple[float, bool]:
+        active = self.alert or self.priority >= PRIORITY_HIGH or self.level() > 0.05
+        boost = 1.0 if self.alert else self.level()
+        return PRIORITY_WEIGHTS.get(self.priority, 1.0) * (0.25 + boost), active
+
+    def current_effective_fps(self, now: float) -> float:
+        """Effective fps, bounded by the time since the last processed frame (0 before the first)."""
+        if self._processed_start is None:
+            return 0.0
+        return min(self.effective_fps, 1.0 / max(now - self._processed_start, 1e-3))
+
+    def refresh(self):
+        """Publish this camera's state and recompute its share from all cameras (one round trip)."""
+        now = time.time()
+        weight, active = self.weight()
+        state = {"weight": round(weight, 3), "active": active, "fps": round(self.fps, 2),
+                 "effective_fps": round(self.current_effective_fps(now), 2), "priority": self.priority,
+                 "activity": round(self.level(), 3), "alert": self.alert, "ts": now}
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hset(CAMERAS_KEY, self.camera_id, json.dumps(state))
+            pipe.hget(PRIORITY_KEY, self.camera_id)
+            pipe.exists(ALERT_KEY.format(camera_id=self.camera_id))
+            pipe.hgetall(CAMERAS_KEY)
+            _, priority, alert, raw = pipe.execute()
+        except redis.RedisError as e:
+            logger.error(f"[{self.camera_id}] Redis budget refresh error: {e}")
+            return
+        if priority is not None:
+            self.priority = int(priority)
+        self.alert = bool(alert)
+        cameras = {}
+        for camera_id, value in raw.items():
+            other = json.loads(value)
+            if now - other["ts"] <= STATE_TTL:
+                cameras[camera_id.decode()] = (other["weight"], other["active"])
+        cameras[str(self.camera_id)] = self.weight()
+        fps = allocate(cameras, self.total_fps, self.max_fps, self.heartbeat_fps)[str(self.camera_id)]
+        if abs(fps - self.fps) >= 0.5:
+            logger.info(f"[{self.camera_id}] Inference budget: {self.fps:.1f} -> {fps:.1f} fps")
+        self.fps = fps
+        self._refreshed_at = now
+
+    def wait(self):
+        """Sleep until this camera's next inference slot."""
+        now = time.time()
+        if now - self._refreshed_at >= self.refresh_s:
+            self.refresh()
+            now = time.time()
+        if self._last_start is not None:
+            delay = 1.0 / max(self.fps, 1e-3) - (now - self._last_start)
+            if delay > 0:
+                time.sleep(delay)
+                now = time.time()
+        self._last_start = now
+        self._frame_start = now
+
+    def close(self):
+        try:
+            redis_client.hdel(CAMERAS_KEY, self.camera_id)
+        except redis.RedisError:
+            pass
+
+
+def get_budget_stats(camera_ids: Iterable) -> Dict:
+    """{camera_id: state of its loop (target / effective fps, activity...)} or None when not running."""
+    camera_ids = list(camera_ids)
+    try:
+        raw = redis_client.hgetall(CAMERAS_KEY)
+    except redis.RedisError as e:
+        logger.error(f"Redis budget stats error: {e}")
+        raw = {}
+    now = time.time()
+    states = {camera_id.decode(): json.loads(value) for camera_id, value in raw.items()}
+    stats = {}
+    for camera_id in camera_ids:
+        state = states.get(str(camera_id))
+        stats[camera_id] = state if state and now - state["ts"] <= STATE_TTL else None
+    return stats
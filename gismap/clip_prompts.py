@@ -0,0 +1,89 @@
+# ============================================================================
+# CLIP_PROMPTS.PY - CLIP zero-shot descriptions with cached prompt embeddings
+# Text embeddings only depend on the prompts: each prompt set is encoded
+# once per loaded model, L2-normalized and kept in the model bundle under
+# the hash of its prompts (the fire set at load time, see
+# gismap/model_registry.py). Describing images is then one batched
+# encode_image over every crop of a frame and a matrix product.
+# Prompt sets are configurable (CLIP_FIRE_PROMPTS / CLIP_NO_FIRE_PROMPTS):
+# an image is confirmed as fire when its best prompt is a fire one.
+# ============================================================================
+import hashlib
+import json
+import logging
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIRE_PROMPTS = (
+    "A photo showing fire",
+    "Smoke and fire are visible",
+    "Flames and smoke in the image",
+    "A photo of burning fire",
+)
+DEFAULT_NO_FIRE_PROMPTS = (
+    "No fire in the image",
+    "No flames or smoke",
+)
+
+_lock = threading.Lock()
+
+
+def positive_fire_prompts() -> Tuple[str, ...]:
+    from django.conf import settings
+    return tuple(getattr(settings, "CLIP_FIRE_PROMPTS", None) or DEFAULT_FIRE_PROMPTS)
+
+
+def fire_prompts() -> Tuple[str, ...]:
+    """Fire prompts followed by the no-fire ones: the set CLIP picks from."""
+    from django.conf import settings
+    return positive_fire_prompts() + tuple(getattr(settings, "CLIP_NO_FIRE_PROMPTS", None) or DEFAULT_NO_FIRE_PROMPTS)
+
+
+def prompt_set_hash(prompts: Sequence[str]) -> str:
+    return hashlib.sha1(json.dumps(list(prompts)).encode()).hexdigest()[:16]
+
+
+def text_embeddings(clip, prompts: Sequence[str]):
+    """(P, D) normalized text embeddings of a prompt set, encoded on first use only."""
+    cache = clip.setdefault("text_embeddings", {})
+    key = prompt_set_hash(prompts)
+    features = cache.get(key)
+    if features is not None:
+        return features
+    import torch
+    with _lock:
+        features = cache.get(key)
+        if features is None:
+            with torch.no_grad():
+                features = clip["model"].encode_text(clip["tokenize"](list(prompts)).to(clip["device"]))
+                features = features / features.norm(dim=-1, keepdim=True)
+            cache[key] = features
+            logger.info(f"✅ CLIP text embeddings cached for {len(prompts)} prompts ({key})")
+    return features
+
+
+def describe(clip, images: Sequence[np.ndarray], prompts: Optional[Sequence[str]] = None) -> List[Tuple[str, float]]:
+    """
+    Most probable prompt and its probability for each BGR image, from one
+    encode_image pass over all of them.
+    """
+    if not len(images):
+        return []
+    import torch
+    prompts = tuple(prompts or fire_prompts())
+    text = text_embeddings(clip, prompts)
+    batch = torch.stack([clip["preprocess"](Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)))
+                         for image in images]).to(clip["device"])
+    with torch.no_grad():
+        features = clip["model"].encode_image(batch)
+        features = features / features.norm(dim=-1, keepdim=True)
+        logits = clip["model"].logit_scale.exp() * features @ text.T
+        probs = logits.float().softmax(dim=-1)
+        confidences, best = probs.max(dim=-1)
+    return [(prompts[index], confidence) for index, confidence in zip(best.tolist(), confidences.tolist())]
@@ -22,14 +22,26 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
 # gismap/consumers.py
 
+import base64
+from urllib.parse import parse_qs
 import redis.asyncio as aioredis
+from gismap.frame_buffer import DEFAULT_LEVEL, LEVEL_DETECT, LEVEL_FULL, LEVEL_THUMB, jpeg_keys
+from gismap.overlays import overlay_keys
 
-# Async Redis client
-redis_client = aioredis.from_url("redis://localhost:6379", decode_responses=True)
+# Async Redis client (raw bytes: frames are JPEG, not text)
+redis_client = aioredis.from_url("redis://localhost:6379")
 
 class CameraStreamConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.camera_id = self.scope['url_route']['kwargs']['camera_id']
+        # Pyramid level: ?level=thumb for grids, detect (default) or full
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.level = query.get('level', [DEFAULT_LEVEL])[0]
+        if self.level not in (LEVEL_THUMB, LEVEL_DETECT, LEVEL_FULL):
+            self.level = DEFAULT_LEVEL
+        self.frame_key, _, self.wanted_key = jpeg_keys(self.camera_id, self.level)
+        # Detection layers (JSON) sent along with each frame, drawn client-side
+        self.overlay_keys = overlay_keys(self.camera_id)
         await self.accept()
         print(f"[WS] Client connected to camera {self.camera_id}")
 
@@ -48,13 +60,17 @@ class CameraStreamConsumer(AsyncWebsocketConsumer):
     async def send_frames(self):
         try:
             while True:
-                # Get latest frame from Redis
-                frame_data = await redis_client.get(f"camera:{self.camera_id}:frame")
+                # Ingest only encodes JPEG while someone is watching
+                await redis_client.set(self.wanted_key, 1, ex=5)
+
+                # Latest frame and detection layers in one round trip
+                frame_data, *overlays = await redis_client.mget(self.frame_key, *self.overlay_keys)
                 if frame_data:
-                    await self.send_json({
+                    await self.send(text_data=json.dumps({
                         "camera_id": self.camera_id,
-                        "frame": frame_data  # already base64
-                    })
+                        "frame": base64.b64encode(frame_data).decode("ascii"),
+                        "overlays": [json.loads(overlay) for overlay in overlays if overlay],
+                    }))
                 await asyncio.sleep(1/10)  # 10 fps
         except asyncio.CancelledError:
             print(f"[WS] Frame sending loop cancelled for camera {self.camera_id}")
\ No newline at end of file
@@ -0,0 +1,246 @@
+# ============================================================================
+# DETECTORS.PY - YOLO model wrappers shared by the Celery tasks and the
+# batched inference server (gismap/inference_server.py)
+# Backends: "torch" (ultralytics .pt), "onnx" (ONNX Runtime) and "openvino",
+# from exports cached in gismap/yolo/exported/, optionally INT8.
+# torch / ultralytics are imported on first model load: importing this
+# module stays cheap (see gismap/model_registry.py).
+# ============================================================================
+import hashlib
+import json
+import logging
+import os
+import shutil
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from filelock import FileLock
+
+logger = logging.getLogger(__name__)
+
+YOLO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "yolo"))
+
+# Models of the detection and fire pipelines, by short name
+MODEL_PATHS = {
+    "best": os.path.join(YOLO_DIR, "best.pt"),
+    "box": os.path.join(YOLO_DIR, "box.pt"),
+    "pose": os.path.join(YOLO_DIR, "yolov8s-pose.pt"),
+    "fire": os.path.join(YOLO_DIR, "best (1).pt"),
+}
+
+BACKENDS = ("torch", "onnx", "openvino")
+EXPORT_DIR = os.path.join(YOLO_DIR, "exported")
+
+
+def get_device() -> str:
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def default_backend_options() -> Dict:
+    """
+    Backend settings of this node (INFERENCE_BACKEND / INFERENCE_INT8 / INFERENCE_THREADS).
+    Without INFERENCE_THREADS, a pinned inference process uses its share of
+    the cores (gismap/worker_pool.py).
+    """
+    from django.conf import settings
+    from gismap.worker_pool import process_threads
+    return {
+        "backend": getattr(settings, "INFERENCE_BACKEND", "torch"),
+        "int8": getattr(settings, "INFERENCE_INT8", False),
+        "threads": getattr(settings, "INFERENCE_THREADS", 0) or process_threads(),
+    }
+
+
+# ============================================================================
+# Export cache
+# ============================================================================
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def export_model(model_path: str, backend: str, int8: bool = False, imgsz=640,
+                 calibration_data: Optional[str] = None) -> str:
+    """
+    Path of the ONNX file / OpenVINO directory for a .pt model, exported on
+    first use and cached. The cache is keyed on the .pt content, so a
+    retrained model is exported again.
+
+    INT8: ONNX gets dynamic weight quantization (no calibration data needed),
+    OpenVINO uses NNCF post-training quantization on `calibration_data`
+    (ultralytics dataset yaml, its default otherwise).
+    """
+    if backend not in BACKENDS or backend == "torch":
+        raise ValueError(f"No export for backend: {backend}")
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    suffix = "-int8" if int8 else ""
+    target = os.path.join(EXPORT_DIR, f"{stem}{suffix}.onnx" if backend == "onnx" else f"{stem}{suffix}_openvino_model")
+    sidecar = target.rstrip("/") + ".json"
+    source_sha = _file_sha256(model_path)
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    # Several workers may start at once: only one exports
+    with FileLock(os.path.join(EXPORT_DIR, f"{stem}.lock")):
+        if os.path.exists(target) and os.path.exists(sidecar):
+            with open(sidecar) as f:
+                if json.load(f).get("source_sha256") == source_sha:
+                    return target
+
+        from ultralytics import YOLO
+        logger.info(f"📦 Exporting {model_path} to {backend}{' INT8' if int8 else ''}...")
+        model = YOLO(model_path)
+        if backend == "onnx":
+            exported = model.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+            if int8:
+                try:
+                    from onnxruntime.quantization import QuantType, quantize_dynamic
+                except ImportError as e:
+                    raise ImportError("INT8 ONNX export needs onnxruntime (pip install onnxruntime)") from e
+                quantize_dynamic(exported, target, weight_type=QuantType.QUInt8)
+                os.remove(exported)
+            else:
+                shutil.move(exported, target)
+        else:
+            options = {"data": calibration_data} if int8 and calibration_data else {}
+            exported = model.export(format="openvino", imgsz=imgsz, dynamic=True, int8=int8, **options)
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            shutil.move(exported, target)
+
+        with open(sidecar, "w") as f:
+            json.dump({"source": os.path.basename(model_path), "source_sha256": source_sha,
+                       "task": model.task, "backend": backend, "int8": int8}, f, indent=2)
+        logger.info(f"✅ Exported {target}")
+        return target
+
+
+def exported_task(artifact: str) -> Optional[str]:
+    """Task (detect / pose) recorded when the model was exported."""
+    try:
+        with open(artifact.rstrip("/") + ".json") as f:
+            return json.load(f).get("task")
+    except (OSError, ValueError):
+        return None
+
+
+def detections_from_result(result, names) -> List[Dict]:
+    """Ultralytics Results -> [{"bbox", "confidence", "class_name"}] (vectorized)."""
+    if result.boxes is None or len(result.boxes) == 0:
+        return []
+    boxes = result.boxes.xyxy.cpu().numpy().astype(int)
+    confs = result.boxes.conf.cpu().numpy()
+    cls_ids = result.boxes.cls.cpu().numpy().astype(int)
+    return [
+        {
+            "bbox": tuple(box.tolist()),
+            "confidence": float(conf),
+            "class_name": names[cls_id] if names is not None else str(cls_id),
+        }
+        for box, conf, cls_id in zip(boxes, confs, cls_ids)
+    ]
+
+
+def keypoints_from_result(result) -> List[List[List[float]]]:
+    """Per person, the (x, y) keypoints of a pose Results as plain lists."""
+    if result.keypoints is None:
+        return []
+    return result.keypoints.xy.cpu().numpy().tolist()
+
+
+# ============================================================================
+# YOLO Detector Wrapper
+# ============================================================================
+class YOLODetector:
+    def __init__(self, model_path: str, imgsz=(640, 384), backend: str = "torch", int8: bool = False,
+                 threads: int = 0):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend: {backend}")
+        self.model_path = model_path
+        self.imgsz = imgsz
+        self.backend = backend
+        self.int8 = int8
+        # Intra-op threads of the runtime (0: runtime default)
+        self.threads = threads
+        self.model = None
+        self.load_model()
+
+    def load_model(self):
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"Model not found: {self.model_path}")
+        from ultralytics import YOLO
+        if self.backend == "torch":
+            import torch
+            device = get_device()
+            self.model = YOLO(self.model_path).to(device)
+            if self.threads:
+                torch.set_num_threads(self.threads)
+            logger.info(f"✅ YOLO loaded on {device.upper()}: {self.model_path}")
+            return
+
+        imgsz = max(self.imgsz) if isinstance(self.imgsz, (tuple, list)) else self.imgsz
+        artifact = export_model(self.model_path, self.backend, self.int8, imgsz=imgsz)
+        self.model = YOLO(artifact, task=exported_task(artifact))
+        # The runtime session only exists after the first prediction
+        self.warmup()
+        if self.backend == "onnx" and self.threads:
+            self._tune_onnx_session(artifact)
+        logger.info(f"✅ YOLO loaded with {self.backend}{' INT8' if self.int8 else ''}: {artifact}")
+
+    def _tune_onnx_session(self, artifact: str):
+        """
+        Ultralytics creates the ONNX Runtime session with default options
+        (one intra-op thread per core, per process): recreate it with our
+        thread budget so several detectors on a node do not oversubscribe.
+        """
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        backend = self.model.predictor.model
+        try:
+            backend.session = onnxruntime.InferenceSession(artifact, options, providers=["CPUExecutionProvider"])
+        except Exception as e:
+            logger.warning(f"⚠️ ONNX Runtime thread tuning skipped for {artifact}: {e}")
+
+    def warmup(self, shape=(384, 640, 3)):
+        """One prediction on a black frame: allocations, kernel selection, lazy runtime sessions."""
+        self.predict([np.zeros(shape, np.uint8)])
+
+    @property
+    def names(self):
+        return self.model.names if hasattr(self.model, "names") else None
+
+    def predict(self, frames: Sequence[np.ndarray], conf_threshold: float = 0.25):
+        """One forward pass over a batch of frames (sizes may differ, they are letterboxed)."""
+        return self.model.predict(
+            source=list(frames),
+            save=False,
+            conf=conf_threshold,
+            device=get_device() if self.backend == "torch" else "cpu",
+            imgsz=self.imgsz,
+            verbose=False
+        )
+
+    def detect(self, frame: np.ndarray, conf_threshold: float = 0.25):
+        try:
+            results = self.predict([frame], conf_threshold)
+            detections = []
+            for result in results:
+                detections.extend(detections_from_result(result, self.names))
+            return detections, results
+        except Exception as e:
+            logger.error(f"❌ YOLO detect() error: {e}")
+            return [], None
+
+    def detect_batch(self, frames: Sequence[np.ndarray], conf_threshold: float = 0.25) -> List[List[Dict]]:
+        """Detections for each frame of the batch, in order."""
+        if not frames:
+            return []
+        results = self.predict(frames, conf_threshold)
+        return [detections_from_result(result, self.names) for result in results]
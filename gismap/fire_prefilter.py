@@ -0,0 +1,150 @@
+# ============================================================================
+# FIRE_PREFILTER.PY - Cheap colour / flicker stage ahead of fire YOLO and CLIP
+# Cascade of the fire pipeline (gismap/tasks/fire_clip_tasks.py):
+#     1. pre-filter   flame-coloured pixels on a downscaled frame (HSV range
+#                     and R >= G >= B), and flicker: the brightness of those
+#                     pixels keeps changing from frame to frame, unlike a red
+#                     car or a sunset. Fully vectorized in OpenCV/NumPy.
+#     2. fire YOLO    on candidate frames only
+#     3. CLIP         only to confirm YOLO fire boxes (alert when confirmed)
+# Pass rates of each stage are counted per camera at stats:fire_cascade:{camera_id}.
+# ============================================================================
+import logging
+from typing import Dict, Iterable, Optional
+
+import cv2
+import numpy as np
+import redis
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+STATS_KEY = "stats:fire_cascade:{camera_id}"
+
+# Counters of the cascade, in order: each stage only sees what the previous one passed
+STAGES = ("frames", "prefilter", "yolo", "clip_confirmed")
+
+
+class FirePrefilter:
+    """
+    Per-camera colour + flicker pre-filter.
+
+    update(frame) returns a dict:
+        candidate     True when the frame should go to the fire YOLO
+        flame_ratio   fraction of flame-coloured pixels (downscaled)
+        flicker       fraction of those pixels whose brightness flickers
+    """
+
+    def __init__(self, min_flame_ratio: float = 0.0005, min_flicker: float = 0.1,
+                 downscale_width: int = 160, hue_max: int = 35, min_saturation: int = 80,
+                 min_value: int = 150, flicker_threshold: float = 12.0, alpha: float = 0.3,
+                 hold_frames: int = 10, max_skipped_frames: int = 50):
+        self.min_flame_ratio = min_flame_ratio
+        self.min_flicker = min_flicker
+        self.downscale_width = downscale_width
+        # OpenCV hue is 0..180: red / orange / yellow, plus the red wrap-around above 180 - hue_max / 2
+        self.hue_max = hue_max
+        self.min_saturation = min_saturation
+        self.min_value = min_value
+        # Mean absolute brightness change (running average) above which a pixel flickers
+        self.flicker_threshold = flicker_threshold
+        self.alpha = alpha
+        # Keep passing frames for a while after a candidate, so tracks are not cut
+        self.hold_frames = hold_frames
+        # Send a frame to YOLO at least every N frames (smoke without visible flames)
+        self.max_skipped_frames = max_skipped_frames
+
+        self.roi_mask: Optional[np.ndarray] = None
+        self._small_roi: Optional[np.ndarray] = None
+        self._previous: Optional[np.ndarray] = None
+        self._change: Optional[np.ndarray] = None
+        self._hold = 0
+        self._skipped = 0
+
+    def _prepare(self, frame: np.ndarray) -> np.ndarray:
+        h, w = frame.shape[:2]
+        small_h = max(int(h * self.downscale_width / w), 1)
+        return cv2.resize(frame, (self.downscale_width, small_h), interpolation=cv2.INTER_AREA)
+
+    def flame_mask(self, small: np.ndarray) -> np.ndarray:
+        """uint8 0/1 mask of flame-coloured pixels of a BGR image."""
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        low = cv2.inRange(hsv, (0, self.min_saturation, self.min_value), (self.hue_max, 255, 255))
+        wrap = cv2.inRange(hsv, (180 - self.hue_max // 2, self.min_saturation, self.min_value), (180, 255, 255))
+        b, g, r = cv2.split(small)
+        mask = (low | wrap) & ((r >= g) & (g >= b)).astype(np.uint8) * 255
+        if self.roi_mask is not None:
+            if self._small_roi is None or self._small_roi.shape != mask.shape:
+                self._small_roi = cv2.resize(self.roi_mask, (mask.shape[1], mask.shape[0]),
+                                             interpolation=cv2.INTER_NEAREST)
+            mask &= self._small_roi * 255
+        return (mask > 0).astype(np.uint8)
+
+    def update(self, frame: np.ndarray) -> Dict:
+        small = self._prepare(frame)
+        mask = self.flame_mask(small)
+        value = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)[:, :, 2].astype(np.float32)
+        flame_ratio = float(mask.mean())
+
+        if self._previous is None or self._previous.shape != value.shape:
+            # No history yet: colour alone decides
+            self._previous = value
+            self._change = np.zeros_like(value)
+            flicker = 1.0
+        else:
+            cv2.accumulateWeighted(cv2.absdiff(value, self._previous), self._change, self.alpha)
+            self._previous = value
+            flame_pixels = int(mask.sum())
+            flickering = int(np.count_nonzero((self._change > self.flicker_threshold) & mask.astype(bool)))
+            flicker = flickering / flame_pixels if flame_pixels else 0.0
+
+        candidate = flame_ratio >= self.min_flame_ratio and flicker >= self.min_flicker
+        if candidate:
+            self._hold = self.hold_frames
+        elif self._hold > 0:
+            self._hold -= 1
+            candidate = True
+        if candidate:
+            self._skipped = 0
+        else:
+            self._skipped += 1
+            if self._skipped >= self.max_skipped_frames:
+                # Periodic YOLO pass so smoke-only scenes are not missed
+                self._skipped = 0
+                candidate = True
+        return {"candidate": candidate, "flame_ratio": flame_ratio, "flicker": flicker}
+
+
+# ============================================================================
+# Pass rate reporting
+# ============================================================================
+def record_cascade_stats(camera_id, prefilter: bool, yolo: bool = False, clip_confirmed: bool = False):
+    key = STATS_KEY.format(camera_id=camera_id)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hincrby(key, "frames", 1)
+        for stage, passed in (("prefilter", prefilter), ("yolo", yolo), ("clip_confirmed", clip_confirmed)):
+            if passed:
+                pipe.hincrby(key, stage, 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"[{camera_id}] Redis fire cascade stats error: {e}")
+
+
+def get_cascade_stats(camera_ids: Iterable) -> Dict:
+    """
+    {camera_id: counts of STAGES plus pass rates}: each rate is the share of
+    the previous stage's frames that passed this one.
+    """
+    camera_ids = list(camera_ids)
+    pipe = redis_client.pipeline(transaction=False)
+    for camera_id in camera_ids:
+        pipe.hgetall(STATS_KEY.format(camera_id=camera_id))
+    stats = {}
+    for camera_id, raw in zip(camera_ids, pipe.execute()):
+        counts = {stage: int(raw.get(stage.encode(), 0)) for stage in STAGES}
+        for previous, stage in zip(STAGES, STAGES[1:]):
+            counts[f"{stage}_pass_rate"] = round(counts[stage] / counts[previous], 3) if counts[previous] else 0.0
+        stats[camera_id] = counts
+    return stats
@@ -0,0 +1,378 @@
+# ============================================================================
+# FRAME_BUFFER.PY - Per-camera shared-memory ring buffer of raw BGR frames
+# The ingest process writes decoded frames once; same-host consumers
+# (YOLO, fire, ...) read zero-copy NumPy views instead of decoding JPEG
+# from Redis. JPEG is only produced when a consumer asks for it.
+# One ring per pyramid level (full / detect / thumb, see frame_bus.py).
+# ============================================================================
+import logging
+import os
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+import redis
+
+from gismap.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Redis client (JPEG fallback + "JPEG wanted" flags)
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+MAGIC = 0x53564652  # "SVFR"
+VERSION = 1
+HEADER_FIELDS = 8   # magic, version, slots, height, width, channels, write_seq, generation
+DEFAULT_SLOTS = 8
+# Readers check at most this often whether the writer recreated the segment
+REATTACH_INTERVAL = 1.0
+
+# Pyramid levels: full decode (kept briefly, for crops), detector input, grid thumbnail
+LEVEL_FULL = "full"
+LEVEL_DETECT = "detect"
+LEVEL_THUMB = "thumb"
+DEFAULT_LEVEL = LEVEL_DETECT
+
+# Keys shared with the ingest side (DEFAULT_LEVEL; other levels get a ":{level}" suffix)
+JPEG_KEY = "camera:{camera_id}:frame"
+JPEG_META_KEY = "camera:{camera_id}:frame_meta"   # "seq:timestamp" of the JPEG above
+JPEG_WANTED_KEY = "camera:{camera_id}:jpeg_wanted"
+
+
+def shm_name(camera_id, level: str = DEFAULT_LEVEL) -> str:
+    return f"smartvision_cam_{camera_id}_{level}"
+
+
+def jpeg_keys(camera_id, level: str = DEFAULT_LEVEL) -> Tuple[str, str, str]:
+    """(frame, meta, wanted) Redis keys of the JPEG published for a pyramid level."""
+    suffix = "" if level == DEFAULT_LEVEL else f":{level}"
+    return (JPEG_KEY.format(camera_id=camera_id) + suffix,
+            JPEG_META_KEY.format(camera_id=camera_id) + suffix,
+            JPEG_WANTED_KEY.format(camera_id=camera_id) + suffix)
+
+
+def _untrack(shm: shared_memory.SharedMemory):
+    """
+    Readers must not let the resource tracker unlink the writer's segment
+    when they exit (Python < 3.13 registers every attach).
+    """
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+# ============================================================================
+# Ring buffer
+# ============================================================================
+class FrameRingBuffer:
+    """
+    Fixed-size ring of `slots` frames of shape (height, width, channels).
+
+    Layout of the segment:
+        int64[HEADER_FIELDS]   header
+        int64[slots]           sequence number stored in each slot (-1 while written)
+        float64[slots]         capture timestamp of each slot
+        uint8[slots, h, w, c]  pixel data
+
+    Sequence numbers start at 1 and only grow; slot = seq % slots.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        if header[0] != MAGIC or header[1] != VERSION:
+            raise ValueError(f"Segment {shm.name} is not a frame ring buffer")
+
+        self.slots = int(header[2])
+        self.shape = (int(header[3]), int(header[4]), int(header[5]))
+        # Creation id: a restarted writer recreates the segment under the same name
+        self.generation = int(header[7])
+        self._header = header
+        self.checked_at = time.monotonic()
+
+        offset = HEADER_FIELDS * 8
+        self._slot_seq = np.ndarray((self.slots,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self.slots * 8
+        self._slot_ts = np.ndarray((self.slots,), dtype=np.float64, buffer=shm.buf, offset=offset)
+        offset += self.slots * 8
+        self._data = np.ndarray((self.slots,) + self.shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+
+    # ------------------------------------------------------------------
+    # Construction
+    # ------------------------------------------------------------------
+    @staticmethod
+    def segment_size(width: int, height: int, channels: int, slots: int) -> int:
+        return HEADER_FIELDS * 8 + slots * 16 + slots * width * height * channels
+
+    @classmethod
+    def create(cls, camera_id, width: int, height: int, channels: int = 3,
+               slots: int = DEFAULT_SLOTS, name: Optional[str] = None) -> "FrameRingBuffer":
+        """Create (or recreate) the segment for a camera. Called by the writer only."""
+        name = name or shm_name(camera_id)
+        size = cls.segment_size(width, height, channels, slots)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Leftover from a crashed writer: drop it and start clean
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        generation = int.from_bytes(os.urandom(7), "little")
+        header[:] = (MAGIC, VERSION, slots, height, width, channels, 0, generation)
+        ring = cls(shm, owner=True)
+        ring._slot_seq[:] = 0
+        ring._slot_ts[:] = 0.0
+        logger.info(f"[{camera_id}] Frame ring buffer created: {name} ({slots}x{width}x{height}x{channels})")
+        return ring
+
+    @classmethod
+    def attach(cls, camera_id, name: Optional[str] = None) -> Optional["FrameRingBuffer"]:
+        """Attach to an existing segment. Returns None if the camera has no local writer."""
+        name = name or shm_name(camera_id)
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return None
+        _untrack(shm)
+        try:
+            return cls(shm, owner=False)
+        except ValueError as e:
+            logger.error(f"❌ {e}")
+            shm.close()
+            return None
+
+    # ------------------------------------------------------------------
+    # Writer side
+    # ------------------------------------------------------------------
+    def write(self, frame: np.ndarray, timestamp: Optional[float] = None, seq: Optional[int] = None) -> int:
+        """
+        Copy one frame into the next slot and publish it. Returns its sequence
+        number (`seq` forces it, so all pyramid levels share the same numbers).
+        """
+        return self._write(lambda slot: self._data.__setitem__(slot, frame), timestamp, seq)
+
+    def write_resized(self, frame: np.ndarray, timestamp: Optional[float] = None, seq: Optional[int] = None,
+                      interpolation: int = cv2.INTER_AREA) -> int:
+        """Resize `frame` straight into the next slot (no intermediate array)."""
+        height, width = self.shape[:2]
+
+        def fill(slot):
+            cv2.resize(frame, (width, height), dst=self._data[slot], interpolation=interpolation)
+        return self._write(fill, timestamp, seq)
+
+    def _write(self, fill, timestamp: Optional[float], seq: Optional[int]) -> int:
+        seq = int(self._header[6]) + 1 if seq is None else seq
+        slot = seq % self.slots
+        self._slot_seq[slot] = -1          # mark slot as being written
+        fill(slot)
+        self._slot_ts[slot] = timestamp if timestamp is not None else time.time()
+        self._slot_seq[slot] = seq
+        self._header[6] = seq
+        return seq
+
+    def write_bytes(self, raw: bytes, timestamp: Optional[float] = None) -> int:
+        """Same as write() for a raw bgr24 buffer straight from ffmpeg."""
+        return self.write(np.frombuffer(raw, np.uint8).reshape(self.shape), timestamp)
+
+    # ------------------------------------------------------------------
+    # Reader side
+    # ------------------------------------------------------------------
+    @property
+    def latest_seq(self) -> int:
+        return int(self._header[6])
+
+    def is_valid(self, seq: int) -> bool:
+        """True while the slot still holds frame `seq` (i.e. it was not overwritten)."""
+        return seq > 0 and int(self._slot_seq[seq % self.slots]) == seq
+
+    def read(self, seq: Optional[int] = None, copy: bool = False) -> Optional[Tuple[int, float, np.ndarray]]:
+        """
+        Return (seq, timestamp, frame) for `seq` (default: latest frame).
+
+        With copy=False the frame is a zero-copy view into shared memory: it is
+        only guaranteed until the writer wraps around (`slots` frames later),
+        check is_valid(seq) after use if that matters. With copy=True the frame
+        is a private copy, validated against concurrent writes.
+        """
+        seq = self.latest_seq if seq is None else seq
+        if not self.is_valid(seq):
+            return None
+        slot = seq % self.slots
+        ts = float(self._slot_ts[slot])
+        frame = self._data[slot]
+        if copy:
+            frame = frame.copy()
+            if not self.is_valid(seq):
+                return None
+        return seq, ts, frame
+
+    def close(self):
+        # Drop our views before releasing the mapping
+        self._header = self._slot_seq = self._slot_ts = self._data = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# ============================================================================
+# Reader helpers (one attached segment per camera, level and process)
+# When the writer restarts (ffmpeg restart, new source size) it unlinks the
+# segment and creates a new one under the same name: the old mapping stays
+# valid but never receives frames again. Readers compare the generation in
+# the header with the named segment's, every REATTACH_INTERVAL seconds or
+# as soon as a requested seq is missing, and re-attach when it changed.
+# ============================================================================
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def _reattach(key, ring: FrameRingBuffer) -> Optional[FrameRingBuffer]:
+    ring.checked_at = time.monotonic()
+    fresh = FrameRingBuffer.attach(key[0], name=shm_name(*key))
+    if fresh is None:
+        # Writer gone: nothing new will come, drop the stale mapping
+        del _readers[key]
+        return None
+    if fresh.generation == ring.generation:
+        fresh.close()
+        return ring
+    logger.info(f"[{key[0]}] Frame ring {shm_name(*key)} recreated by the writer, re-attached")
+    # The old mapping is not closed here: other threads may still hold
+    # zero-copy views into it; it is released once they are gone
+    _readers[key] = fresh
+    return fresh
+
+
+def get_reader(camera_id, level: str = DEFAULT_LEVEL, seq: Optional[int] = None) -> Optional[FrameRingBuffer]:
+    """Attached ring of a camera / level; `seq` is the frame about to be read."""
+    key = (camera_id, level)
+    with _readers_lock:
+        ring = _readers.get(key)
+        if ring is None:
+            ring = FrameRingBuffer.attach(camera_id, name=shm_name(camera_id, level))
+            if ring is not None:
+                _readers[key] = ring
+            return ring
+        # A frame newer than anything this mapping saw was written to a new segment;
+        # older missing frames (consumer lagging) only trigger the periodic check
+        newer = seq is not None and seq > ring.latest_seq
+        if newer or time.monotonic() - ring.checked_at >= REATTACH_INTERVAL:
+            return _reattach(key, ring)
+        return ring
+
+
+def release_reader(camera_id):
+    with _readers_lock:
+        rings = [_readers.pop(key) for key in list(_readers) if key[0] == camera_id]
+    for ring in rings:
+        ring.close()
+
+
+def request_jpeg(camera_id, ttl: int = 5, level: str = DEFAULT_LEVEL):
+    """Tell the ingest side that someone needs JPEG frames of this level for this camera."""
+    try:
+        redis_client.set(jpeg_keys(camera_id, level)[2], 1, ex=ttl)
+    except redis.RedisError as e:
+        logger.error(f"[{camera_id}] Redis JPEG request error: {e}")
+
+
+def read_latest_frame(camera_id, copy: bool = False,
+                      level: str = DEFAULT_LEVEL) -> Optional[Tuple[int, float, np.ndarray]]:
+    """
+    Latest frame of a camera as (seq, timestamp, frame).
+
+    Uses the local shared-memory ring when the ingest runs on this host,
+    otherwise falls back to the JPEG published in Redis (and asks for it).
+    """
+    ring = get_reader(camera_id, level)
+    if ring is not None:
+        result = ring.read(copy=copy)
+        if result is not None:
+            return result
+
+    request_jpeg(camera_id, level=level)
+    jpeg_bytes, meta = redis_client.mget(*jpeg_keys(camera_id, level)[:2])
+    if not jpeg_bytes:
+        return None
+    frame = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        return None
+    seq, ts = parse_jpeg_meta(meta)
+    return seq, ts, frame
+
+
+def parse_jpeg_meta(meta) -> Tuple[int, float]:
+    """(seq, timestamp) from a JPEG_META_KEY value; seq 0 means "unknown"."""
+    try:
+        seq, ts = meta.decode().split(":")
+        return int(seq), float(ts)
+    except (AttributeError, ValueError):
+        return 0, time.time()
+
+
+# ============================================================================
+# Writer helper: JPEG only for consumers that asked for it
+# ============================================================================
+class JpegPublisher:
+    """Encodes and SETs JPEG frames only while a consumer flagged interest."""
+
+    def __init__(self, camera_id, check_interval: float = 1.0, quality: int = 80, level: str = DEFAULT_LEVEL):
+        self.camera_id = camera_id
+        self.level = level
+        self.key, self.meta_key, self.wanted_key = jpeg_keys(camera_id, level)
+        self.check_interval = check_interval
+        self.params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        self._wanted = False
+        self._checked_at = 0.0
+
+    def wanted(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            try:
+                self._wanted = bool(redis_client.exists(self.wanted_key))
+            except redis.RedisError:
+                self._wanted = False
+        return self._wanted
+
+    def set_wanted(self, wanted: bool):
+        """Set the flag from a batched check (see frame_bus.refresh_jpeg_interest)."""
+        self._wanted = wanted
+        self._checked_at = time.monotonic()
+
+    def encode(self, frame: np.ndarray) -> Optional[bytes]:
+        ret, buffer = cv2.imencode(".jpg", frame, self.params)
+        if not ret:
+            logger.error(f"[{self.camera_id}] JPEG encoding failed")
+            return None
+        return buffer.tobytes()
+
+    def publish(self, frame: np.ndarray, seq: int = 0, timestamp: Optional[float] = None) -> bool:
+        if not self.wanted():
+            return False
+        jpeg_bytes = self.encode(frame)
+        if jpeg_bytes is None:
+            return False
+        self.publish_encoded(jpeg_bytes, seq, timestamp)
+        return True
+
+    def publish_encoded(self, jpeg_bytes: bytes, seq: int = 0, timestamp: Optional[float] = None):
+        """Store an already encoded JPEG (MJPEG passthrough) with its sequence number."""
+        timestamp = timestamp if timestamp is not None else time.time()
+        with timed("redis_set", self.camera_id):
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.set(self.key, jpeg_bytes, ex=5)
+            pipe.set(self.meta_key, f"{seq}:{timestamp}", ex=5)
+            pipe.execute()
@@ -0,0 +1,369 @@
+# ============================================================================
+# FRAME_BUS.PY - Single place where ingest publishes camera frames
+# Both the asyncio ingest supervisor and the legacy stream_camera task go
+# through FramePublisher, so consumers only depend on this module.
+#
+# Frames are decoded once and published as a small pyramid, one ring per level:
+#     full    decode resolution, few slots (crops: OCR plates, ...)
+#     detect  640x384 detector input
+#     thumb   320x192 for the camera grid
+# All levels share the sequence number of the frame, consumers pick the
+# level they need.
+#
+# Every frame is announced on a capped per-camera Redis Stream
+# (camera:{id}:frames, XADD MAXLEN ~). An entry carries the sequence number,
+# the capture timestamp and the frame itself or a reference to it:
+#     ref=shm:<name>   raw pixels in the local shared-memory ring
+#     jpeg=<bytes>     JPEG (MJPEG passthrough, or embed_jpeg for remote hosts)
+# Analytics read through consumer groups (one group per analytic), so each
+# analytic sees each frame once and scaled-out workers share the load.
+# ============================================================================
+import collections
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import cv2
+import numpy as np
+import redis
+
+from gismap.frame_buffer import (
+    DEFAULT_LEVEL, LEVEL_DETECT, LEVEL_FULL, LEVEL_THUMB,
+    FrameRingBuffer, JpegPublisher, get_reader, shm_name,
+)
+from gismap.metrics import count, timed
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+STREAM_KEY = "camera:{camera_id}:frames"
+DEFAULT_MAXLEN = 100
+
+# (width, height) of the downscaled levels; LEVEL_FULL is the ingest size
+PYRAMID_LEVELS = {
+    LEVEL_DETECT: (640, 384),
+    LEVEL_THUMB: (320, 192),
+}
+FULL_SLOTS = 4   # full resolution is large and only needed right after detection
+
+
+# ============================================================================
+# Publisher
+# ============================================================================
+class FramePublisher:
+    """
+    Publishes the frames of one camera.
+
+    output_format="rawvideo": frames are pixels (width x height = full level),
+    written to one shared-memory ring per pyramid level; JPEG is encoded only
+    on demand, per level (or the detect level for every frame with
+    embed_jpeg, for analytics running on another host).
+    output_format="mjpeg": ffmpeg already produced JPEG, it is stored as-is
+    for every level and nothing here touches pixels (no ring buffer).
+    """
+
+    def __init__(self, camera_id, width: int, height: int, output_format: str = "rawvideo",
+                 maxlen: int = DEFAULT_MAXLEN, embed_jpeg: bool = False,
+                 levels: Optional[Dict[str, tuple]] = None, full_slots: int = FULL_SLOTS):
+        self.camera_id = camera_id
+        self.width = width
+        self.height = height
+        self.output_format = output_format
+        self.frame_size = width * height * 3
+        self.stream_key = STREAM_KEY.format(camera_id=camera_id)
+        self.maxlen = maxlen
+        self.embed_jpeg = embed_jpeg
+        self.levels = dict(PYRAMID_LEVELS if levels is None else levels)
+
+        self.rings: Dict[str, FrameRingBuffer] = {}
+        if output_format == "rawvideo":
+            self.rings[LEVEL_FULL] = FrameRingBuffer.create(camera_id, width, height, slots=full_slots,
+                                                            name=shm_name(camera_id, LEVEL_FULL))
+            for level, (level_width, level_height) in self.levels.items():
+                self.rings[level] = FrameRingBuffer.create(camera_id, level_width, level_height,
+                                                           name=shm_name(camera_id, level))
+        self.ring = self.rings.get(LEVEL_FULL)
+        self.jpegs = {level: JpegPublisher(camera_id, level=level) for level in (LEVEL_FULL, *self.levels)}
+        self.jpeg = self.jpegs.get(DEFAULT_LEVEL) or JpegPublisher(camera_id)
+        self.frames_published = 0
+        self._seq = 0
+
+    def _announce(self, seq: int, timestamp: float, jpeg_bytes: Optional[bytes] = None):
+        fields = {"seq": seq, "ts": repr(timestamp), "w": self.width, "h": self.height}
+        if self.rings:
+            fields["ref"] = "shm"
+            fields["levels"] = ",".join(self.rings)
+        if jpeg_bytes is not None:
+            fields["jpeg"] = jpeg_bytes
+        try:
+            with timed("redis_xadd", self.camera_id):
+                redis_client.xadd(self.stream_key, fields, maxlen=self.maxlen, approximate=True)
+        except redis.RedisError as e:
+            logger.error(f"[{self.camera_id}] Frame bus XADD error: {e}")
+
+    def publish(self, frame: np.ndarray, timestamp: Optional[float] = None) -> int:
+        timestamp = timestamp if timestamp is not None else time.time()
+        self._seq += 1
+        seq = self._seq
+        self.rings[LEVEL_FULL].write(frame, timestamp, seq)
+        for level in self.levels:
+            self.rings[level].write_resized(frame, timestamp, seq)
+
+        embedded = None
+        for level, jpeg in self.jpegs.items():
+            embed = self.embed_jpeg and level == DEFAULT_LEVEL
+            wanted = jpeg.wanted()
+            if not (wanted or embed):
+                continue
+            # Encode from the ring slot just written: no second resize
+            with timed("jpeg_encode", self.camera_id):
+                jpeg_bytes = jpeg.encode(self.rings[level].read(seq)[2])
+            if wanted and jpeg_bytes is not None:
+                jpeg.publish_encoded(jpeg_bytes, seq, timestamp)
+            if embed:
+                embedded = jpeg_bytes
+
+        self._announce(seq, timestamp, embedded)
+        self.frames_published += 1
+        count("frames_published", self.camera_id)
+        return seq
+
+    def publish_raw(self, raw_frame: bytes, timestamp: Optional[float] = None) -> int:
+        """Publish a raw bgr24 buffer as read from ffmpeg."""
+        frame = np.frombuffer(raw_frame, np.uint8).reshape((self.height, self.width, 3))
+        return self.publish(frame, timestamp)
+
+    def publish_jpeg(self, jpeg_bytes: bytes, timestamp: Optional[float] = None) -> int:
+        """Publish a JPEG straight from ffmpeg (MJPEG passthrough, no decode)."""
+        timestamp = timestamp if timestamp is not None else time.time()
+        self._seq += 1
+        # Every level gets the same image: resizing would need a decode
+        self.jpeg.publish_encoded(jpeg_bytes, self._seq, timestamp)
+        for jpeg in self.jpegs.values():
+            if jpeg is not self.jpeg and jpeg.wanted():
+                jpeg.publish_encoded(jpeg_bytes, self._seq, timestamp)
+        self._announce(self._seq, timestamp, jpeg_bytes)
+        self.frames_published += 1
+        count("frames_published", self.camera_id)
+        return self._seq
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+
+
+def refresh_jpeg_interest(publishers: Iterable[FramePublisher]):
+    """
+    Check the "JPEG wanted" flags of many cameras in one round trip, so a
+    supervisor with hundreds of cameras does not hit Redis once per camera.
+    """
+    publishers = list(publishers)
+    if not publishers:
+        return
+    jpegs = [jpeg for publisher in publishers for jpeg in publisher.jpegs.values()]
+    pipe = redis_client.pipeline(transaction=False)
+    for jpeg in jpegs:
+        pipe.exists(jpeg.wanted_key)
+    try:
+        flags = pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"❌ Redis JPEG interest refresh error: {e}")
+        return
+    for jpeg, flag in zip(jpegs, flags):
+        jpeg.set_wanted(bool(flag))
+
+
+# ============================================================================
+# Consumer
+# ============================================================================
+def default_consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+
+
+class FrameBusConsumer:
+    """
+    Reads the frames of one camera through a consumer group.
+
+    All workers using the same `group` share the stream: each entry is
+    delivered to one of them. Entries left pending by a dead worker are
+    reclaimed after `claim_idle_ms`. Frames are returned at pyramid `level`;
+    read_level() fetches another level of the same frame (e.g. full
+    resolution crops).
+    """
+
+    def __init__(self, camera_id, group: str, consumer: Optional[str] = None,
+                 block_ms: int = 1000, claim_idle_ms: int = 30000, level: str = DEFAULT_LEVEL):
+        self.camera_id = camera_id
+        self.group = group
+        self.level = level
+        self.consumer = consumer or default_consumer_name()
+        self.stream_key = STREAM_KEY.format(camera_id=camera_id)
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.dropped = 0
+        self.skipped = 0
+        self._last_claim = 0.0
+        self._pending = collections.deque()
+        self.ensure_group()
+
+    def ensure_group(self):
+        try:
+            # "$": a new analytic starts with the next frame, not the backlog
+            redis_client.xgroup_create(self.stream_key, self.group, id="$", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def _claim_stale(self) -> List:
+        now = time.monotonic()
+        if now - self._last_claim < self.claim_idle_ms / 1000:
+            return []
+        self._last_claim = now
+        try:
+            _, entries, *_ = redis_client.xautoclaim(
+                self.stream_key, self.group, self.consumer,
+                min_idle_time=self.claim_idle_ms, start_id="0-0", count=10,
+            )
+        except redis.ResponseError:
+            return []
+        return [e for e in entries if e and e[1]]
+
+    def _decode(self, fields: Dict) -> Optional[Dict]:
+        seq = int(fields.get(b"seq", 0))
+        frame = None
+        source = "shm"
+        if fields.get(b"ref") == b"shm":
+            frame = self._from_ring(seq, self.level)
+        if frame is None and b"jpeg" in fields:
+            source = "jpeg"
+            # Remote host or MJPEG passthrough: single image, resized to the level
+            with timed("jpeg_decode", self.camera_id):
+                frame = cv2.imdecode(np.frombuffer(fields[b"jpeg"], np.uint8), cv2.IMREAD_COLOR)
+            if frame is not None and self.level in PYRAMID_LEVELS:
+                size = PYRAMID_LEVELS[self.level]
+                if (frame.shape[1], frame.shape[0]) != size:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if frame is None:
+            return None
+        return {"seq": seq, "timestamp": float(fields.get(b"ts", 0)), "frame": frame,
+                "level": self.level, "source": source}
+
+    def _from_ring(self, seq: int, level: str, copy: bool = False) -> Optional[np.ndarray]:
+        ring = get_reader(self.camera_id, level, seq)
+        result = ring.read(seq, copy=copy) if ring is not None else None
+        return result[2] if result is not None else None
+
+    def read_level(self, entry: Dict, level: str, copy: bool = True) -> Optional[np.ndarray]:
+        """
+        Same frame as `entry` at another pyramid level, or None when it is not
+        available (remote host, or the full level already wrapped around).
+        """
+        if level == entry.get("level"):
+            return entry["frame"]
+        return self._from_ring(entry["seq"], level, copy=copy)
+
+    def _skip_to_latest(self, backlog: int = 1000):
+        """Keep only the newest announced frame; older ones are acknowledged unprocessed."""
+        try:
+            response = redis_client.xreadgroup(
+                self.group, self.consumer, {self.stream_key: ">"}, count=backlog)
+        except redis.ResponseError:
+            return
+        if response:
+            self._pending.extend(response[0][1])
+        skipped = []
+        while len(self._pending) > 1:
+            skipped.append(self._pending.popleft()[0])
+        if skipped:
+            self.skipped += len(skipped)
+            count("frames_skipped", self.camera_id, value=len(skipped))
+            try:
+                redis_client.xack(self.stream_key, self.group, *skipped)
+            except redis.RedisError as e:
+                logger.error(f"[{self.camera_id}] Frame bus XACK error: {e}")
+
+    def read(self, latest: bool = False) -> Optional[Dict]:
+        """
+        Next frame for this consumer as {"id", "seq", "timestamp", "frame"}, or
+        None after block_ms without frames. Call ack(entry["id"]) once processed.
+        latest=True skips straight to the newest frame (consumers running
+        slower than the camera on purpose, see budget.py).
+        """
+        if not self._pending:
+            self._pending.extend(self._claim_stale())
+        if latest:
+            self._skip_to_latest()
+        if not self._pending:
+            try:
+                response = redis_client.xreadgroup(
+                    self.group, self.consumer, {self.stream_key: ">"},
+                    count=1, block=self.block_ms,
+                )
+            except redis.ResponseError as e:
+                if "NOGROUP" in str(e):
+                    # Stream was deleted (e.g. Redis flushed): recreate the group
+                    self.ensure_group()
+                    return None
+                raise
+            if not response:
+                return None
+            self._pending.extend(response[0][1])
+
+        while self._pending:
+            entry_id, fields = self._pending.popleft()
+            entry = self._decode(fields)
+            if entry is None:
+                # Frame no longer in the ring (we lagged too far) or undecodable
+                self.dropped += 1
+                self.ack(entry_id)
+                continue
+            entry["id"] = entry_id
+            return entry
+        return None
+
+    def ack(self, entry_id):
+        try:
+            redis_client.xack(self.stream_key, self.group, entry_id)
+        except redis.RedisError as e:
+            logger.error(f"[{self.camera_id}] Frame bus XACK error: {e}")
+
+    def close(self):
+        """
+        Remove this consumer from the group when the task exits. A consumer
+        that still holds unacknowledged frames (task died mid-frame) is kept,
+        so another worker reclaims them (deleting it would drop them).
+        """
+        self._pending.clear()
+        try:
+            consumers = redis_client.xinfo_consumers(self.stream_key, self.group)
+            for consumer in consumers:
+                name = consumer["name"].decode() if isinstance(consumer["name"], bytes) else consumer["name"]
+                if name == self.consumer and not consumer.get("pending"):
+                    redis_client.xgroup_delconsumer(self.stream_key, self.group, self.consumer)
+        except redis.RedisError as e:
+            logger.error(f"[{self.camera_id}] Frame bus consumer cleanup error: {e}")
+
+
+def consumer_lag(camera_id) -> List[Dict]:
+    """
+    Per analytic group: entries not yet delivered (lag, Redis >= 7) and
+    delivered but not acknowledged (pending).
+    """
+    stream_key = STREAM_KEY.format(camera_id=camera_id)
+    try:
+        groups = redis_client.xinfo_groups(stream_key)
+    except redis.ResponseError:
+        return []
+    lag = []
+    for group in groups:
+        lag.append({
+            "group": group["name"].decode() if isinstance(group["name"], bytes) else group["name"],
+            "consumers": group.get("consumers", 0),
+            "pending": group.get("pending", 0),
+            "lag": group.get("lag"),
+        })
+    return lag
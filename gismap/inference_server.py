@@ -0,0 +1,380 @@
+# ============================================================================
+# INFERENCE_SERVER.PY - One process runs the YOLO models for every camera
+# Camera tasks send requests (frame reference + per-model regions, see
+# gismap/schedule.py) on a Redis Stream; the server groups them into
+# micro-batches (max_batch frames, or max_delay_ms after the first one
+# arrived), runs one forward pass per model (best.pt, box.pt,
+# yolov8s-pose.pt) over every requested image and scatters the results
+# back on a per-request reply list.
+# Run it with `python manage.py run_inference`.
+#
+# Frames are referenced in the shared-memory pyramid (seq + level) when every
+# live server runs on the client's host (servers heartbeat their host in
+# inference:servers), and sent as JPEG otherwise.
+# On CPU nodes, `--workers N` runs N servers pinned to disjoint core sets
+# (gismap/worker_pool.py); each reports its frames/s per core.
+# ============================================================================
+import json
+import logging
+import socket
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+import redis
+
+from gismap.detectors import detections_from_result, keypoints_from_result
+from gismap.metrics import count, observe_stage, timed
+from gismap.frame_buffer import get_reader
+from gismap.frame_bus import default_consumer_name
+from gismap.model_registry import registry
+from gismap.worker_pool import ThroughputMeter, available_cores
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+REQUEST_STREAM = "inference:requests"
+REQUEST_GROUP = "inference-server"
+REPLY_KEY = "inference:reply:{request_id}"
+STATS_KEY = "stats:inference"
+SERVERS_KEY = "inference:servers"  # consumer -> JSON {"host", "ts"} of the live servers
+SERVER_TTL = 15.0
+
+DEFAULT_MODELS = ("best", "box", "pose")
+MODEL_CONF = {"best": 0.25, "box": 0.25, "pose": 0.5}
+
+
+def offset_detections(detections: List[Dict], dx: int, dy: int) -> List[Dict]:
+    for det in detections:
+        x1, y1, x2, y2 = det["bbox"]
+        det["bbox"] = (x1 + dx, y1 + dy, x2 + dx, y2 + dy)
+    return detections
+
+
+def model_images(frame: np.ndarray, regions: Optional[List]) -> List:
+    """[(image, (dx, dy))] for a model: the full frame (regions None) or one crop per region."""
+    if regions is None:
+        return [(frame, (0, 0))]
+    return [(frame[y1:y2, x1:x2], (x1, y1)) for x1, y1, x2, y2 in regions if x2 > x1 and y2 > y1]
+
+
+def run_models(detectors: Dict, requests: List[Dict]):
+    """
+    One forward pass per model over every image of every request.
+    A request is {"frame", "regions": {model: regions or None}, "results": {}, "error"};
+    results are in frame coordinates, crops of one request are concatenated.
+    """
+    for name, detector in detectors.items():
+        batch = [(r, image, offset) for r in requests if r["error"] is None and name in r["regions"]
+                 for image, offset in model_images(r["frame"], r["regions"][name])]
+        for r in requests:
+            if r["error"] is None and name in r["regions"]:
+                r["results"][name] = []
+        if not batch:
+            continue
+        try:
+            # Batch spans cameras: timed per model only, images counted per camera below
+            with timed("inference_batch", model=name):
+                results = detector.predict([image for _, image, _ in batch], MODEL_CONF.get(name, 0.25))
+        except Exception as e:
+            logger.error(f"❌ Batched {name} inference error ({len(batch)} images): {e}")
+            for r, _, _ in batch:
+                r["error"] = str(e)
+            continue
+
+        for (r, _, (dx, dy)), result in zip(batch, results):
+            count("inference_images", r.get("camera_id"), name)
+            if name == "pose":
+                # Undetected keypoints are (0, 0) and stay so: only visible ones move to frame coordinates
+                r["results"][name].extend([[x + dx, y + dy] if x or y else [x, y] for x, y in person]
+                                          for person in keypoints_from_result(result))
+            else:
+                r["results"][name].extend(offset_detections(detections_from_result(result, detector.names), dx, dy))
+
+
+# ============================================================================
+# Client (Celery tasks)
+# ============================================================================
+class InferenceClient:
+    """Sends one frame to the inference server and waits for its results."""
+
+    def __init__(self, timeout: int = 3, maxlen: int = 1000, check_interval: float = 5.0):
+        # Must stay below the client socket_timeout (BLPOP blocks on the socket)
+        self.timeout = timeout
+        self.maxlen = maxlen
+        self.check_interval = check_interval
+        self.host = socket.gethostname()
+        self._local = False
+        self._checked_at = 0.0
+
+    def servers_local(self) -> bool:
+        """
+        True when every live server runs on this host: any of them may take
+        the request (shared consumer group), so all must reach our shared memory.
+        """
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._local
+        self._checked_at = now
+        try:
+            raw = redis_client.hgetall(SERVERS_KEY)
+        except redis.RedisError as e:
+            logger.error(f"Inference servers lookup error: {e}")
+            raw = {}
+        hosts = {state["host"] for state in map(json.loads, raw.values()) if time.time() - state["ts"] <= SERVER_TTL}
+        self._local = hosts == {self.host}
+        return self._local
+
+    def infer(self, camera_id, entry: Dict, frame: Optional[np.ndarray] = None,
+              regions: Optional[Dict] = None) -> Optional[Dict]:
+        """
+        Results as {model: detections} ("pose": keypoints per person), or None
+        when the server did not answer in time. `entry` comes from
+        FrameBusConsumer.read(); `frame` is the local copy, only sent when the
+        server cannot read the shared-memory ring. `regions` maps each model
+        to run to a list of (x1, y1, x2, y2) crops, or None for the full frame.
+        """
+        if regions is None:
+            regions = {name: None for name in DEFAULT_MODELS}
+        request_id = uuid.uuid4().hex
+        fields = {
+            "id": request_id,
+            "camera_id": camera_id,
+            "ts": repr(time.time()),
+            "regions": json.dumps({name: None if boxes is None else [[int(v) for v in box] for box in boxes]
+                                   for name, boxes in regions.items()}),
+        }
+        if entry.get("source") == "shm" and self.servers_local():
+            fields["seq"] = entry["seq"]
+            fields["level"] = entry["level"]
+        else:
+            ok, buffer = cv2.imencode(".jpg", frame if frame is not None else entry["frame"])
+            if not ok:
+                logger.error(f"[{camera_id}] JPEG encoding failed for inference request")
+                return None
+            fields["jpeg"] = buffer.tobytes()
+
+        reply_key = REPLY_KEY.format(request_id=request_id)
+        try:
+            redis_client.xadd(REQUEST_STREAM, fields, maxlen=self.maxlen, approximate=True)
+            reply = redis_client.blpop(reply_key, timeout=self.timeout)
+        except redis.RedisError as e:
+            logger.error(f"[{camera_id}] Inference request error: {e}")
+            return None
+        if reply is None:
+            logger.warning(f"[{camera_id}] Inference server did not answer within {self.timeout}s")
+            return None
+        return json.loads(reply[1])
+
+
+# ============================================================================
+# Server
+# ============================================================================
+class InferenceServer:
+    """
+    Micro-batching loop over REQUEST_STREAM. Several servers (one per GPU or
+    node) share the stream through the consumer group.
+    """
+
+    def __init__(self, max_batch: int = 16, max_delay_ms: int = 50, request_ttl: float = 3.0,
+                 consumer: Optional[str] = None, detectors: Optional[Dict] = None,
+                 cores: Optional[List[int]] = None):
+        self.max_batch = max_batch
+        self.max_delay_ms = max_delay_ms
+        # Requests older than this: the client already gave up waiting
+        self.request_ttl = request_ttl
+        self.consumer = consumer or default_consumer_name()
+        # None: the process-wide model registry (loaded and warmed up here, before the first
+        # request, and pinned: a quiet night must not cost a reload on the next frame)
+        self.detectors = detectors
+        if detectors is None:
+            registry.pin(DEFAULT_MODELS)
+            registry.warmup(DEFAULT_MODELS)
+        self.batches = 0
+        self.frames = 0
+        self.meter = ThroughputMeter(self.consumer, cores if cores is not None else available_cores())
+        self.host = socket.gethostname()
+        self._heartbeat_at = 0.0
+        # Entries of a batch whose replies could not be sent (Redis error): acknowledged with the next one
+        self._unacked: List[bytes] = []
+        self._running = False
+        self.ensure_group()
+
+    def get_detectors(self) -> Dict:
+        if self.detectors is not None:
+            return self.detectors
+        return {name: registry.get(name) for name in DEFAULT_MODELS}
+
+    def ensure_group(self):
+        try:
+            redis_client.xgroup_create(REQUEST_STREAM, REQUEST_GROUP, id="$", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    # ------------------------------------------------------------------
+    # Batch collection
+    # ------------------------------------------------------------------
+    def _read(self, count: int, block_ms: int) -> List:
+        response = redis_client.xreadgroup(REQUEST_GROUP, self.consumer, {REQUEST_STREAM: ">"},
+                                           count=count, block=max(block_ms, 1))
+        return response[0][1] if response else []
+
+    def collect(self, idle_block_ms: int = 1000) -> List:
+        """Up to max_batch requests: waits for the first, then at most max_delay_ms for the rest."""
+        entries = self._read(self.max_batch, idle_block_ms)
+        if not entries:
+            return []
+        deadline = time.monotonic() + self.max_delay_ms / 1000
+        while len(entries) < self.max_batch:
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms <= 0:
+                break
+            more = self._read(self.max_batch - len(entries), remaining_ms)
+            if not more:
+                break
+            entries.extend(more)
+        return entries
+
+    # ------------------------------------------------------------------
+    # Batch processing
+    # ------------------------------------------------------------------
+    def _load_frame(self, fields: Dict) -> Optional[np.ndarray]:
+        if b"jpeg" in fields:
+            return cv2.imdecode(np.frombuffer(fields[b"jpeg"], np.uint8), cv2.IMREAD_COLOR)
+        camera_id = int(fields[b"camera_id"])
+        seq = int(fields[b"seq"])
+        ring = get_reader(camera_id, fields[b"level"].decode(), seq)
+        result = ring.read(seq, copy=True) if ring is not None else None
+        return result[2] if result is not None else None
+
+    def _prepare(self, entry_id: bytes, fields: Dict, now: float) -> Optional[Dict]:
+        """
+        Request of a stream entry; None when expired. A malformed entry gets
+        an error request, never run (and replied to only if it has an id).
+        """
+        request = {"id": None, "camera_id": None, "regions": {}, "frame": None, "results": {}, "error": None}
+        try:
+            request["id"] = fields[b"id"].decode()
+            request["camera_id"] = fields[b"camera_id"].decode()
+            waited = now - float(fields.get(b"ts", 0))
+            if waited > self.request_ttl:
+                count("inference_expired", request["camera_id"])
+                return None
+            observe_stage("inference_queue", waited, request["camera_id"])
+            regions = json.loads(fields[b"regions"])
+            if not isinstance(regions, dict):
+                raise ValueError(f"regions must be an object, got {type(regions).__name__}")
+            request["regions"] = regions
+        except (KeyError, ValueError, TypeError) as e:
+            logger.warning(f"⚠️ Malformed inference request {entry_id!r} skipped: {e!r}")
+            count("inference_malformed", request["camera_id"])
+            request["error"] = f"malformed request: {e!r}"
+            return request
+        with timed("frame_load", request["camera_id"]):
+            try:
+                request["frame"] = self._load_frame(fields)
+            except Exception as e:
+                logger.warning(f"[{request['camera_id']}] Frame load error: {e!r}")
+        if request["frame"] is None:
+            request["error"] = "frame unavailable"
+        return request
+
+    def process(self, entries: List):
+        now = time.time()
+        prepared = [self._prepare(entry_id, fields, now) for entry_id, fields in entries]
+        requests = [r for r in prepared if r is not None]
+        try:
+            run_models(self.get_detectors(), requests)
+        except Exception as e:
+            # Not a bad image (run_models handles those per model): the whole batch fails, replied to
+            logger.error(f"❌ Inference batch error ({len(requests)} requests): {e!r}")
+            for r in requests:
+                r["results"] = {}
+                r["error"] = r["error"] or str(e)
+        ready = [r for r in requests if r["error"] is None]
+
+        pipe = redis_client.pipeline(transaction=False)
+        for r in requests:
+            if r["id"] is None:
+                continue
+            reply = dict(r["results"], error=r["error"], batch_size=len(ready))
+            reply_key = REPLY_KEY.format(request_id=r["id"])
+            pipe.rpush(reply_key, json.dumps(reply))
+            pipe.expire(reply_key, 30)
+        entry_ids = self._unacked + [entry_id for entry_id, _ in entries]
+        pipe.xack(REQUEST_STREAM, REQUEST_GROUP, *entry_ids)
+        pipe.hincrby(STATS_KEY, "batches", 1)
+        pipe.hincrby(STATS_KEY, "frames", len(ready))
+        pipe.hincrby(STATS_KEY, "expired", len(entries) - len(requests))
+        try:
+            pipe.execute()
+        except redis.RedisError:
+            # Clients have given up by the time Redis is back: nothing to retry, only to acknowledge
+            self._unacked = entry_ids
+            raise
+        self._unacked = []
+
+        self.batches += 1
+        self.frames += len(ready)
+
+    # ------------------------------------------------------------------
+    # Loop
+    # ------------------------------------------------------------------
+    def heartbeat(self):
+        """Advertise this server's host, so clients know whether it reads their shared memory."""
+        now = time.monotonic()
+        if now - self._heartbeat_at < SERVER_TTL / 3:
+            return
+        self._heartbeat_at = now
+        try:
+            redis_client.hset(SERVERS_KEY, self.consumer, json.dumps({"host": self.host, "ts": time.time()}))
+        except redis.RedisError as e:
+            logger.error(f"❌ Inference server heartbeat error: {e}")
+
+    def stop(self):
+        self._running = False
+        self.meter.close()
+        try:
+            redis_client.hdel(SERVERS_KEY, self.consumer)
+        except redis.RedisError:
+            pass
+
+    def run(self):
+        self._running = True
+        logger.info(f"🚀 Inference server {self.consumer} ready "
+                    f"(max_batch={self.max_batch}, max_delay={self.max_delay_ms}ms)")
+        while self._running:
+            self.heartbeat()
+            try:
+                entries = self.collect()
+            except redis.ResponseError as e:
+                if "NOGROUP" in str(e):
+                    self.ensure_group()
+                    continue
+                raise
+            except redis.RedisError as e:
+                logger.error(f"❌ Inference request read error: {e}")
+                time.sleep(1)
+                continue
+            if not entries:
+                self.meter.add(0)
+                continue
+            frames_before = self.frames
+            started = time.monotonic()
+            try:
+                self.process(entries)
+            except redis.RedisError as e:
+                logger.error(f"❌ Inference reply error: {e}")
+                time.sleep(1)
+                continue
+            self.meter.add(self.frames - frames_before, time.monotonic() - started)
+            logger.debug(f"Batch of {len(entries)} request(s) in {(time.monotonic() - started) * 1000:.0f} ms")
+            if self.batches % 100 == 0:
+                capacity = self.meter.capacity()
+                logger.info(f"📊 Inference: {self.batches} batches, "
+                            f"{self.frames / self.batches:.1f} frames/batch on average"
+                            + (f", {capacity / len(self.meter.cores):.2f} frames/s per core" if capacity else ""))
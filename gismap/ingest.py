@@ -0,0 +1,461 @@
+# ============================================================================
+# INGEST.PY - One asyncio supervisor for every camera ffmpeg process
+# Replaces the per-camera Celery task / OpenCV thread capture paths:
+# ffmpeg pipes are read without blocking, stderr is drained, dead or
+# stalled streams (no data for stall_timeout) are restarted with
+# exponential backoff, frames go to the frame bus.
+# Run it with `python manage.py run_ingest`.
+# ============================================================================
+import asyncio
+import collections
+import logging
+import signal
+import time
+from typing import Dict, List, Optional
+
+from asgiref.sync import sync_to_async
+
+from gismap.frame_bus import FramePublisher, refresh_jpeg_interest
+from gismap.leases import LeaseRegistry
+from gismap.metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+DETECTION_TASKS = (
+    "gismap.tasks.yolo_detect_task.detect_from_redis",
+    "gismap.tasks.fire_clip_tasks.detect_fire_from_redis",
+)
+
+
+OUTPUT_FORMATS = ("rawvideo", "mjpeg")
+
+# Camera.decode_mode -> ffmpeg input options, applied before the decoder:
+#   all       decode everything, fps filter drops the surplus
+#   keyframe  decode I-frames only (-skip_frame nokey), ~GOP rate
+#   decimate  skip non-reference frames (B-frames...) before decoding
+# -lowres: decode at 1/2^lowres (0 = full resolution), 3 is the most decoders support
+MAX_LOWRES = 3
+
+DECODE_MODES = {
+    "all": [],
+    "keyframe": ["-skip_frame", "nokey"],
+    "decimate": ["-skip_frame", "nonref"],
+}
+
+# JPEG markers used to split an image2pipe stream
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+
+
+def build_ffmpeg_cmd(rtsp_url: str, width: int = 640, height: int = 480, fps: int = 1,
+                     output_format: str = "rawvideo", jpeg_quality: int = 5,
+                     decode_mode: str = "all", lowres: int = 0,
+                     input_options: Optional[List[str]] = None) -> List[str]:
+    """
+    ffmpeg command writing frames of width x height on stdout, either as raw
+    bgr24 ("rawvideo") or as concatenated JPEG images ("mjpeg", -q:v 2..31).
+
+    input_options go before -i as given (benchmarks reading a file pass
+    "-re -stream_loop -1"); live sources get none besides RTSP over TCP.
+
+    decode_mode (see DECODE_MODES) and lowres (decode at 1/2^lowres, for
+    decoders that support it: MJPEG / MPEG-4 cameras) cut decode work
+    before it happens instead of discarding decoded frames.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown ingest output format: {output_format}")
+    if decode_mode not in DECODE_MODES:
+        raise ValueError(f"Unknown decode mode: {decode_mode}")
+    if not 0 <= int(lowres) <= MAX_LOWRES:
+        raise ValueError(f"decode lowres must be between 0 and {MAX_LOWRES}: {lowres}")
+
+    if output_format == "mjpeg":
+        output = ["-f", "image2pipe", "-c:v", "mjpeg", "-q:v", str(jpeg_quality)]
+    else:
+        output = ["-f", "rawvideo", "-pix_fmt", "bgr24"]
+
+    source = ["-rtsp_transport", "tcp"] if rtsp_url.lower().startswith(("rtsp://", "rtsps://")) else []
+    source += list(input_options or [])
+
+    # Deblocking stays on: decoded frames feed the detectors and plate OCR
+    decode = list(DECODE_MODES[decode_mode])
+    if lowres:
+        decode += ["-lowres", str(int(lowres))]
+
+    if decode_mode == "all":
+        rate = ["-vf", f"fps={fps}"]
+    else:
+        # fps= would duplicate frames when fewer than fps arrive (keyframes
+        # every few seconds): keep at most one frame per 1/fps, never duplicate.
+        # -fps_mode needs ffmpeg >= 5.1 (older builds: -vsync vfr)
+        rate = ["-vf", f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{1 / fps:g})'",
+                "-fps_mode", "vfr"]
+
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "warning",
+        *source,
+        *decode,
+        "-i", rtsp_url,
+        "-s", f"{width}x{height}",
+        *output,
+        *rate,
+        "-an",
+        "pipe:1"
+    ]
+
+
+class JpegSplitter:
+    """
+    Cuts an image2pipe byte stream into JPEG images on SOI / EOI markers.
+    ffmpeg's mjpeg encoder stuffs 0xFF bytes in entropy-coded data, so EOI
+    only appears at the end of an image.
+    """
+
+    def __init__(self, max_buffer: int = 16 * 1024 * 1024):
+        self.buffer = bytearray()
+        self.max_buffer = max_buffer
+        self._scan_from = 0
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        self.buffer += chunk
+        images = []
+        while True:
+            start = self.buffer.find(SOI)
+            if start < 0:
+                # Keep a trailing 0xFF, it may be the first half of a marker
+                del self.buffer[:max(len(self.buffer) - 1, 0)]
+                self._scan_from = 0
+                break
+            if start > 0:
+                del self.buffer[:start]
+                self._scan_from = 0
+            end = self.buffer.find(EOI, max(self._scan_from, 2))
+            if end < 0:
+                self._scan_from = max(len(self.buffer) - 1, 2)
+                break
+            images.append(bytes(self.buffer[:end + 2]))
+            del self.buffer[:end + 2]
+            self._scan_from = 0
+
+        if len(self.buffer) > self.max_buffer:
+            logger.warning("[INGEST] JPEG splitter buffer overflow, dropping data")
+            self.buffer.clear()
+            self._scan_from = 0
+        return images
+
+
+def start_detection_tasks(camera_id):
+    """Dispatch the analytic tasks by name so ingest never imports the models."""
+    from smartVision.celery import app as celery_app
+    for task_name in DETECTION_TASKS:
+        celery_app.send_task(task_name, args=[camera_id])
+    logger.info(f"[{camera_id}] YOLO / fire detection started")
+
+
+# ============================================================================
+# One camera
+# ============================================================================
+class CameraIngest:
+    """Keeps one ffmpeg process alive for a camera and publishes its frames."""
+
+    def __init__(self, camera_id, rtsp_url: str, width: int = 640, height: int = 480, fps: int = 1,
+                 output_format: str = "rawvideo", min_backoff: float = 1.0, max_backoff: float = 60.0,
+                 start_detection: bool = True, publisher_options: Optional[dict] = None,
+                 decode_mode: str = "all", lowres: int = 0, input_options: Optional[List[str]] = None,
+                 stall_timeout: float = 10.0):
+        self.camera_id = camera_id
+        self.rtsp_url = rtsp_url
+        self.decode_mode = decode_mode
+        self.lowres = lowres
+        # Extra ffmpeg input options (benchmarks only, see build_ffmpeg_cmd)
+        self.input_options = input_options
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.output_format = output_format
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.start_detection = start_detection
+        # No stdout data for this long: ffmpeg is killed and restarted. A source that keeps its
+        # socket open but stops sending never makes ffmpeg exit. At least 3 frame intervals.
+        self.stall_timeout = max(stall_timeout, 3.0 / fps)
+        # Forwarded to FramePublisher (frame bus maxlen, embed_jpeg)
+        self.publisher_options = publisher_options or {}
+
+        self.publisher: Optional[FramePublisher] = None
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.stderr_tail = collections.deque(maxlen=20)
+        self.restarts = 0
+        self.frames = 0
+        # Analytics are dispatched once per ingest, not on every ffmpeg restart
+        # (leases + ensure_detection_tasks take over if they die)
+        self.detection_started = False
+        self.last_frame_at = 0.0
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self.run(), name=f"ingest-{self.camera_id}")
+        return self._task
+
+    async def stop(self):
+        self._stopping = True
+        await self._kill()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def run(self):
+        backoff = self.min_backoff
+        self.publisher = FramePublisher(self.camera_id, self.width, self.height, self.output_format,
+                                        **self.publisher_options)
+        try:
+            while not self._stopping:
+                started_at = time.monotonic()
+                frames = await self._run_once()
+                if self._stopping:
+                    break
+
+                # A stream that delivered frames for a while resets the backoff
+                if frames > 0 and time.monotonic() - started_at > self.max_backoff:
+                    backoff = self.min_backoff
+
+                self.restarts += 1
+                tail = " | ".join(self.stderr_tail) or "no stderr"
+                logger.warning(f"[{self.camera_id}] FFmpeg ended after {frames} frames, "
+                               f"restart #{self.restarts} in {backoff:.1f}s ({tail})")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        finally:
+            await self._kill()
+            self.publisher.close()
+            logger.info(f"[{self.camera_id}] Ingest stopped")
+
+    async def _run_once(self) -> int:
+        cmd = build_ffmpeg_cmd(self.rtsp_url, self.width, self.height, self.fps, self.output_format,
+                               decode_mode=self.decode_mode, lowres=self.lowres,
+                               input_options=self.input_options)
+        self.stderr_tail.clear()
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except (FileNotFoundError, PermissionError) as e:
+            logger.error(f"[{self.camera_id}] Cannot start ffmpeg: {e}")
+            return 0
+
+        logger.info(f"[{self.camera_id}] FFmpeg started for {self.rtsp_url} "
+                    f"({self.output_format}, decode {self.decode_mode}, pid {self.process.pid})")
+        stderr_task = asyncio.create_task(self._drain_stderr(self.process.stderr))
+        self.frames = 0
+        try:
+            if self.output_format == "mjpeg":
+                await self._read_mjpeg(self.process.stdout)
+            else:
+                await self._read_raw(self.process.stdout)
+        except asyncio.TimeoutError:
+            logger.warning(f"[{self.camera_id}] No data from ffmpeg for {self.stall_timeout:g}s, stream stalled")
+            self.stderr_tail.append(f"stalled: no data for {self.stall_timeout:g}s")
+        finally:
+            await self._kill()
+            stderr_task.cancel()
+        return self.frames
+
+    async def _read_raw(self, stdout: asyncio.StreamReader):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = time.perf_counter()
+            try:
+                raw_frame = await asyncio.wait_for(stdout.readexactly(self.publisher.frame_size),
+                                                   self.stall_timeout)
+            except asyncio.IncompleteReadError:
+                return
+            self.last_frame_at = time.time()
+            # Includes waiting for the camera: at the stream fps this is mostly the frame interval
+            observe_stage("ffmpeg_read", time.perf_counter() - started, self.camera_id)
+            # Ring write + optional JPEG encode release the GIL, keep them off the loop
+            started = time.perf_counter()
+            await loop.run_in_executor(None, self.publisher.publish_raw, raw_frame, self.last_frame_at)
+            observe_stage("publish", time.perf_counter() - started, self.camera_id)
+            await self._frame_published()
+
+    async def _read_mjpeg(self, stdout: asyncio.StreamReader):
+        """Passthrough: only split on markers, never decode pixels."""
+        loop = asyncio.get_running_loop()
+        splitter = JpegSplitter()
+        while True:
+            chunk = await asyncio.wait_for(stdout.read(64 * 1024), self.stall_timeout)
+            if not chunk:
+                return
+            for jpeg_bytes in splitter.feed(chunk):
+                self.last_frame_at = time.time()
+                await loop.run_in_executor(None, self.publisher.publish_jpeg, jpeg_bytes, self.last_frame_at)
+                await self._frame_published()
+
+    async def _frame_published(self):
+        self.frames += 1
+        if self.start_detection and not self.detection_started:
+            self.detection_started = True
+            await asyncio.get_running_loop().run_in_executor(None, start_detection_tasks, self.camera_id)
+
+    async def _drain_stderr(self, stream: asyncio.StreamReader):
+        """ffmpeg blocks when its stderr pipe is full: always keep reading it."""
+        try:
+            while True:
+                line = await stream.readline()
+                if not line:
+                    break
+                text = line.decode("utf-8", errors="ignore").strip()
+                if text:
+                    self.stderr_tail.append(text)
+                    logger.debug(f"[{self.camera_id}] ffmpeg: {text}")
+        except asyncio.CancelledError:
+            pass
+
+    async def _kill(self):
+        process, self.process = self.process, None
+        if process is None or process.returncode is not None:
+            return
+        try:
+            process.kill()
+        except ProcessLookupError:
+            return
+        await process.wait()
+
+
+# ============================================================================
+# Supervisor
+# ============================================================================
+class IngestSupervisor:
+    """
+    Runs a CameraIngest per Camera row and follows additions / removals.
+
+    With several supervisors (one per node), each camera is ingested by the
+    node holding its "ingest" lease; leases are rebalanced every
+    lease_interval so cameras move when a node dies or joins.
+    """
+
+    def __init__(self, width: int = 640, height: int = 480, fps: int = 1, output_format: str = "rawvideo",
+                 refresh_interval: float = 30.0, jpeg_interest_interval: float = 0.5,
+                 start_detection: bool = True, publisher_options: Optional[dict] = None,
+                 lease_interval: float = 5.0, lease_ttl: float = 15.0):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.output_format = output_format
+        self.refresh_interval = refresh_interval
+        self.jpeg_interest_interval = jpeg_interest_interval
+        self.start_detection = start_detection
+        self.publisher_options = publisher_options or {}
+        self.lease_interval = lease_interval
+        self.leases = LeaseRegistry("ingest", ttl=lease_ttl)
+        self.cameras: Dict[int, CameraIngest] = {}
+        self.all_cameras: Dict[int, dict] = {}
+        self._stop_event: Optional[asyncio.Event] = None
+
+    @staticmethod
+    @sync_to_async
+    def load_cameras() -> Dict[int, dict]:
+        """{camera_id: {"rtsp_url", "decode_mode", "lowres", "size"}}, size: full level [w, h] or None"""
+        from gismap.models import Camera
+        rows = Camera.objects.values_list("id", "rtsp_url", "decode_mode", "decode_lowres", "tiling")
+        return {camera_id: {"rtsp_url": rtsp_url, "decode_mode": decode_mode, "lowres": lowres,
+                            # Tiled cameras may keep more of their native resolution (gismap/tiling.py)
+                            "size": list(tiling["source_size"]) if (tiling or {}).get("enabled")
+                            and tiling.get("source_size") else None}
+                for camera_id, rtsp_url, decode_mode, lowres, tiling in rows}
+
+    def _size(self, config: dict) -> List[int]:
+        """Full level size of a camera: its own, or the supervisor's."""
+        width, height = config.get("size") or (self.width, self.height)
+        return [int(width), int(height)]
+
+    async def sync_cameras(self, wanted: Dict[int, dict]):
+        for camera_id in list(self.cameras):
+            ingest = self.cameras[camera_id]
+            config = {"rtsp_url": ingest.rtsp_url, "decode_mode": ingest.decode_mode, "lowres": ingest.lowres,
+                      "size": [ingest.width, ingest.height]}
+            want = wanted.get(camera_id)
+            if want is None or dict(want, size=self._size(want)) != config:
+                logger.info(f"[{camera_id}] Camera removed or config changed, stopping ingest")
+                await ingest.stop()
+                del self.cameras[camera_id]
+
+        for camera_id, config in wanted.items():
+            if camera_id not in self.cameras:
+                width, height = self._size(config)
+                ingest = CameraIngest(camera_id, config["rtsp_url"], width, height, self.fps,
+                                      self.output_format, start_detection=self.start_detection,
+                                      publisher_options=self.publisher_options,
+                                      decode_mode=config["decode_mode"], lowres=config["lowres"])
+                self.cameras[camera_id] = ingest
+                ingest.start()
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                self.all_cameras = await self.load_cameras()
+            except Exception as e:
+                logger.error(f"[INGEST] Camera refresh error: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def _lease_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                owned = await loop.run_in_executor(None, self.leases.rebalance, list(self.all_cameras))
+                before = set(self.cameras)
+                await self.sync_cameras({cid: config for cid, config in self.all_cameras.items() if cid in owned})
+                if set(self.cameras) != before:
+                    logger.info(f"[INGEST] {self.leases.node_id}: {len(self.cameras)}/{len(self.all_cameras)} "
+                                f"camera(s) owned")
+            except Exception as e:
+                logger.error(f"[INGEST] Lease rebalance error: {e}")
+            await asyncio.sleep(self.lease_interval)
+
+    async def _jpeg_interest_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # MJPEG cameras always publish their JPEG, no flag to check
+            publishers = [c.publisher for c in self.cameras.values()
+                          if c.publisher is not None and c.output_format == "rawvideo"]
+            await loop.run_in_executor(None, refresh_jpeg_interest, publishers)
+            await asyncio.sleep(self.jpeg_interest_interval)
+
+    def stop(self):
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+    async def run(self):
+        self._stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                # Windows: Ctrl+C still raises KeyboardInterrupt
+                pass
+
+        background = [
+            asyncio.create_task(self._refresh_loop()),
+            asyncio.create_task(self._lease_loop()),
+            asyncio.create_task(self._jpeg_interest_loop()),
+        ]
+        try:
+            await self._stop_event.wait()
+        finally:
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*(c.stop() for c in self.cameras.values()), return_exceptions=True)
+            # Hand cameras over right away instead of waiting for lease expiry
+            self.leases.leave(list(self.cameras))
+            self.cameras.clear()
+            logger.info("[INGEST] Supervisor stopped")
@@ -0,0 +1,168 @@
+# ============================================================================
+# LEASES.PY - Redis-backed camera ownership across worker nodes
+# Replaces the process-local running_* sets: each camera has at most one
+# owner per role ("ingest", "yolo", "fire") thanks to an expiring lease,
+# and nodes heartbeat so cameras are spread (rendezvous hashing) over the
+# live nodes and move automatically when a node dies or joins.
+# ============================================================================
+import hashlib
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Iterable, List, Optional, Set
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+LEASE_KEY = "lease:{role}:{camera_id}"
+# A task was dispatched for this camera and has not started yet
+PENDING_KEY = "lease:{role}:{camera_id}:pending"
+NODES_KEY = "nodes:{role}"
+
+# Only the holder may renew / release its lease
+_RENEW = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+""")
+_RELEASE = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+
+def default_node_id(unique: bool = False) -> str:
+    node_id = f"{socket.gethostname()}-{os.getpid()}"
+    if unique:
+        # One holder per task instance, even for several tasks in one process
+        node_id = f"{node_id}-{uuid.uuid4().hex[:8]}"
+    return node_id
+
+
+def rendezvous_owner(camera_id, nodes: Iterable[str]) -> Optional[str]:
+    """Highest-random-weight hashing: stable owner, minimal moves when nodes change."""
+    best, best_score = None, None
+    for node in nodes:
+        score = hashlib.sha1(f"{node}:{camera_id}".encode()).digest()
+        if best_score is None or score > best_score:
+            best, best_score = node, score
+    return best
+
+
+class LeaseRegistry:
+    """Leases of one role held by one node (or one task instance)."""
+
+    def __init__(self, role: str, node_id: Optional[str] = None, ttl: float = 15.0):
+        self.role = role
+        self.node_id = node_id or default_node_id()
+        self.ttl = ttl
+        self.nodes_key = NODES_KEY.format(role=role)
+        self._renewed_at = {}
+
+    def _key(self, camera_id) -> str:
+        return LEASE_KEY.format(role=self.role, camera_id=camera_id)
+
+    # ------------------------------------------------------------------
+    # Single leases
+    # ------------------------------------------------------------------
+    def mark_pending(self, camera_id, ttl: float = 120.0) -> bool:
+        """
+        Record that a task is about to be dispatched for this camera. False
+        when one is already queued (and not started for less than ttl
+        seconds): the caller must not dispatch another one.
+        """
+        return bool(redis_client.set(PENDING_KEY.format(role=self.role, camera_id=camera_id), self.node_id,
+                                     nx=True, ex=int(ttl)))
+
+    def clear_pending(self, camera_id):
+        """The dispatched task has started: the next one may be queued again."""
+        try:
+            redis_client.delete(PENDING_KEY.format(role=self.role, camera_id=camera_id))
+        except redis.RedisError as e:
+            logger.error(f"[{camera_id}] Pending dispatch clear error ({self.role}): {e}")
+
+    def acquire(self, camera_id) -> bool:
+        """Take the lease if free (or renew it if we already hold it)."""
+        ttl_ms = int(self.ttl * 1000)
+        if redis_client.set(self._key(camera_id), self.node_id, nx=True, px=ttl_ms):
+            self._renewed_at[camera_id] = time.monotonic()
+            return True
+        return self.renew(camera_id)
+
+    def renew(self, camera_id) -> bool:
+        ok = bool(_RENEW(keys=[self._key(camera_id)], args=[self.node_id, int(self.ttl * 1000)]))
+        if ok:
+            self._renewed_at[camera_id] = time.monotonic()
+        else:
+            self._renewed_at.pop(camera_id, None)
+        return ok
+
+    def keep(self, camera_id) -> bool:
+        """Cheap call for hot loops: renews at most every ttl/3 seconds."""
+        renewed_at = self._renewed_at.get(camera_id)
+        if renewed_at is not None and time.monotonic() - renewed_at < self.ttl / 3:
+            return True
+        return self.renew(camera_id)
+
+    def release(self, camera_id):
+        self._renewed_at.pop(camera_id, None)
+        try:
+            _RELEASE(keys=[self._key(camera_id)], args=[self.node_id])
+        except redis.RedisError as e:
+            logger.error(f"[{camera_id}] Lease release error ({self.role}): {e}")
+
+    def owner(self, camera_id) -> Optional[str]:
+        owner = redis_client.get(self._key(camera_id))
+        return owner.decode() if owner else None
+
+    # ------------------------------------------------------------------
+    # Node membership and rebalancing
+    # ------------------------------------------------------------------
+    def heartbeat(self):
+        now = time.time()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zadd(self.nodes_key, {self.node_id: now})
+        pipe.zremrangebyscore(self.nodes_key, "-inf", now - self.ttl)
+        pipe.execute()
+
+    def live_nodes(self) -> List[str]:
+        nodes = redis_client.zrangebyscore(self.nodes_key, time.time() - self.ttl, "+inf")
+        return sorted(n.decode() for n in nodes)
+
+    def leave(self, camera_ids: Iterable = ()):
+        for camera_id in camera_ids:
+            self.release(camera_id)
+        redis_client.zrem(self.nodes_key, self.node_id)
+
+    def rebalance(self, camera_ids: Iterable) -> Set:
+        """
+        Heartbeat, then converge on the rendezvous assignment: acquire the
+        cameras assigned to this node, hand back the ones assigned elsewhere.
+        A lease still held by a dead node is taken over once it expires.
+        Returns the cameras this node owns now.
+        """
+        self.heartbeat()
+        nodes = self.live_nodes()
+        camera_ids = list(camera_ids)
+        if not camera_ids:
+            return set()
+
+        owners = redis_client.mget([self._key(camera_id) for camera_id in camera_ids])
+        me = self.node_id.encode()
+        owned = set()
+        for camera_id, owner in zip(camera_ids, owners):
+            if rendezvous_owner(camera_id, nodes) == self.node_id:
+                if self.acquire(camera_id):
+                    owned.add(camera_id)
+            elif owner == me:
+                logger.info(f"[{camera_id}] {self.role} lease handed over to another node")
+                self.release(camera_id)
+        return owned
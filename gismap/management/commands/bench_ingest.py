@@ -0,0 +1,55 @@
+import asyncio
+import json
+import logging
+
+from django.core.management.base import BaseCommand
+
+from gismap.benchmark.ingest import run_benchmark
+from gismap.ingest import DECODE_MODES, OUTPUT_FORMATS
+
+
+class Command(BaseCommand):
+    help = "Benchmark d'ingestion: N caméras simulées (clip de test en boucle), rapport JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cameras", type=int, default=4)
+        parser.add_argument("--duration", type=float, default=30.0, help="Durée mesurée (s)")
+        parser.add_argument("--warmup", type=float, default=5.0, help="Durée ignorée au démarrage (s)")
+        parser.add_argument("--width", type=int, default=1280)
+        parser.add_argument("--height", type=int, default=720)
+        parser.add_argument("--fps", type=int, default=1)
+        parser.add_argument("--format", choices=OUTPUT_FORMATS, default="rawvideo")
+        parser.add_argument("--decode-mode", choices=list(DECODE_MODES), default="all")
+        parser.add_argument("--lowres", type=int, default=0)
+        parser.add_argument("--source", choices=("rtsp", "file"), default="rtsp",
+                            help="rtsp: clips publiés sur mediamtx, file: lecture directe du clip")
+        parser.add_argument("--rtsp-server", default="rtsp://localhost:8554")
+        parser.add_argument("--clip", default=None, help="Clip H.264 (généré si absent)")
+        parser.add_argument("--output", default=None, help="Fichier JSON (sinon stdout)")
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.WARNING)
+        report = asyncio.run(run_benchmark(
+            cameras=options["cameras"],
+            duration=options["duration"],
+            warmup=options["warmup"],
+            width=options["width"],
+            height=options["height"],
+            fps=options["fps"],
+            output_format=options["format"],
+            decode_mode=options["decode_mode"],
+            lowres=options["lowres"],
+            source=options["source"],
+            rtsp_server=options["rtsp_server"],
+            clip=options["clip"],
+        ))
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(text + "\n")
+            results = report["results"]
+            self.stdout.write(self.style.SUCCESS(
+                f"📊 {options['cameras']} camera(s): {results['total_fps']} fps, "
+                f"{results['cpu_percent_per_camera']}% CPU/camera -> {options['output']}"))
+        else:
+            self.stdout.write(text)
@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gismap.benchmark.startup import TASK_MODULES, measure_startup
+
+
+class Command(BaseCommand):
+    help = "Mesure le démarrage d'un worker (import des tâches) et vérifie qu'aucun modèle n'est chargé"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=3, help="Nombre de processus mesurés")
+        parser.add_argument("--modules", nargs="+", default=list(TASK_MODULES))
+        parser.add_argument("--warmup", nargs="*", default=[],
+                            help="Modèles à préchauffer après l'import (ex. best box pose fire clip)")
+        parser.add_argument("--output", default=None, help="Fichier JSON (sinon stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            report = measure_startup(options["modules"], warmup=options["warmup"], runs=options["runs"])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(text + "\n")
+        else:
+            self.stdout.write(text)
+        if not report["passed"]:
+            raise CommandError(f"❌ Modèles chargés à l'import: {report['median']['models_loaded']}")
+        self.stdout.write(self.style.SUCCESS(f"✅ Démarrage: {report['median']['startup_s']}s, aucun modèle chargé"))
@@ -0,0 +1,54 @@
+import json
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from gismap.benchmark.backends import check_backends, grab_camera_frames, load_images
+from gismap.detectors import BACKENDS, MODEL_PATHS
+
+
+class Command(BaseCommand):
+    help = "Vérifie les exports ONNX / OpenVINO contre PyTorch (parité des détections) et compare les latences"
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument("--images", help="Dossier d'images (jpg/png) de référence")
+        source.add_argument("--camera", type=int, help="Capturer les frames d'une caméra (ingestion active)")
+        parser.add_argument("--frames", type=int, default=20, help="Nombre de frames utilisées")
+        parser.add_argument("--backends", nargs="+", choices=[b for b in BACKENDS if b != "torch"],
+                            default=["onnx", "openvino"])
+        parser.add_argument("--models", nargs="+", choices=list(MODEL_PATHS), default=list(MODEL_PATHS))
+        parser.add_argument("--int8", action="store_true", help="Comparer les exports INT8")
+        parser.add_argument("--threads", type=int, default=getattr(settings, "INFERENCE_THREADS", 0))
+        parser.add_argument("--min-recall", type=float, default=0.9)
+        parser.add_argument("--min-precision", type=float, default=0.9)
+        parser.add_argument("--output", default=None, help="Fichier JSON (sinon stdout)")
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.WARNING)
+        if options["images"]:
+            frames = load_images(options["images"], limit=options["frames"])
+        else:
+            frames = grab_camera_frames(options["camera"], count=options["frames"])
+        if not frames:
+            raise CommandError("Aucune frame disponible")
+
+        report = check_backends(
+            frames,
+            backends=options["backends"],
+            models=options["models"],
+            int8=options["int8"],
+            threads=options["threads"],
+            min_recall=options["min_recall"],
+            min_precision=options["min_precision"],
+        )
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(text + "\n")
+        else:
+            self.stdout.write(text)
+        if not report["passed"]:
+            raise CommandError("❌ Parité insuffisante avec PyTorch (voir le rapport)")
+        self.stdout.write(self.style.SUCCESS("✅ Backends conformes à PyTorch"))
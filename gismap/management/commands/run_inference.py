@@ -0,0 +1,52 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from gismap.frame_bus import default_consumer_name
+from gismap.inference_server import InferenceServer
+from gismap.worker_pool import default_workers, run_pinned
+
+
+def serve(index, cores, max_batch, max_delay_ms):
+    """One pinned server process: loads its own models, shares the request stream with the others."""
+    server = InferenceServer(max_batch=max_batch, max_delay_ms=max_delay_ms,
+                             consumer=f"{default_consumer_name()}-{index}", cores=cores)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+class Command(BaseCommand):
+    help = "Démarre le serveur d'inférence YOLO batché (toutes les caméras, un seul jeu de modèles)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-batch", type=int, default=getattr(settings, "INFERENCE_MAX_BATCH", 16),
+                            help="Nombre maximal de frames par passe")
+        parser.add_argument("--max-delay-ms", type=int, default=getattr(settings, "INFERENCE_MAX_DELAY_MS", 50),
+                            help="Attente maximale (ms) après la première frame d'un batch")
+        parser.add_argument("--workers", type=int, default=None,
+                            help="Processus serveurs, chacun épinglé sur ses propres cœurs "
+                                 "(défaut: INFERENCE_WORKERS, 0 = cœurs / INFERENCE_CORES_PER_WORKER)")
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.INFO)
+        workers = default_workers(options["workers"])
+        if workers > 1:
+            self.stdout.write(self.style.SUCCESS(f"🧠 Inference server started ({workers} pinned workers)"))
+            try:
+                run_pinned(lambda index, cores: serve(index, cores, options["max_batch"], options["max_delay_ms"]),
+                           workers)
+            except KeyboardInterrupt:
+                pass
+            self.stdout.write("Inference server stopped")
+            return
+
+        server = InferenceServer(max_batch=options["max_batch"], max_delay_ms=options["max_delay_ms"])
+        self.stdout.write(self.style.SUCCESS("🧠 Inference server started"))
+        try:
+            server.run()
+        except KeyboardInterrupt:
+            server.stop()
+        self.stdout.write("Inference server stopped")
@@ -0,0 +1,46 @@
+import asyncio
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from gismap.ingest import IngestSupervisor, OUTPUT_FORMATS
+
+
+class Command(BaseCommand):
+    help = "Démarre le superviseur d'ingestion (un processus ffmpeg par caméra, lecture asyncio)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--width", type=int, default=getattr(settings, "INGEST_FRAME_WIDTH", 1280),
+                            help="Largeur de décodage (niveau full de la pyramide)")
+        parser.add_argument("--height", type=int, default=getattr(settings, "INGEST_FRAME_HEIGHT", 720),
+                            help="Hauteur de décodage (niveau full de la pyramide)")
+        parser.add_argument("--fps", type=int, default=1)
+        parser.add_argument("--format", choices=OUTPUT_FORMATS,
+                            default=getattr(settings, "INGEST_OUTPUT_FORMAT", "rawvideo"),
+                            help="rawvideo: pixels en mémoire partagée, mjpeg: JPEG directement depuis ffmpeg")
+        parser.add_argument("--refresh", type=float, default=30.0,
+                            help="Intervalle (s) de relecture de la table Camera")
+        parser.add_argument("--no-detection", action="store_true",
+                            help="Ne pas lancer les tâches de détection au premier frame")
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.INFO)
+        supervisor = IngestSupervisor(
+            width=options["width"],
+            height=options["height"],
+            fps=options["fps"],
+            output_format=options["format"],
+            refresh_interval=options["refresh"],
+            start_detection=not options["no_detection"],
+            publisher_options={
+                "maxlen": getattr(settings, "FRAME_BUS_MAXLEN", 100),
+                "embed_jpeg": getattr(settings, "FRAME_BUS_EMBED_JPEG", False),
+            },
+        )
+        self.stdout.write(self.style.SUCCESS("🎥 Ingest supervisor started"))
+        try:
+            asyncio.run(supervisor.run())
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write("Ingest supervisor stopped")
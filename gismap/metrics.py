@@ -0,0 +1,150 @@
+# ============================================================================
+# METRICS.PY - Stage latency histograms and counters, Prometheus text format
+# Every process (ingest, Celery workers, inference server, web) records:
+#     smartvision_stage_seconds{stage, camera, model}   histogram
+#     smartvision_events_total{event, camera, model}    counter
+# Observations are aggregated in memory and flushed to Redis about once a
+# second (one pipeline), so timing a stage never costs a round trip. The
+# /metrics view renders the totals of all processes from Redis:
+#     metrics:histogram:{name}   field "{labels}|{le}" / "{labels}|sum" / "{labels}|count"
+#     metrics:counter:{name}     field "{labels}"
+# ============================================================================
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+HISTOGRAM_KEY = "metrics:histogram:{name}"
+COUNTER_KEY = "metrics:counter:{name}"
+
+STAGE_SECONDS = "smartvision_stage_seconds"
+EVENTS_TOTAL = "smartvision_events_total"
+HELP = {
+    STAGE_SECONDS: "Latency of one pipeline stage (ffmpeg read, encode, inference, OCR, DB write...)",
+    EVENTS_TOTAL: "Pipeline events (frames, skips, cache hits, alerts...)",
+}
+# Upper bounds in seconds, from a Redis SET to a CLIP pass on CPU
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FLUSH_INTERVAL = 1.0
+
+
+def _labels(**labels) -> str:
+    """Canonical label string, e.g. camera="3",model="best",stage="inference" (empty labels left out)."""
+    return ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()) if value is not None)
+
+
+def _le(value: float) -> str:
+    for bound in BUCKETS:
+        if value <= bound:
+            return repr(bound)
+    return "+Inf"
+
+
+class MetricsBuffer:
+    """In-process aggregation, flushed to Redis at most every FLUSH_INTERVAL seconds."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str], Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._counters: Dict[Tuple[str, str], float] = defaultdict(float)
+        self._flushed_at = time.monotonic()
+
+    def observe(self, name: str, value: float, labels: str):
+        with self._lock:
+            series = self._histograms[(name, labels)]
+            series[_le(value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+        self._maybe_flush()
+
+    def inc(self, name: str, labels: str, value: float = 1):
+        with self._lock:
+            self._counters[(name, labels)] += value
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            histograms, self._histograms = self._histograms, defaultdict(lambda: defaultdict(float))
+            counters, self._counters = self._counters, defaultdict(float)
+            self._flushed_at = time.monotonic()
+        if not histograms and not counters:
+            return
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for (name, labels), series in histograms.items():
+                key = HISTOGRAM_KEY.format(name=name)
+                for field, value in series.items():
+                    pipe.hincrbyfloat(key, f"{labels}|{field}", value)
+            for (name, labels), value in counters.items():
+                pipe.hincrbyfloat(COUNTER_KEY.format(name=name), labels, value)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.error(f"❌ Metrics flush error: {e}")
+
+
+buffer = MetricsBuffer()
+atexit.register(buffer.flush)
+
+
+def observe_stage(stage: str, seconds: float, camera_id=None, model: Optional[str] = None):
+    buffer.observe(STAGE_SECONDS, seconds, _labels(stage=stage, camera=camera_id, model=model))
+
+
+@contextmanager
+def timed(stage: str, camera_id=None, model: Optional[str] = None):
+    """with timed("ocr", camera_id): ... records the block's duration (also when it raises)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, camera_id, model)
+
+
+def count(event: str, camera_id=None, model: Optional[str] = None, value: float = 1):
+    buffer.inc(EVENTS_TOTAL, _labels(event=event, camera=camera_id, model=model), value)
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render() -> str:
+    """All histograms and counters in Prometheus text exposition format (version 0.0.4)."""
+    buffer.flush()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hgetall(HISTOGRAM_KEY.format(name=STAGE_SECONDS))
+    pipe.hgetall(COUNTER_KEY.format(name=EVENTS_TOTAL))
+    histogram, counter = pipe.execute()
+
+    lines = [f"# HELP {STAGE_SECONDS} {HELP[STAGE_SECONDS]}", f"# TYPE {STAGE_SECONDS} histogram"]
+    series: Dict[str, Dict[str, float]] = defaultdict(dict)
+    for field, value in histogram.items():
+        labels, _, kind = field.decode().rpartition("|")
+        series[labels][kind] = float(value)
+    for labels in sorted(series):
+        values = series[labels]
+        prefix = f"{labels}," if labels else ""
+        cumulative = 0.0
+        for bound in [repr(b) for b in BUCKETS] + ["+Inf"]:
+            cumulative += values.get(bound, 0.0)
+            lines.append(f'{STAGE_SECONDS}_bucket{{{prefix}le="{bound}"}} {_number(cumulative)}')
+        lines.append(f"{STAGE_SECONDS}_sum{{{labels}}} {_number(values.get('sum', 0.0))}")
+        lines.append(f"{STAGE_SECONDS}_count{{{labels}}} {_number(values.get('count', 0.0))}")
+
+    lines += [f"# HELP {EVENTS_TOTAL} {HELP[EVENTS_TOTAL]}", f"# TYPE {EVENTS_TOTAL} counter"]
+    for labels, value in sorted((field.decode(), float(value)) for field, value in counter.items()):
+        lines.append(f"{EVENTS_TOTAL}{{{labels}}} {_number(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gismap', '0004_alter_camera_name_alter_detectionmatricule_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='motion_gating',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='motion_threshold',
+            field=models.FloatField(default=0.002),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:00
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gismap', '0005_camera_motion_gating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='decode_mode',
+            field=models.CharField(choices=[('all', 'Toutes les frames'), ('keyframe', 'Images clés uniquement'), ('decimate', 'Frames de référence uniquement')], default='all', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='decode_lowres',
+            field=models.PositiveSmallIntegerField(default=0, validators=[django.core.validators.MaxValueValidator(3)]),
+        ),
+    ]
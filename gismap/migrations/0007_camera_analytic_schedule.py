@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gismap', '0006_camera_decode_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='analytic_schedule',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
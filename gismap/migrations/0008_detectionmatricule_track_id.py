@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gismap', '0007_camera_analytic_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detectionmatricule',
+            name='track_id',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
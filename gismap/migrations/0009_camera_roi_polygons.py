@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gismap', '0008_detectionmatricule_track_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='roi_polygons',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gismap', '0009_camera_roi_polygons'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='tiling',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
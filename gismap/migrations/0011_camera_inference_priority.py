@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gismap', '0010_camera_tiling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='inference_priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Basse'), (1, 'Normale'), (2, 'Haute')], default=1),
+        ),
+    ]
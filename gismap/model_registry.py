@@ -0,0 +1,221 @@
+# ============================================================================
+# MODEL_REGISTRY.PY - Models of a process, loaded on first use
+# Importing a task module loads no network: models are built the first
+# time a task asks for them (registry.get("pose")) or when the worker warms
+# them up explicitly (MODEL_WARMUP, see smartVision/celery.py). One instance
+# per process, shared by the threads of the Celery pool; models unused for
+# MODEL_IDLE_TIMEOUT seconds are unloaded, except the pinned ones (a
+# dedicated inference server keeps its models however quiet the cameras).
+# ============================================================================
+import gc
+import logging
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def free_memory():
+    """gc + CUDA cache release, without importing torch in processes that never loaded it."""
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class ModelRegistry:
+    """
+    register(name, loader, warmup) declares a model; get(name) builds it once
+    (per-model lock: two threads asking at once share one load) and returns
+    the same object to every thread afterwards.
+    """
+
+    def __init__(self, idle_timeout: float = 0.0, reap_interval: float = 60.0):
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self._loaders: Dict[str, Callable] = {}
+        self._warmups: Dict[str, Optional[Callable]] = {}
+        self._models: Dict[str, object] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._stats: Dict[str, Dict] = {}
+        # Never unloaded by the idle reaper
+        self._pinned = set()
+        self._lock = threading.Lock()
+        self._reaper: Optional[threading.Thread] = None
+
+    def register(self, name: str, loader: Callable, warmup: Optional[Callable] = None):
+        with self._lock:
+            self._loaders[name] = loader
+            self._warmups[name] = warmup
+            self._locks.setdefault(name, threading.Lock())
+            self._stats.setdefault(name, {"loads": 0, "uses": 0, "load_s": None, "warmup_s": None,
+                                          "last_used": None})
+
+    def names(self):
+        return list(self._loaders)
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def loaded(self):
+        return [name for name in self._loaders if name in self._models]
+
+    def pin(self, names: Iterable[str]):
+        """Exempt these models from idle unloading."""
+        with self._lock:
+            self._pinned.update(names)
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+    def get(self, name: str):
+        """The model, loaded on first call."""
+        model = self._models.get(name)
+        if model is None:
+            if name not in self._loaders:
+                raise KeyError(f"Unknown model: {name}")
+            with self._locks[name]:
+                model = self._models.get(name)
+                if model is None:
+                    model = self._load(name)
+        stats = self._stats[name]
+        stats["uses"] += 1
+        stats["last_used"] = time.monotonic()
+        return model
+
+    def _load(self, name: str):
+        started = time.perf_counter()
+        model = self._loaders[name]()
+        load_s = time.perf_counter() - started
+        self._models[name] = model
+        self._stats[name].update(loads=self._stats[name]["loads"] + 1, load_s=round(load_s, 3),
+                                 last_used=time.monotonic())
+        logger.info(f"🧠 Model {name} loaded in {load_s:.2f}s")
+        self._start_reaper()
+        return model
+
+    def warmup(self, names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """Load and run one dummy inference for each model; {name: seconds}."""
+        timings = {}
+        for name in (self.names() if names is None else names):
+            if name not in self._loaders:
+                logger.warning(f"⚠️ Warmup of unknown model {name} skipped")
+                continue
+            started = time.perf_counter()
+            model = self.get(name)
+            warmup = self._warmups.get(name)
+            if warmup is not None:
+                with self._locks[name]:
+                    warmup(model)
+            timings[name] = round(time.perf_counter() - started, 3)
+            self._stats[name]["warmup_s"] = timings[name]
+        if timings:
+            logger.info(f"🔥 Models warmed up: {timings}")
+        return timings
+
+    # ------------------------------------------------------------------
+    # Unloading
+    # ------------------------------------------------------------------
+    def unload(self, name: str) -> bool:
+        lock = self._locks.get(name)
+        if lock is None:
+            return False
+        with lock:
+            model = self._models.pop(name, None)
+        if model is None:
+            return False
+        del model
+        free_memory()
+        logger.info(f"🧹 Model {name} unloaded")
+        return True
+
+    def unload_idle(self, max_idle_s: Optional[float] = None):
+        """Unload the models nobody asked for in max_idle_s seconds; names unloaded."""
+        max_idle_s = self.idle_timeout if max_idle_s is None else max_idle_s
+        if not max_idle_s:
+            return []
+        now = time.monotonic()
+        idle = [name for name in self.loaded() if name not in self._pinned
+                and now - (self._stats[name]["last_used"] or now) > max_idle_s]
+        return [name for name in idle if self.unload(name)]
+
+    def _start_reaper(self):
+        if not self.idle_timeout:
+            return
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="model-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                self.unload_idle()
+            except Exception as e:
+                logger.error(f"❌ Idle model unload error: {e}")
+
+    def stats(self) -> Dict:
+        return {name: dict(self._stats[name], loaded=name in self._models, pinned=name in self._pinned)
+                for name in self._loaders}
+
+
+# ============================================================================
+# Models of the pipelines
+# ============================================================================
+def _yolo_loader(name: str, imgsz=(640, 384)):
+    def load():
+        from gismap.detectors import MODEL_PATHS, YOLODetector, default_backend_options
+        return YOLODetector(MODEL_PATHS[name], imgsz=imgsz, **default_backend_options())
+    return load
+
+
+def _yolo_warmup(detector):
+    detector.warmup()
+
+
+def _load_clip():
+    import clip
+    from gismap.detectors import get_device
+    device = get_device()
+    model, preprocess = clip.load("ViT-B/32", device=device)
+    model.eval()
+    bundle = {"model": model, "preprocess": preprocess, "tokenize": clip.tokenize, "device": device}
+    # Fire prompts encoded once, with the model (gismap/clip_prompts.py)
+    from gismap.clip_prompts import fire_prompts, text_embeddings
+    text_embeddings(bundle, fire_prompts())
+    return bundle
+
+
+def _clip_warmup(bundle):
+    import torch
+    with torch.no_grad():
+        bundle["model"].encode_image(torch.zeros((1, 3, 224, 224), device=bundle["device"]))
+
+
+def _build_registry() -> ModelRegistry:
+    try:
+        from django.conf import settings
+        idle_timeout = float(getattr(settings, "MODEL_IDLE_TIMEOUT", 0))
+    except Exception:
+        idle_timeout = 0.0
+    models = ModelRegistry(idle_timeout=idle_timeout)
+    models.register("best", _yolo_loader("best"), _yolo_warmup)
+    models.register("box", _yolo_loader("box"), _yolo_warmup)
+    models.register("pose", _yolo_loader("pose", imgsz=640), _yolo_warmup)
+    models.register("fire", _yolo_loader("fire", imgsz=640), _yolo_warmup)
+    models.register("clip", _load_clip, _clip_warmup)
+    return models
+
+
+registry = _build_registry()
+
+
+def warmup_from_settings() -> Dict[str, float]:
+    """Warm the models listed in MODEL_WARMUP (worker start)."""
+    from django.conf import settings
+    names = getattr(settings, "MODEL_WARMUP", [])
+    return registry.warmup(names) if names else {}
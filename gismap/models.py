@@ -1,4 +1,5 @@
 from django.contrib.gis.db import models
+from django.core.validators import MaxValueValidator
 from django.utils import timezone
 
 
@@ -20,6 +21,30 @@ class Camera(models.Model):
         Lieu, on_delete=models.SET_NULL,
         null=True, blank=True, related_name='cameras'
     )
+    # Étage mouvement : les frames statiques sautent l'inférence
+    motion_gating = models.BooleanField(default=False)
+    motion_threshold = models.FloatField(default=0.002)  # part minimale de pixels changés
+    # Mode de décodage ffmpeg pour les analytiques à faible FPS
+    DECODE_MODES = [
+        ('all', 'Toutes les frames'),
+        ('keyframe', 'Images clés uniquement'),
+        ('decimate', 'Frames de référence uniquement'),
+    ]
+    decode_mode = models.CharField(max_length=16, choices=DECODE_MODES, default='all')
+    decode_lowres = models.PositiveSmallIntegerField(default=0, validators=[MaxValueValidator(3)])  # 1: 1/2, 2: 1/4, 3: 1/8 (décodeurs compatibles)
+    # Planification des modèles, ex. {"box": {"every": 3}, "pose": null} (voir gismap/schedule.py)
+    analytic_schedule = models.JSONField(default=dict, blank=True)
+    # Zones d'inférence dessinées sur l'image, polygones [[x, y], ...] normalisés 0..1 (voir gismap/roi.py)
+    roi_polygons = models.JSONField(default=list, blank=True)
+    # Inférence par tuiles sur la pleine résolution, ex. {"enabled": true, "size": 640} (voir gismap/tiling.py)
+    tiling = models.JSONField(default=dict, blank=True)
+    # Priorité opérateur dans le budget d'inférence partagé (voir gismap/budget.py)
+    INFERENCE_PRIORITIES = [
+        (0, 'Basse'),
+        (1, 'Normale'),
+        (2, 'Haute'),
+    ]
+    inference_priority = models.PositiveSmallIntegerField(choices=INFERENCE_PRIORITIES, default=1)
 
     def __str__(self):
         return self.name
@@ -42,6 +67,7 @@ class DetectionMatricule(models.Model):
     timestamp = models.DateTimeField(default=timezone.now)
     est_autorise = models.BooleanField(default=False)
     camera = models.ForeignKey('Camera', on_delete=models.CASCADE)
+    track_id = models.BigIntegerField(null=True, blank=True, db_index=True)  # suivi multi-objets (par caméra)
 
     def __str__(self):
         return f"{self.numero} - {self.camera.name} - {self.timestamp}"
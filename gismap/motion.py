@@ -0,0 +1,174 @@
+# ============================================================================
+# MOTION.PY - Cheap motion stage ahead of inference
+# Downscaled grayscale frame vs running-average background, fully
+# vectorized in OpenCV/NumPy. Static frames skip inference; motion boxes
+# let detectors run on the moving region only.
+# ============================================================================
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import redis
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+STATS_KEY = "stats:motion:{camera_id}"
+
+Box = Tuple[int, int, int, int]
+
+
+class MotionDetector:
+    """
+    Per-camera motion detector.
+
+    update(frame) returns a dict:
+        static        True when the frame can skip inference
+        motion_ratio  fraction of changed pixels (downscaled)
+        boxes         motion bounding boxes in frame coordinates
+    """
+
+    def __init__(self, min_area_ratio: float = 0.002, pixel_threshold: int = 25,
+                 downscale_width: int = 160, alpha: float = 0.05, min_box_ratio: float = 0.0005,
+                 box_padding: float = 0.05, max_static_frames: int = 30):
+        self.min_area_ratio = min_area_ratio
+        self.pixel_threshold = pixel_threshold
+        self.downscale_width = downscale_width
+        self.alpha = alpha
+        self.min_box_ratio = min_box_ratio
+        self.box_padding = box_padding
+        # Run inference at least every N frames even on a static scene
+        self.max_static_frames = max_static_frames
+
+        self.background: Optional[np.ndarray] = None
+        self.static_run = 0
+        # Static inference ROI (frame-size uint8 mask): motion elsewhere is ignored
+        self.roi_mask: Optional[np.ndarray] = None
+        self._small_roi: Optional[np.ndarray] = None
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+
+    def _prepare(self, frame: np.ndarray) -> np.ndarray:
+        h, w = frame.shape[:2]
+        small_h = max(int(h * self.downscale_width / w), 1)
+        small = cv2.resize(frame, (self.downscale_width, small_h), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def update(self, frame: np.ndarray) -> Dict:
+        gray = self._prepare(frame)
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray.astype(np.float32)
+            self.static_run = 0
+            h, w = frame.shape[:2]
+            return {"static": False, "motion_ratio": 1.0, "boxes": [(0, 0, w, h)]}
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        mask = (diff > self.pixel_threshold).astype(np.uint8)
+        mask = cv2.dilate(mask, self._kernel, iterations=2)
+        if self.roi_mask is not None:
+            if self._small_roi is None or self._small_roi.shape != mask.shape:
+                self._small_roi = cv2.resize(self.roi_mask, (mask.shape[1], mask.shape[0]),
+                                             interpolation=cv2.INTER_NEAREST)
+            mask &= self._small_roi
+        motion_ratio = float(mask.mean())
+
+        # Slow background update, so a car that parks becomes background
+        cv2.accumulateWeighted(gray, self.background, self.alpha)
+
+        static = motion_ratio < self.min_area_ratio
+        if static:
+            self.static_run += 1
+            if self.static_run >= self.max_static_frames:
+                # Periodic full refresh so slow scene changes are not missed
+                self.static_run = 0
+                h, w = frame.shape[:2]
+                return {"static": False, "motion_ratio": motion_ratio, "boxes": [(0, 0, w, h)]}
+            return {"static": True, "motion_ratio": motion_ratio, "boxes": []}
+
+        self.static_run = 0
+        return {"static": False, "motion_ratio": motion_ratio, "boxes": self._boxes(mask, frame.shape)}
+
+    def _boxes(self, mask: np.ndarray, frame_shape) -> List[Box]:
+        n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        if n <= 1:
+            return []
+        stats = stats[1:]  # drop background label
+        keep = stats[:, cv2.CC_STAT_AREA] >= self.min_box_ratio * mask.size
+        stats = stats[keep]
+        if not len(stats):
+            return []
+
+        h, w = frame_shape[:2]
+        sx, sy = w / mask.shape[1], h / mask.shape[0]
+        pad_x, pad_y = self.box_padding * w, self.box_padding * h
+        x1 = np.clip(stats[:, cv2.CC_STAT_LEFT] * sx - pad_x, 0, w)
+        y1 = np.clip(stats[:, cv2.CC_STAT_TOP] * sy - pad_y, 0, h)
+        x2 = np.clip((stats[:, cv2.CC_STAT_LEFT] + stats[:, cv2.CC_STAT_WIDTH]) * sx + pad_x, 0, w)
+        y2 = np.clip((stats[:, cv2.CC_STAT_TOP] + stats[:, cv2.CC_STAT_HEIGHT]) * sy + pad_y, 0, h)
+        boxes = np.stack([x1, y1, x2, y2], axis=1).astype(int)
+        return [tuple(b) for b in boxes.tolist()]
+
+
+def union_box(boxes: Iterable[Box]) -> Optional[Box]:
+    boxes = np.asarray(list(boxes))
+    if not len(boxes):
+        return None
+    return int(boxes[:, 0].min()), int(boxes[:, 1].min()), int(boxes[:, 2].max()), int(boxes[:, 3].max())
+
+
+def inference_region(boxes: Iterable[Box], frame_shape, max_area_ratio: float = 0.6,
+                     min_size: int = 96) -> Optional[Box]:
+    """
+    Crop rectangle covering all motion boxes, or None when cropping is not
+    worth it (motion covers most of the frame) and the full frame should be used.
+    """
+    region = union_box(boxes)
+    if region is None:
+        return None
+    h, w = frame_shape[:2]
+    x1, y1, x2, y2 = region
+    # Keep crops large enough for the detectors to see context
+    if x2 - x1 < min_size:
+        cx = (x1 + x2) // 2
+        x1, x2 = max(cx - min_size // 2, 0), min(cx + min_size // 2, w)
+    if y2 - y1 < min_size:
+        cy = (y1 + y2) // 2
+        y1, y2 = max(cy - min_size // 2, 0), min(cy + min_size // 2, h)
+    if (x2 - x1) * (y2 - y1) >= max_area_ratio * w * h:
+        return None
+    return x1, y1, x2, y2
+
+
+# ============================================================================
+# Skip ratio reporting
+# ============================================================================
+def record_motion_stats(camera_id, static: bool):
+    key = STATS_KEY.format(camera_id=camera_id)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hincrby(key, "frames", 1)
+        if static:
+            pipe.hincrby(key, "skipped", 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"[{camera_id}] Redis motion stats error: {e}")
+
+
+def get_motion_stats(camera_ids: Iterable) -> Dict:
+    """{camera_id: {"frames", "skipped", "skip_ratio"}} for the given cameras."""
+    camera_ids = list(camera_ids)
+    pipe = redis_client.pipeline(transaction=False)
+    for camera_id in camera_ids:
+        pipe.hgetall(STATS_KEY.format(camera_id=camera_id))
+    stats = {}
+    for camera_id, raw in zip(camera_ids, pipe.execute()):
+        frames = int(raw.get(b"frames", 0))
+        skipped = int(raw.get(b"skipped", 0))
+        stats[camera_id] = {
+            "frames": frames,
+            "skipped": skipped,
+            "skip_ratio": round(skipped / frames, 3) if frames else 0.0,
+        }
+    return stats
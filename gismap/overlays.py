@@ -0,0 +1,80 @@
+# ============================================================================
+# OVERLAYS.PY - Detection metadata per camera, drawn by the browser
+# Analytics no longer draw boxes and JPEG-encode an annotated copy of each
+# frame: they publish what they found as compact JSON, one layer per model
+# ("best", "box", "pose", "fire"), only on the frames where it ran:
+#     {"layer", "seq", "ts", "size": [w, h],
+#      "objects": [{"bbox": [x1, y1, x2, y2], "class", "conf", "track"}],
+#      "persons": [{"track", "keypoints": [[x, y], ...], "posture"}]}
+# Boxes are in pixels of "size" (detect level); the viewer scales them to
+# whatever level it displays and can toggle each layer. Latest message of a
+# layer is kept at overlay:{camera_id}:{layer} (polled by the stream
+# WebSocket) and also PUBLISHed on the overlay:{camera_id} channel.
+# ============================================================================
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+OVERLAY_KEY = "overlay:{camera_id}:{layer}"
+OVERLAY_CHANNEL = "overlay:{camera_id}"
+LAYERS = ("best", "box", "pose", "fire")
+OVERLAY_TTL = 5  # secondes: un calque périmé disparaît de l'affichage
+
+
+def overlay_keys(camera_id, layers=LAYERS) -> List[str]:
+    return [OVERLAY_KEY.format(camera_id=camera_id, layer=layer) for layer in layers]
+
+
+def overlay_objects(detections: List[Dict]) -> List[Dict]:
+    """Detections (bbox, class_name, confidence, track_id) as overlay objects."""
+    return [{
+        "bbox": [int(v) for v in det["bbox"]],
+        "class": det["class_name"],
+        "conf": round(float(det["confidence"]), 2),
+        "track": det.get("track_id"),
+    } for det in detections]
+
+
+def overlay_message(layer: str, seq: int, shape, objects: List[Dict],
+                    persons: Optional[List[Dict]] = None, timestamp: Optional[float] = None) -> bytes:
+    message = {
+        "layer": layer,
+        "seq": int(seq),
+        "ts": round(timestamp if timestamp is not None else time.time(), 3),
+        "size": [int(shape[1]), int(shape[0])],
+        "objects": objects,
+    }
+    if persons is not None:
+        message["persons"] = persons
+    return json.dumps(message, separators=(",", ":")).encode()
+
+
+def publish_overlays(camera_id, seq: int, shape, layers: Dict[str, List[Dict]],
+                     persons: Optional[List[Dict]] = None, timestamp: Optional[float] = None) -> bool:
+    """
+    Store and publish one frame's detections, {layer: detections}, plus the
+    pose persons as the "pose" layer, in one pipeline round trip.
+    """
+    payloads = {layer: overlay_message(layer, seq, shape, overlay_objects(dets), timestamp=timestamp)
+                for layer, dets in layers.items()}
+    if persons is not None:
+        payloads["pose"] = overlay_message("pose", seq, shape, [], persons, timestamp)
+    if not payloads:
+        return False
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for layer, payload in payloads.items():
+            pipe.set(OVERLAY_KEY.format(camera_id=camera_id, layer=layer), payload, ex=OVERLAY_TTL)
+            pipe.publish(OVERLAY_CHANNEL.format(camera_id=camera_id), payload)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"[{camera_id}] Overlay publish error: {e}")
+        return False
+    return True
@@ -0,0 +1,237 @@
+# ============================================================================
+# POSE_EVENTS.PY - Temporal fall / aggression detection on pose tracks
+# Keypoints of each tracked person (COCO-17, from yolov8s-pose) go into a
+# preallocated ring buffer: (max_tracks, window, 17, 2) plus timestamps.
+# Features are computed for every track at once over its window:
+#     torso angle     shoulders -> hips midpoints, degrees from vertical
+#     height ratio    current keypoint-box height / tallest in the window
+#     drop speed      hip centre descent, body heights per second
+#     wrist speed     fastest wrist, body heights per second
+# An event is only raised once its condition has held for confirm_s
+# (and min_frames frames); then the track is quiet for cooldown_s.
+# ============================================================================
+import logging
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# COCO keypoint indices
+L_SHOULDER, R_SHOULDER = 5, 6
+L_WRIST, R_WRIST = 9, 10
+L_HIP, R_HIP = 11, 12
+NUM_KEYPOINTS = 17
+
+EVENT_FALLEN = "fallen"
+EVENT_AGGRESSION = "aggression"
+
+
+def keypoint_array(persons) -> np.ndarray:
+    """Pose results (per person, list of (x, y)) as one (P, 17, 2) float32 array."""
+    if not len(persons):
+        return np.zeros((0, NUM_KEYPOINTS, 2), np.float32)
+    return np.asarray(persons, dtype=np.float32).reshape(len(persons), NUM_KEYPOINTS, 2)
+
+
+def person_boxes(kps: np.ndarray) -> np.ndarray:
+    """(P, 4) boxes of the visible keypoints (undetected ones are at 0, 0); empty persons get 0 boxes."""
+    visible = (kps > 0).any(axis=2)
+    big = np.float32(1e9)
+    x = kps[..., 0]
+    y = kps[..., 1]
+    x1 = np.where(visible, x, big).min(axis=1)
+    y1 = np.where(visible, y, big).min(axis=1)
+    x2 = np.where(visible, x, -big).max(axis=1)
+    y2 = np.where(visible, y, -big).max(axis=1)
+    boxes = np.stack([x1, y1, x2, y2], axis=1)
+    boxes[~visible.any(axis=1)] = 0
+    return boxes
+
+
+def _midpoint(kps: np.ndarray, a: int, b: int):
+    """Midpoint of two keypoints over (..., 17, 2), NaN when neither is visible."""
+    pa, pb = kps[..., a, :], kps[..., b, :]
+    va = (pa > 0).any(axis=-1, keepdims=True)
+    vb = (pb > 0).any(axis=-1, keepdims=True)
+    total = va.astype(np.float32) + vb
+    mid = (pa * va + pb * vb) / np.maximum(total, 1)
+    return np.where(total > 0, mid, np.nan)
+
+
+class PoseEventEngine:
+    """
+    update(track_ids, keypoints, ts) appends one frame for the given tracks
+    and returns the confirmed events of this frame:
+        [{"type", "track_id", "since", "features": {...}}]
+    """
+
+    def __init__(self, camera_id, window: int = 32, max_tracks: int = 64,
+                 fall_angle: float = 60.0, fall_height_ratio: float = 0.6, fall_drop_speed: float = 0.8,
+                 fall_recent_s: float = 3.0, aggression_wrist_speed: float = 2.5,
+                 confirm_s: float = 1.0, min_frames: int = 2, cooldown_s: float = 60.0, stale_s: float = 10.0):
+        self.camera_id = camera_id
+        self.window = window
+        self.max_tracks = max_tracks
+        self.fall_angle = fall_angle
+        self.fall_height_ratio = fall_height_ratio
+        # A fall is a fast descent (heights/s) seen within fall_recent_s, then a lying posture
+        self.fall_drop_speed = fall_drop_speed
+        self.fall_recent_s = fall_recent_s
+        self.aggression_wrist_speed = aggression_wrist_speed
+        self.confirm_s = confirm_s
+        self.min_frames = min_frames
+        self.cooldown_s = cooldown_s
+        # Tracks not updated for stale_s free their slot
+        self.stale_s = stale_s
+
+        # Ring buffers, one row per slot
+        self.keypoints = np.zeros((max_tracks, window, NUM_KEYPOINTS, 2), np.float32)
+        self.timestamps = np.zeros((max_tracks, window), np.float64)
+        self.head = np.zeros(max_tracks, np.int64)      # next write position
+        self.count = np.zeros(max_tracks, np.int64)     # frames stored (<= window)
+        self.track_of_slot = np.full(max_tracks, -1, np.int64)
+        self.last_seen = np.zeros(max_tracks, np.float64)
+        self.slots: Dict[int, int] = {}
+
+        # Per slot and event type: condition start / hits, last alert
+        self.condition_since = {t: np.full(max_tracks, np.nan) for t in (EVENT_FALLEN, EVENT_AGGRESSION)}
+        self.condition_hits = {t: np.zeros(max_tracks, np.int64) for t in (EVENT_FALLEN, EVENT_AGGRESSION)}
+        self.last_event = {t: np.full(max_tracks, -np.inf) for t in (EVENT_FALLEN, EVENT_AGGRESSION)}
+        self.last_drop = np.full(max_tracks, -np.inf)
+
+    # ------------------------------------------------------------------
+    # Slots
+    # ------------------------------------------------------------------
+    def _free(self, slots: np.ndarray):
+        for slot in slots.tolist():
+            self.slots.pop(int(self.track_of_slot[slot]), None)
+        self.track_of_slot[slots] = -1
+        self.count[slots] = 0
+        self.head[slots] = 0
+        self.last_drop[slots] = -np.inf
+        for event in self.condition_since:
+            self.condition_since[event][slots] = np.nan
+            self.condition_hits[event][slots] = 0
+            self.last_event[event][slots] = -np.inf
+
+    def _slots_for(self, track_ids: List[int], now: float) -> np.ndarray:
+        stale = np.flatnonzero((self.track_of_slot >= 0) & (now - self.last_seen > self.stale_s))
+        if len(stale):
+            self._free(stale)
+        slots = np.full(len(track_ids), -1, np.int64)
+        for i, track_id in enumerate(track_ids):
+            slot = self.slots.get(track_id)
+            if slot is None:
+                free = np.flatnonzero(self.track_of_slot < 0)
+                if not len(free):
+                    # Full: the least recently seen track gives its slot away
+                    free = np.array([int(np.argmin(np.where(self.track_of_slot >= 0, self.last_seen, np.inf)))])
+                    self._free(free)
+                slot = int(free[0])
+                self.slots[track_id] = slot
+                self.track_of_slot[slot] = track_id
+            slots[i] = slot
+        return slots
+
+    # ------------------------------------------------------------------
+    # Features
+    # ------------------------------------------------------------------
+    def _windows(self, slots: np.ndarray):
+        """Chronological (S, W, 17, 2) keypoints, (S, W) timestamps and validity."""
+        order = (self.head[slots, None] + np.arange(self.window)[None, :]) % self.window
+        kps = self.keypoints[slots[:, None], order]
+        ts = self.timestamps[slots[:, None], order]
+        valid = np.arange(self.window)[None, :] >= (self.window - self.count[slots])[:, None]
+        return kps, ts, valid
+
+    def features(self, slots: np.ndarray) -> Dict[str, np.ndarray]:
+        """Per slot (vectorized): torso_angle, height_ratio, drop_speed, wrist_speed of the latest frame."""
+        kps, ts, valid = self._windows(slots)
+        visible = (kps > 0).any(axis=-1)                                   # (S, W, 17)
+        ys = kps[..., 1]
+        height = np.where(visible, ys, -np.inf).max(axis=-1) - np.where(visible, ys, np.inf).min(axis=-1)
+        height = np.where(valid & visible.any(axis=-1), height, np.nan)  # (S, W)
+
+        shoulders = _midpoint(kps, L_SHOULDER, R_SHOULDER)
+        hips = _midpoint(kps, L_HIP, R_HIP)
+        torso = shoulders - hips
+        angle = np.degrees(np.arctan2(np.abs(torso[..., 0]), np.abs(torso[..., 1])))
+
+        ref_height = np.where(np.isnan(height), -np.inf, height).max(axis=1)  # tallest in window
+        last_height = height[:, -1]
+        # Previous valid frame for the speeds
+        dt = ts[:, -1] - ts[:, -2]
+        has_prev = valid[:, -2] & (dt > 0)
+        scale = np.where(np.isfinite(ref_height) & (ref_height > 0), ref_height, np.nan)
+        wrists = kps[:, :, [L_WRIST, R_WRIST], :]
+        wrist_visible = visible[:, -1, [L_WRIST, R_WRIST]] & visible[:, -2, [L_WRIST, R_WRIST]]
+        wrist_move = np.linalg.norm(wrists[:, -1] - wrists[:, -2], axis=-1)  # (S, 2)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            drop = (hips[:, -1, 1] - hips[:, -2, 1]) / (dt * scale)
+            wrist_speed = np.where(wrist_visible, wrist_move, 0).max(axis=1) / (dt * scale)
+            return {
+                "torso_angle": angle[:, -1],
+                "height_ratio": last_height / scale,
+                "drop_speed": np.where(has_prev, drop, np.nan),
+                "wrist_speed": np.where(has_prev, wrist_speed, np.nan),
+            }
+
+    # ------------------------------------------------------------------
+    # Update
+    # ------------------------------------------------------------------
+    def _confirm(self, event: str, slots: np.ndarray, condition: np.ndarray, now: float) -> np.ndarray:
+        since = self.condition_since[event]
+        hits = self.condition_hits[event]
+        started = condition & np.isnan(since[slots])
+        since[slots[started]] = now
+        since[slots[~condition]] = np.nan
+        hits[slots] = np.where(condition, hits[slots] + 1, 0)
+        confirmed = (condition & (now - since[slots] >= self.confirm_s) & (hits[slots] >= self.min_frames)
+                     & (now - self.last_event[event][slots] >= self.cooldown_s))
+        self.last_event[event][slots[confirmed]] = now
+        return confirmed
+
+    def update(self, track_ids: List[int], keypoints: np.ndarray, ts: Optional[float] = None) -> List[Dict]:
+        now = time.time() if ts is None else ts
+        if not len(track_ids):
+            return []
+        slots = self._slots_for(list(track_ids), now)
+        pos = self.head[slots]
+        self.keypoints[slots, pos] = keypoints
+        self.timestamps[slots, pos] = now
+        self.head[slots] = (pos + 1) % self.window
+        self.count[slots] = np.minimum(self.count[slots] + 1, self.window)
+        self.last_seen[slots] = now
+
+        feats = self.features(slots)
+        with np.errstate(invalid="ignore"):
+            dropping = feats["drop_speed"] >= self.fall_drop_speed
+            self.last_drop[slots[dropping]] = now
+            lying = (feats["torso_angle"] >= self.fall_angle) & (feats["height_ratio"] <= self.fall_height_ratio)
+            fallen = lying & (now - self.last_drop[slots] <= self.fall_recent_s + self.confirm_s)
+            aggressive = feats["wrist_speed"] >= self.aggression_wrist_speed
+
+        events = []
+        for event, condition in ((EVENT_FALLEN, fallen), (EVENT_AGGRESSION, aggressive)):
+            for i in np.flatnonzero(self._confirm(event, slots, condition, now)).tolist():
+                events.append({
+                    "type": event,
+                    "track_id": int(track_ids[i]),
+                    "since": float(self.condition_since[event][slots[i]]),
+                    "features": {name: None if np.isnan(values[i]) else round(float(values[i]), 2)
+                                 for name, values in feats.items()},
+                })
+        return events
+
+    def postures(self, track_ids: List[int]) -> Dict[int, str]:
+        """Current posture of tracks held in the buffer: "lying" / "upright" (logging, overlays)."""
+        known = [t for t in track_ids if t in self.slots]
+        if not known:
+            return {}
+        feats = self.features(np.array([self.slots[t] for t in known]))
+        with np.errstate(invalid="ignore"):
+            lying = (feats["torso_angle"] >= self.fall_angle) & (feats["height_ratio"] <= self.fall_height_ratio)
+        return {t: "lying" if l else "upright" for t, l in zip(known, lying.tolist())}
@@ -0,0 +1,191 @@
+# ============================================================================
+# RESULT_CACHE.PY - Reuse analytic results while the scene does not change
+# Each frame gets a difference hash (dHash) of its downsampled grayscale
+# image: 16x16 = 256 bits, a few microseconds on the detect level. When a
+# recent entry of the same camera / analytic is within max_distance bits,
+# its result is reused instead of running YOLO / CLIP again, for at most
+# max_age_s (moving objects too small to flip a bit are picked up again).
+# Dict results merge the models run on different frames; each model key
+# keeps its own timestamp, so a merge never extends an older model result.
+# Entries of all cameras share one LRU (max_entries), a few per camera.
+# Hits / misses are counted per camera at stats:result_cache:{camera_id}.
+# ============================================================================
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import cv2
+import numpy as np
+import redis
+from django.conf import settings
+
+from gismap.metrics import count
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+STATS_KEY = "stats:result_cache:{camera_id}"
+HASH_SIZE = 16
+
+# Bits set in each byte value, for the Hamming distance of packed hashes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+
+def frame_hash(frame: np.ndarray, hash_size: int = HASH_SIZE) -> np.ndarray:
+    """dHash of a BGR / gray frame: hash_size^2 bits packed in uint8."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1])
+
+
+def hamming(hashes: np.ndarray, h: np.ndarray) -> np.ndarray:
+    """Bit distance between each row of (K, B) packed hashes and one hash."""
+    return _POPCOUNT[np.bitwise_xor(hashes, h)].sum(axis=-1)
+
+
+class ResultCache:
+    """
+    get(camera_id, analytic, h) returns a deep copy of the last result of a
+    near-identical frame (None on miss); put() stores a new one. Thread-safe:
+    one instance is shared by the camera threads of a worker.
+    """
+
+    def __init__(self, max_entries: int = 256, per_camera: int = 4, max_age_s: float = 2.0,
+                 max_distance: int = 6):
+        self.max_entries = max_entries
+        self.per_camera = per_camera
+        self.max_age_s = max_age_s
+        self.max_distance = max_distance
+        # (camera_id, analytic, entry id) -> {"hash", "ts", "value", "key_ts"}, least recently used first
+        # ("ts": newest key; "key_ts": {key: ts} of a dict value, None otherwise)
+        self._entries: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        self._ids = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _candidates(self, camera_id, analytic, now: float, max_age: float):
+        keys = [key for key in self._entries if key[0] == camera_id and key[1] == analytic]
+        expired = [key for key in keys if now - self._entries[key]["ts"] > max_age]
+        for key in expired:
+            del self._entries[key]
+        return [key for key in keys if key not in expired]
+
+    @staticmethod
+    def _fresh(entry: Dict, now: float, max_age: float):
+        """The entry value without its dict keys older than max_age."""
+        if entry["key_ts"] is None:
+            return entry["value"]
+        return {name: result for name, result in entry["value"].items()
+                if now - entry["key_ts"][name] <= max_age}
+
+    def _nearest(self, keys, h: np.ndarray):
+        if not keys:
+            return None, None
+        distances = hamming(np.stack([self._entries[key]["hash"] for key in keys]), h)
+        best = int(np.argmin(distances))
+        return keys[best], int(distances[best])
+
+    def get(self, camera_id, analytic: str, h: np.ndarray, require: Iterable[str] = (),
+            max_age: Optional[float] = None) -> Optional[Any]:
+        """Cached result for a near-identical frame; with `require`, only if it holds all those keys."""
+        now = time.time()
+        max_age = self.max_age_s if max_age is None else max_age
+        with self._lock:
+            keys = self._candidates(camera_id, analytic, now, max_age)
+            key, distance = self._nearest(keys, h)
+            hit = key is not None and distance <= self.max_distance
+            if hit:
+                value = self._fresh(self._entries[key], now, max_age)
+                if require and not all(name in value for name in require):
+                    hit = False
+            if hit:
+                self._entries.move_to_end(key)
+                value = copy.deepcopy(value)
+                self.hits += 1
+            else:
+                value = None
+                self.misses += 1
+        record_cache_stats(camera_id, analytic, hit)
+        count("result_cache_hits" if hit else "result_cache_misses", camera_id, analytic)
+        return value
+
+    def put(self, camera_id, analytic: str, h: np.ndarray, value: Any):
+        """
+        Store a result. Dict results of the same (near-identical) frame are
+        merged, so models scheduled on different frames fill one entry.
+        """
+        now = time.time()
+        key_ts = dict.fromkeys(value, now) if isinstance(value, dict) else None
+        with self._lock:
+            keys = self._candidates(camera_id, analytic, now, self.max_age_s)
+            key, distance = self._nearest(keys, h)
+            if key is not None and distance <= self.max_distance and key_ts is not None:
+                old = self._entries.pop(key)
+                keys.remove(key)
+                # Older model results keep their own timestamp (stale ones are dropped)
+                if old["key_ts"] is not None:
+                    kept = self._fresh(old, now, self.max_age_s)
+                    value = {**kept, **value}
+                    key_ts = {**{name: old["key_ts"][name] for name in kept}, **key_ts}
+            # Per camera: the oldest entries go first
+            for old in keys[:max(len(keys) - self.per_camera + 1, 0)]:
+                del self._entries[old]
+            self._ids += 1
+            self._entries[(camera_id, analytic, self._ids)] = {
+                "hash": h, "ts": now, "value": copy.deepcopy(value), "key_ts": key_ts}
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, camera_id, analytic: Optional[str] = None):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == camera_id and analytic in (None, k[1])]:
+                del self._entries[key]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def record_cache_stats(camera_id, analytic: str, hit: bool):
+    try:
+        redis_client.hincrby(STATS_KEY.format(camera_id=camera_id), f"{analytic}:{'hits' if hit else 'misses'}", 1)
+    except redis.RedisError as e:
+        logger.error(f"[{camera_id}] Redis result cache stats error: {e}")
+
+
+def get_cache_stats(camera_ids: Iterable) -> Dict:
+    """{camera_id: {analytic: {"hits", "misses", "hit_ratio"}}} for the given cameras."""
+    camera_ids = list(camera_ids)
+    pipe = redis_client.pipeline(transaction=False)
+    for camera_id in camera_ids:
+        pipe.hgetall(STATS_KEY.format(camera_id=camera_id))
+    stats = {}
+    for camera_id, raw in zip(camera_ids, pipe.execute()):
+        analytics: Dict[str, Dict] = {}
+        for field, value in raw.items():
+            analytic, kind = field.decode().rsplit(":", 1)
+            analytics.setdefault(analytic, {"hits": 0, "misses": 0})[kind] = int(value)
+        for counts in analytics.values():
+            lookups = counts["hits"] + counts["misses"]
+            counts["hit_ratio"] = round(counts["hits"] / lookups, 3) if lookups else 0.0
+        stats[camera_id] = analytics
+    return stats
+
+
+# One cache per worker process, shared by all its cameras
+result_cache = ResultCache(
+    max_entries=getattr(settings, "RESULT_CACHE_SIZE", 256),
+    max_age_s=getattr(settings, "RESULT_CACHE_MAX_AGE", 2.0),
+    max_distance=getattr(settings, "RESULT_CACHE_MAX_DISTANCE", 6),
+)
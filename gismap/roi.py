@@ -0,0 +1,165 @@
+# ============================================================================
+# ROI.PY - Per-camera static inference regions, in image space
+# Camera.roi_polygons holds polygons drawn on the camera image (editor at
+# /camera/<id>/roi/), in normalized coordinates (0..1) so they apply to
+# every pyramid level. They are compiled once per frame size into:
+#     mask     uint8 HxW, 1 inside the union of the polygons
+#     rects    bounding rectangles of the polygons (overlapping ones merged)
+# Detectors only run on the rects; detections mostly outside the mask are
+# dropped before drawing / alerting. Unrelated to Lieu polygons (map space).
+# ============================================================================
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+Box = Tuple[int, int, int, int]
+
+
+def validate_polygons(polygons) -> List[List[List[float]]]:
+    """Normalized polygons from editor / API input; ValueError when malformed."""
+    if not isinstance(polygons, list):
+        raise ValueError("roi_polygons must be a list of polygons")
+    cleaned = []
+    for polygon in polygons:
+        points = np.asarray(polygon, dtype=np.float64)
+        if points.ndim != 2 or points.shape[1] != 2 or len(points) < 3:
+            raise ValueError("Each polygon needs at least 3 [x, y] points")
+        if not np.isfinite(points).all() or points.min() < 0 or points.max() > 1:
+            raise ValueError("Polygon coordinates must be normalized between 0 and 1")
+        cleaned.append(np.round(points, 4).tolist())
+    return cleaned
+
+
+def merge_rects(rects: Sequence[Box]) -> List[Box]:
+    """Union of overlapping rectangles, until none overlap."""
+    rects = [list(r) for r in rects]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rects[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(r) for r in rects]
+
+
+def intersect(a: Box, b: Box) -> Optional[Box]:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    return (x1, y1, x2, y2) if x2 > x1 and y2 > y1 else None
+
+
+class RoiMask:
+    """
+    Compiled ROI of one camera. No polygons means the whole image (every
+    method is then a no-op), so cameras without an ROI behave as before.
+    """
+
+    def __init__(self, polygons: Optional[List] = None, min_inside: float = 0.5):
+        self.polygons = [np.asarray(p, dtype=np.float64) for p in (polygons or [])]
+        # Fraction of a detection box that must lie in the ROI to keep it
+        self.min_inside = min_inside
+        self._compiled: Dict[Tuple[int, int], Dict] = {}
+
+    def __bool__(self):
+        return bool(self.polygons)
+
+    def compile(self, shape) -> Optional[Dict]:
+        """{"mask", "integral", "rects", "coverage"} for a frame size, cached."""
+        if not self.polygons:
+            return None
+        h, w = shape[:2]
+        compiled = self._compiled.get((h, w))
+        if compiled is None:
+            scale = np.array([w, h], dtype=np.float64)
+            points = [np.round(p * scale).astype(np.int32) for p in self.polygons]
+            mask = np.zeros((h, w), np.uint8)
+            cv2.fillPoly(mask, points, 1)
+            rects = []
+            for pts in points:
+                x, y, bw, bh = cv2.boundingRect(pts)
+                rect = intersect((x, y, x + bw, y + bh), (0, 0, w, h))
+                if rect is not None:
+                    rects.append(rect)
+            compiled = {
+                "mask": mask,
+                # Summed-area table: pixels of the mask inside any box in O(1)
+                "integral": cv2.integral(mask, sdepth=cv2.CV_32S),
+                "rects": merge_rects(rects),
+                "coverage": float(mask.mean()),
+            }
+            self._compiled[(h, w)] = compiled
+        return compiled
+
+    def mask(self, shape) -> Optional[np.ndarray]:
+        compiled = self.compile(shape)
+        return compiled["mask"] if compiled else None
+
+    def rects(self, shape) -> Optional[List[Box]]:
+        compiled = self.compile(shape)
+        return list(compiled["rects"]) if compiled else None
+
+    def restrict(self, regions: Optional[List[Box]], shape) -> Optional[List[Box]]:
+        """
+        Scheduler regions (None: full frame) cut to the ROI rectangles.
+        An empty list means nothing of the ROI is left to look at.
+        """
+        rects = self.rects(shape)
+        if rects is None:
+            return regions
+        if regions is None:
+            return rects
+        return [r for region in regions for rect in rects
+                for r in [intersect(tuple(region), rect)] if r is not None]
+
+    def restrict_plan(self, plan: Dict[str, Optional[List[Box]]], shape) -> Dict[str, Optional[List[Box]]]:
+        """A schedule plan cut to the ROI; models with nothing left are removed."""
+        if not self.polygons:
+            return plan
+        restricted = {model: self.restrict(regions, shape) for model, regions in plan.items()}
+        return {model: regions for model, regions in restricted.items() if regions}
+
+    def inside_ratio(self, boxes, shape) -> np.ndarray:
+        """Fraction of each (N, 4) box covered by the ROI mask (vectorized)."""
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        compiled = self.compile(shape)
+        if compiled is None:
+            return np.ones(len(boxes))
+        h, w = shape[:2]
+        x1 = np.clip(boxes[:, 0], 0, w)
+        y1 = np.clip(boxes[:, 1], 0, h)
+        x2 = np.clip(boxes[:, 2], 0, w)
+        y2 = np.clip(boxes[:, 3], 0, h)
+        integral = compiled["integral"]
+        inside = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+        area = np.maximum((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]), 1)
+        return inside / area
+
+    def filter(self, detections: List[Dict], shape) -> List[Dict]:
+        """Detections with at least min_inside of their box in the ROI."""
+        if not self.polygons or not detections:
+            return detections
+        keep = self.inside_ratio([det["bbox"] for det in detections], shape) >= self.min_inside
+        return [det for det, k in zip(detections, keep) if k]
+
+    def filter_boxes(self, boxes: List[Box], shape) -> np.ndarray:
+        """Boolean keep-mask for plain boxes (e.g. pose persons from their keypoints)."""
+        if not self.polygons or not len(boxes):
+            return np.ones(len(boxes), dtype=bool)
+        return self.inside_ratio(boxes, shape) >= self.min_inside
+
+
+def load_roi(camera_id: int) -> RoiMask:
+    from gismap.models import Camera
+    polygons = Camera.objects.filter(id=camera_id).values_list("roi_polygons", flat=True).first()
+    return RoiMask(polygons or [])
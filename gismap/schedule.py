@@ -0,0 +1,184 @@
+# ============================================================================
+# SCHEDULE.PY - Per-camera analytic schedule for the detection loop
+# Declares, per model, how often it runs and on which condition, e.g.
+#     plates (best.pt) every frame, boxes every 2nd frame,
+#     pose only while a person was seen recently, on person crops only.
+# Defaults below, overridden per camera by Camera.analytic_schedule.
+# Each model's runs / skips / images are counted per camera (budget).
+# ============================================================================
+import copy
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import redis
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+STATS_KEY = "stats:schedule:{camera_id}"
+
+Box = Tuple[int, int, int, int]
+
+# Rule keys:
+#   every        run on 1 frame out of N (of the frames that pass the motion gate)
+#   requires     class names: run only if one was seen in the last recent_s seconds
+#   probe_every  without recent classes, still run on the full frame 1 time out of N
+#   crops        run on padded crops around the required classes instead of the frame
+#   motion       run on the motion region (False: always the full frame)
+DEFAULT_SCHEDULE = {
+    "best": {"every": 1},
+    "box": {"every": 2},
+    "pose": {"every": 1, "requires": ["person"], "recent_s": 5.0, "probe_every": 10,
+             "crops": True, "motion": False},
+}
+
+
+def merge_schedule(overrides: Optional[Dict]) -> Dict:
+    """DEFAULT_SCHEDULE with per-model overrides; {"model": null} disables a model."""
+    schedule = copy.deepcopy(DEFAULT_SCHEDULE)
+    for model, rule in (overrides or {}).items():
+        if rule is None:
+            schedule.pop(model, None)
+        else:
+            schedule.setdefault(model, {}).update(rule)
+    return schedule
+
+
+def pad_boxes(boxes: Iterable[Box], frame_shape, padding: float = 0.2, min_size: int = 64) -> List[Box]:
+    """Crops around detections: padded by a fraction of their size, at least min_size, clipped."""
+    boxes = np.asarray(list(boxes), dtype=np.float32).reshape(-1, 4)
+    if not len(boxes):
+        return []
+    h, w = frame_shape[:2]
+    wh = boxes[:, 2:] - boxes[:, :2]
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+    half = np.maximum(wh * (1 + 2 * padding), min_size) / 2
+    x1y1 = np.clip(centers - half, 0, [w, h])
+    x2y2 = np.clip(centers + half, 0, [w, h])
+    padded = np.concatenate([x1y1, x2y2], axis=1).astype(int)
+    return [tuple(b) for b in padded.tolist()]
+
+
+def keypoint_boxes(keypoints) -> List[Box]:
+    """Bounding box of each person's keypoints (undetected keypoints are at 0, 0)."""
+    boxes = []
+    for person in keypoints:
+        kps = np.asarray(person, dtype=np.float32).reshape(-1, 2)
+        kps = kps[(kps > 0).any(axis=1)]
+        if len(kps):
+            x1, y1 = kps.min(axis=0)
+            x2, y2 = kps.max(axis=0)
+            boxes.append((int(x1), int(y1), int(x2), int(y2)))
+    return boxes
+
+
+class AnalyticSchedule:
+    """
+    plan() says which models run on the current frame and on which regions;
+    observe() feeds back what was detected so conditional models follow it.
+    """
+
+    def __init__(self, camera_id, schedule: Optional[Dict] = None):
+        self.camera_id = camera_id
+        self.rules = merge_schedule(schedule)
+        self.frame_index = 0
+        self.last_seen: Dict[str, float] = {}
+        self.last_boxes: Dict[str, List[Box]] = {}
+
+    def plan(self, frame_shape, motion_region: Optional[Box] = None,
+             now: Optional[float] = None) -> Dict[str, Optional[List[Box]]]:
+        """{model: regions} for this frame; regions None means the full frame."""
+        now = time.time() if now is None else now
+        index = self.frame_index
+        self.frame_index += 1
+
+        plan = {}
+        for model, rule in self.rules.items():
+            if index % max(int(rule.get("every", 1)), 1):
+                continue
+            requires = rule.get("requires")
+            if requires:
+                recent = [c for c in requires if now - self.last_seen.get(c, float("-inf")) <= rule.get("recent_s", 5.0)]
+                if not recent:
+                    probe_every = rule.get("probe_every")
+                    if probe_every and index % int(probe_every) == 0:
+                        plan[model] = None
+                    continue
+                if rule.get("crops"):
+                    boxes = [box for c in recent for box in self.last_boxes.get(c, [])]
+                    # Seen recently but not on the last frame: search the whole frame
+                    plan[model] = pad_boxes(boxes, frame_shape) or None
+                    continue
+            if rule.get("motion", True) and motion_region is not None:
+                plan[model] = [motion_region]
+            else:
+                plan[model] = None
+        return plan
+
+    def _seen(self, class_name: str, boxes: List[Box], now: float):
+        self.last_seen[class_name] = now
+        self.last_boxes[class_name] = boxes
+
+    def observe(self, model: str, detections: List[Dict], now: Optional[float] = None):
+        """Detections of a model that ran: refresh the classes they contain."""
+        now = time.time() if now is None else now
+        by_class: Dict[str, List[Box]] = {}
+        for det in detections:
+            by_class.setdefault(det["class_name"].lower(), []).append(tuple(det["bbox"]))
+        for class_name, boxes in by_class.items():
+            self._seen(class_name, boxes, now)
+
+    def observe_persons(self, keypoints, now: Optional[float] = None):
+        """Pose results keep "person" alive (and give the next crops)."""
+        boxes = keypoint_boxes(keypoints)
+        if boxes:
+            self._seen("person", boxes, time.time() if now is None else now)
+        else:
+            # Nobody in the crops: next run searches the whole frame while still recent
+            self.last_boxes["person"] = []
+
+    def record(self, plan: Dict[str, Optional[List[Box]]], elapsed_ms: Optional[Dict[str, float]] = None,
+               tiles: Optional[Dict[str, List[Box]]] = None):
+        """Per-camera budget: frames seen, runs, images (crops, tiles) and time of each model."""
+        key = STATS_KEY.format(camera_id=self.camera_id)
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hincrby(key, "frames", 1)
+            for model in self.rules:
+                if model in plan:
+                    regions = plan[model]
+                    pipe.hincrby(key, f"{model}:runs", 1)
+                    pipe.hincrby(key, f"{model}:images", 1 if regions is None else len(regions))
+                    if tiles and model in tiles:
+                        pipe.hincrby(key, f"{model}:tiles", len(tiles[model]))
+                    if elapsed_ms and model in elapsed_ms:
+                        pipe.hincrbyfloat(key, f"{model}:ms", elapsed_ms[model])
+                else:
+                    pipe.hincrby(key, f"{model}:skipped", 1)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.error(f"[{self.camera_id}] Redis schedule stats error: {e}")
+
+
+def get_schedule_stats(camera_ids: Iterable) -> Dict:
+    """{camera_id: {"frames", "models": {model: {"runs", "skipped", "images", "run_ratio", "ms"...}}}}"""
+    camera_ids = list(camera_ids)
+    pipe = redis_client.pipeline(transaction=False)
+    for camera_id in camera_ids:
+        pipe.hgetall(STATS_KEY.format(camera_id=camera_id))
+    stats = {}
+    for camera_id, raw in zip(camera_ids, pipe.execute()):
+        frames = int(raw.pop(b"frames", 0))
+        models: Dict[str, Dict] = {}
+        for field, value in raw.items():
+            model, counter = field.decode().split(":", 1)
+            models.setdefault(model, {})[counter] = float(value) if counter == "ms" else int(value)
+        for model, counters in models.items():
+            counters["run_ratio"] = round(counters.get("runs", 0) / frames, 3) if frames else 0.0
+            if "ms" in counters:
+                counters["ms_per_run"] = round(counters["ms"] / max(counters.get("runs", 1), 1), 1)
+        stats[camera_id] = {"frames": frames, "models": models}
+    return stats
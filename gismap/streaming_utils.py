@@ -1,8 +1,8 @@
 # streaming_utils.py
-running_streams = set()
+from gismap.leases import LeaseRegistry
+
+ingest_leases = LeaseRegistry("ingest")
 
 def should_start_stream(camera_id):
-    if camera_id not in running_streams:
-        running_streams.add(camera_id)
-        return True
-    return False
+    """True when no node currently holds the ingest lease of this camera."""
+    return ingest_leases.owner(camera_id) is None
@@ -1,15 +1,24 @@
 import cv2
 import numpy as np
-import torch
 import redis
 import time
-import gc
 import logging
 import json
-from ultralytics import YOLO
+import threading
+from typing import List, Tuple
 from celery import shared_task
-import clip
-from PIL import Image
+from django.conf import settings
+from gismap.clip_prompts import describe, positive_fire_prompts
+from gismap.fire_prefilter import FirePrefilter, record_cascade_stats
+from gismap.frame_bus import FrameBusConsumer
+from gismap.inference_server import model_images, offset_detections
+from gismap.leases import LeaseRegistry, default_node_id
+from gismap.metrics import count, observe_stage, timed
+from gismap.model_registry import free_memory, registry
+from gismap.overlays import publish_overlays
+from gismap.result_cache import frame_hash, result_cache
+from gismap.roi import load_roi
+from gismap.tracking import Tracker
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,139 +26,201 @@ logger = logging.getLogger(__name__)
 # Redis client
 r = redis.StrictRedis(host="localhost", port=6379, db=0, socket_timeout=5)
 
-# Device (GPU si disponible)
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
-# Charger modèle YOLO Fire (modèle entraîné)
-model_fire = YOLO("gismap/yolo/best (1).pt").to(device)
-
-# Charger modèle CLIP
-clip_model, clip_preprocess = clip.load("ViT-B/32", device=device)
+# Modèles YOLO Fire et CLIP ViT-B/32: chargés au premier usage par le
+# registre (gismap/model_registry.py), pas à l'import du module.
+# Cascade par frame (gismap/fire_prefilter.py): pré-filtre couleur / scintillement,
+# puis YOLO feu sur les candidates, puis CLIP pour confirmer les boîtes YOLO
+
+# État par caméra conservé d'une exécution de la tâche à l'autre (quelques
+# itérations chacune): passage périodique, maintien et historique de
+# scintillement du pré-filtre, pistes du tracker. Reconstruit après
+# STATE_TTL secondes sans frame (historique trop ancien pour être fiable).
+STATE_TTL = 60.0
+_camera_states = {}
+_states_lock = threading.Lock()
+
+
+def camera_state(camera_id: int, conf_threshold: float) -> dict:
+    """{"prefilter", "tracker", "ts"} de la caméra dans ce processus."""
+    now = time.monotonic()
+    with _states_lock:
+        state = _camera_states.get(camera_id)
+        if state is None or now - state["ts"] > STATE_TTL:
+            state = _camera_states[camera_id] = {
+                "prefilter": FirePrefilter(
+                    min_flame_ratio=getattr(settings, "FIRE_PREFILTER_MIN_RATIO", 0.0005),
+                    min_flicker=getattr(settings, "FIRE_PREFILTER_MIN_FLICKER", 0.1),
+                ),
+                "tracker": Tracker(camera_id, high_conf=conf_threshold),
+                "ts": now,
+            }
+        # Every fire box YOLO keeps starts a track (no weak / strong split)
+        state["tracker"].high_conf = conf_threshold
+        return state
 
 
-def generate_clip_description(frame: np.ndarray) -> str:
+def generate_clip_descriptions(images: List[np.ndarray]) -> Tuple[List[str], bool]:
     """
-    Génère une description avec CLIP sur l'image passée.
-    Retourne le prompt le plus probable avec sa confiance.
+    Décrit toutes les images d'une frame avec CLIP, en une seule passe
+    encode_image (embeddings des prompts en cache, gismap/clip_prompts.py).
+    Retourne pour chacune le prompt le plus probable avec sa confiance, et
+    True si au moins une image est confirmée comme feu. Si CLIP échoue, la
+    détection YOLO n'est pas écartée.
     """
     try:
-        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        image_input = clip_preprocess(image).unsqueeze(0).to(device)
-
-        prompts = [
-            "A photo showing fire",
-            "Smoke and fire are visible",
-            "Flames and smoke in the image",
-            "A photo of burning fire",
-            "No fire in the image",
-            "No flames or smoke"
-        ]
-        text_tokens = clip.tokenize(prompts).to(device)
-
-        with torch.no_grad():
-            image_features = clip_model.encode_image(image_input)
-            text_features = clip_model.encode_text(text_tokens)
-            similarities = (image_features @ text_features.T).softmax(dim=-1)
-
-            best_idx = similarities.argmax().item()
-            confidence = similarities[0, best_idx].item()
-
-            return f"{prompts[best_idx]} (confidence={confidence:.2f})"
-
+        results = describe(registry.get("clip"), images)
     except Exception as e:
         logger.error(f"❌ CLIP description error: {e}")
-        return "Description unavailable"
+        return ["Description unavailable"] * len(images), True
+    fire = set(positive_fire_prompts())
+    descriptions = [f"{prompt} (confidence={confidence:.2f})" for prompt, confidence in results]
+    return descriptions, any(prompt in fire for prompt, _ in results)
+
+
+def generate_clip_description(frame: np.ndarray) -> str:
+    """Description CLIP d'une seule image."""
+    return generate_clip_descriptions([frame])[0][0]
 
 
 @shared_task
 def detect_fire_from_redis(camera_id: int, max_iterations: int = 5, conf_threshold: float = 0.25):
     from gismap.tasks.notification_tasks import send_fire_alert
 
+    lease = LeaseRegistry("fire", node_id=default_node_id(unique=True))
+    lease.clear_pending(camera_id)
+    if not lease.acquire(camera_id):
+        logger.info(f"[{camera_id}] Fire detection already owned by {lease.owner(camera_id)}, skipping")
+        return {"camera_id": camera_id, "iterations": 0}
+
     logger.info(f"🔥 Start fire detection for camera {camera_id}")
     iterations = 0
+    bus = None
 
     try:
+        bus = FrameBusConsumer(camera_id, group="fire")
+        # Pré-filtre et tracker survivent aux exécutions courtes de la tâche
+        state = camera_state(camera_id, conf_threshold)
+        tracker = state["tracker"]
+        prefilter = state["prefilter"]
+        # Zones d'inférence de la caméra (toute l'image si aucune), relues à chaque exécution
+        roi = load_roi(camera_id)
+        prefilter.roi_mask = roi.mask((384, 640))
         while iterations < max_iterations:
-            jpeg_bytes = r.get(f"camera:{camera_id}:frame")
-            if not jpeg_bytes:
-                logger.debug(f"[{camera_id}] No frame found in Redis, waiting...")
-                time.sleep(0.5)
+            if not lease.keep(camera_id):
+                logger.warning(f"[{camera_id}] Fire detection lease lost, stopping")
+                break
+
+            with timed("bus_read", camera_id):
+                entry = bus.read()
+            if entry is None:
+                logger.debug(f"[{camera_id}] No new frame on the bus, waiting...")
                 continue
-
-            np_arr = np.frombuffer(jpeg_bytes, np.uint8)
-            frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-            if frame is None:
-                logger.warning(f"[{camera_id}] Failed to decode frame")
-                time.sleep(0.2)
-                continue
-
-            frame = cv2.resize(frame, (640, 384))
-            logger.info(f"[{camera_id}] Frame shape: {frame.shape}, dtype: {frame.dtype}")
-
-            # YOLO prediction
-            detections = model_fire.predict(source=frame, conf=conf_threshold, device=device, verbose=True)
+            frame_started = time.perf_counter()
+            state["ts"] = time.monotonic()
+
+            frame = entry["frame"]
+            frame = frame.copy() if frame.shape[:2] == (384, 640) else cv2.resize(frame, (640, 384))
+            logger.debug(f"[{camera_id}] Frame shape: {frame.shape}, dtype: {frame.dtype}")
+
+            # 1. Pré-filtre: pas de pixels flamme qui scintillent, pas de YOLO ni de CLIP
+            with timed("fire_prefilter", camera_id):
+                candidate = prefilter.update(frame)["candidate"]
+            cached = None
+            if not candidate:
+                detections = []
+            else:
+                # Scène inchangée: détections YOLO et descriptions CLIP du cache
+                scene_hash = frame_hash(frame)
+                cached = result_cache.get(camera_id, "fire", scene_hash)
+            if cached is not None:
+                detections = cached["detections"]
+            elif candidate:
+                # 2. YOLO feu sur les frames candidates
+                model_fire = registry.get("fire")
+                images = model_images(frame, roi.rects(frame.shape))
+                with timed("inference", camera_id, "fire"):
+                    found = model_fire.detect_batch([image for image, _ in images], conf_threshold)
+                detections = [det for (_, (dx, dy)), dets in zip(images, found)
+                              for det in offset_detections(dets, dx, dy)]
+                detections = roi.filter(detections, frame.shape)
+            raw_detections = detections
+            detections = tracker.update(detections)
             fire_detected = False
+            fire_confirmed = False
+            fire_tracks = []
+            fire_crops = []
             clip_descriptions = []
-            annotated = frame.copy()
 
             h, w, _ = frame.shape
             pad = 10  # Padding autour des boxes YOLO pour CLIP
 
-            for result in detections:
-                if result.boxes is not None and len(result.boxes) > 0:
-                    for box in result.boxes:
-                        x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-                        conf = float(box.conf[0])
-                        cls_id = int(box.cls[0])
-                        cls_name = model_fire.names[cls_id]
-
-                        # Dessiner boîte
-                        color = (0, 0, 255) if cls_name.lower() == "fire" else (255, 255, 0)
-                        cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
-                        cv2.putText(annotated, f"{cls_name} {conf:.2f}", (x1, y1 - 5),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
-
-                        if cls_name.lower() == "fire":
-                            fire_detected = True
-                            # Crop YOLO avec padding
-                            x1_pad = max(x1 - pad, 0)
-                            y1_pad = max(y1 - pad, 0)
-                            x2_pad = min(x2 + pad, w)
-                            y2_pad = min(y2 + pad, h)
-                            fire_crop = frame[y1_pad:y2_pad, x1_pad:x2_pad]
-                            description = generate_clip_description(fire_crop)
-                            clip_descriptions.append(description)
-                            logger.info(f"[{camera_id}] CLIP description (crop): {description}")
-
-            # Si aucun feu détecté par YOLO, CLIP sur l'image entière
-            if not fire_detected:
-                description = generate_clip_description(frame)
-                clip_descriptions.append(description)
-                logger.info(f"[{camera_id}] CLIP description (full image): {description}")
-
-            # 🔔 Envoyer alerte si feu détecté
-            if fire_detected:
+            for det in detections:
+                x1, y1, x2, y2 = det["bbox"]
+                cls_name = det["class_name"]
+
+                if cls_name.lower() == "fire":
+                    fire_detected = True
+                    fire_tracks.append(det["track_id"])
+                    if cached is not None:
+                        continue
+                    # Crop YOLO avec padding
+                    x1_pad = max(x1 - pad, 0)
+                    y1_pad = max(y1 - pad, 0)
+                    x2_pad = min(x2 + pad, w)
+                    y2_pad = min(y2 + pad, h)
+                    fire_crop = frame[y1_pad:y2_pad, x1_pad:x2_pad]
+                    if fire_crop.size:
+                        fire_crops.append(fire_crop)
+
+            if cached is not None:
+                clip_descriptions = cached["clip_descriptions"]
+                fire_confirmed = fire_detected and cached.get("fire_confirmed", True)
+                logger.info(f"[{camera_id}] Unchanged scene, cached CLIP descriptions reused")
+            elif fire_crops:
+                # 3. CLIP seulement pour confirmer les boîtes feu de YOLO, tous les crops en un batch
+                with timed("clip", camera_id, "clip"):
+                    clip_descriptions, fire_confirmed = generate_clip_descriptions(fire_crops)
+                logger.info(f"[{camera_id}] CLIP descriptions (crops): {clip_descriptions}")
+            else:
+                fire_confirmed = fire_detected
+
+            if candidate and cached is None:
+                result_cache.put(camera_id, "fire", scene_hash,
+                                 {"detections": raw_detections, "clip_descriptions": clip_descriptions,
+                                  "fire_confirmed": fire_confirmed})
+            record_cascade_stats(camera_id, candidate, fire_detected, fire_confirmed)
+
+            # 🔔 Envoyer alerte si feu détecté par YOLO et confirmé par CLIP
+            if fire_confirmed:
                 send_fire_alert.delay(
                     camera_id=camera_id,
                     camera_name=f"Caméra {camera_id}",
-                    details={"clip_descriptions": clip_descriptions}
+                    details={"clip_descriptions": clip_descriptions, "track_ids": fire_tracks}
                 )
                 logger.info(f"[{camera_id}] 🔔 Fire alert sent")
+                count("alert_fire", camera_id, "fire")
 
-            # Stocker dans Redis
-            _, buffer = cv2.imencode(".jpg", annotated)
-            r.set(f"frame:{camera_id}:fire", buffer.tobytes(), ex=5)
+            # Boîtes publiées en JSON, dessinées par le navigateur (calque "fire")
+            with timed("overlay_publish", camera_id):
+                publish_overlays(camera_id, entry["seq"], frame.shape, {"fire": detections},
+                                 timestamp=entry["timestamp"])
 
             result_data = {
                 "fire_detected": fire_detected,
+                "fire_confirmed": fire_confirmed,
+                "track_ids": fire_tracks,
                 "clip_descriptions": clip_descriptions
             }
             r.set(f"result:{camera_id}:fire", json.dumps(result_data), ex=10)
+            # Acknowledged once its results are published (a dead worker's frame is reclaimed)
+            bus.ack(entry["id"])
 
-            logger.info(f"[{camera_id}] 🔥 Fire detected={fire_detected}, CLIP='{clip_descriptions}'")
+            logger.debug(f"[{camera_id}] 🔥 Fire detected={fire_detected}, confirmed={fire_confirmed}, "
+                         f"CLIP='{clip_descriptions}'")
 
-            torch.cuda.empty_cache()
-            gc.collect()
+            free_memory()
+            observe_stage("frame_total", time.perf_counter() - frame_started, camera_id, "fire")
+            count("frames_processed", camera_id, "fire")
             iterations += 1
             time.sleep(0.2)
 
@@ -157,5 +228,8 @@ def detect_fire_from_redis(camera_id: int, max_iterations: int = 5, conf_thresho
         logger.error(f"[{camera_id}] Fire detection error: {e}")
 
     finally:
+        if bus is not None:
+            bus.close()
+        lease.release(camera_id)
         logger.info(f"🧹 End fire detection for camera {camera_id}, iterations={iterations}")
         return {"camera_id": camera_id, "iterations": iterations}
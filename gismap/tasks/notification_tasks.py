@@ -11,6 +11,7 @@ from asgiref.sync import async_to_sync
 import redis
 import time
 from datetime import datetime, timedelta
+from gismap.metrics import count, timed
 
 logger = logging.getLogger(__name__)
 
@@ -51,7 +52,9 @@ def send_alert_notification(matricule, camera_id, camera_name=None, lieu=None, d
         }
         
         # Envoyer via WebSocket
-        async_to_sync(channel_layer.group_send)("alerts", alert_data)
+        with timed("ws_send", camera_id, "unauthorized_plate"):
+            async_to_sync(channel_layer.group_send)("alerts", alert_data)
+        count("alerts_sent", camera_id, "unauthorized_plate")
         
         # Stocker dans Redis pour historique
         alert_key = f"alert_{camera_id}_{int(time.time())}"
@@ -95,7 +98,15 @@ def send_system_alert(message, alert_type="system", priority="medium", details=N
             "timestamp": timezone.now().isoformat()
         }
         
-        async_to_sync(channel_layer.group_send)("alerts", alert_data)
+        camera_id = (details or {}).get("camera_id")
+        with timed("ws_send", camera_id, alert_type):
+            async_to_sync(channel_layer.group_send)("alerts", alert_data)
+        count("alerts_sent", camera_id, alert_type)
+
+        # Caméra en alerte: plein régime dans le budget d'inférence pendant un moment
+        if details and details.get("camera_id") is not None:
+            from gismap.budget import mark_alert
+            mark_alert(details["camera_id"])
         
         logger.info(f"[SYSTEM] Alerte système envoyée: {message}")
         
@@ -3,6 +3,7 @@ import cv2
 import numpy as np
 import redis
 import re
+import time
 from celery import shared_task
 import logging
 
@@ -14,6 +15,9 @@ from django.utils import timezone
 from django.core.files.base import ContentFile
 import base64
 from django.core.files.storage import default_storage
+from gismap.blob_store import get_blob
+from gismap.budget import mark_alert
+from gismap.metrics import count, observe_stage, timed
 
 # Configuration Tesseract
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
@@ -65,9 +69,12 @@ def send_unauthorized_notification(matricule_data):
         return False
 # NOUVELLE FONCTION: Vérification et sauvegarde
   # NOUVELLE FONCTION: Vérification et sauvegarde
-def check_and_save_detection(license_plate, camera_id, confidence_score, image_bytes=None):
-    """Vérifie autorisation et envoie notification si nécessaire"""
+def check_and_save_detection(license_plate, camera_id, confidence_score, image_bytes=None, track_id=None):
+    """Vérifie autorisation et envoie notification si nécessaire.
+    Avec un track_id (suivi multi-objets), une nouvelle lecture du même véhicule
+    met à jour sa détection au lieu d'en créer une autre."""
     try:
+        db_started = time.perf_counter()
         # Import des modèles Django
         DetectionMatricule = apps.get_model('gismap', 'DetectionMatricule')
         MatriculeAutorise = apps.get_model('gismap', 'MatriculeAutorise')
@@ -84,17 +91,35 @@ def check_and_save_detection(license_plate, camera_id, confidence_score, image_b
                 lieu=camera.department
             ).exists()
 
-        # Créer l'instance de détection (image sera ajoutée ensuite)
-        detection = DetectionMatricule.objects.create(
-            numero=license_plate,
-            camera=camera,
-            est_autorise=is_authorized
-        )
+        # Même véhicule déjà lu (meilleur crop): mise à jour, pas de nouvelle ligne
+        detection = None
+        if track_id is not None:
+            detection = DetectionMatricule.objects.filter(camera=camera, track_id=track_id).first()
+        if detection is not None:
+            already_notified = detection.numero == license_plate and not detection.est_autorise
+            detection.numero = license_plate
+            detection.est_autorise = is_authorized
+            if image_bytes:
+                detection.image = image_bytes
+            detection.save()
+            if already_notified or is_authorized:
+                observe_stage("db_write", time.perf_counter() - db_started, camera_id)
+                logging.info(f"🔁 Track #{track_id} relu: {license_plate} (Cam: {camera.name})")
+                return detection, is_authorized
+        else:
+            # Créer l'instance de détection (image sera ajoutée ensuite)
+            detection = DetectionMatricule.objects.create(
+                numero=license_plate,
+                camera=camera,
+                est_autorise=is_authorized,
+                track_id=track_id
+            )
 
-        # Stocker directement l’image dans la base de données
-        if image_bytes:
-           detection.image = image_bytes
-           detection.save()
+            # Stocker directement l’image dans la base de données
+            if image_bytes:
+               detection.image = image_bytes
+               detection.save()
+        observe_stage("db_write", time.perf_counter() - db_started, camera_id)
         # 🚨 Si matricule non autorisée → envoyer la notification WebSocket
         if not is_authorized:
             # Encoder l'image en base64 pour l’envoyer
@@ -111,18 +136,24 @@ def check_and_save_detection(license_plate, camera_id, confidence_score, image_b
                 'confidence': confidence_score,
                 'message': f"🚨 Matricule non autorisé: {license_plate}",
                 'image_base64': image_base64,  # 👍 image incluse ici
-                'detection_id': detection.id
+                'detection_id': detection.id,
+                'track_id': track_id
             }
 
             # Envoi WebSocket
             channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                "notifications",  # nom du groupe dans le consumer
-                {
-                    "type": "send_notification",
-                    "data": matricule_data
-                }
-            )
+            with timed("ws_send", camera_id):
+                async_to_sync(channel_layer.group_send)(
+                    "notifications",  # nom du groupe dans le consumer
+                    {
+                        "type": "send_notification",
+                        "data": matricule_data
+                    }
+                )
+            count("alert_unauthorized_plate", camera_id)
+
+            # Plein régime d'inférence sur cette caméra pendant un moment
+            mark_alert(camera_id)
 
             logging.warning(f"🚨 ALERTE: Matricule non autorisée {license_plate} (Cam: {camera.name})")
         else:
@@ -347,10 +378,20 @@ def validate_reconstructed_plate(left, center, right):
     return score, final_plate
 
 @shared_task
-def run_ocr_task(image_bytes, camera_id):
-    """OCR robuste contre les corruptions H.264 AVEC NOTIFICATIONS WEBSOCKET"""
+def run_ocr_task(image_bytes=None, camera_id=None, track_id=None, image_key=None):
+    """OCR robuste contre les corruptions H.264 AVEC NOTIFICATIONS WEBSOCKET
+    image_key: référence du crop dans le blob store (gismap/blob_store.py),
+    le message Celery ne transporte alors pas les pixels."""
     
     try:
+        # 0. Crop référencé par clé: lu une seule fois puis libéré
+        if image_key is not None:
+            with timed("blob_get", camera_id):
+                image_bytes = get_blob(image_key, delete=True)
+            if image_bytes is None:
+                logging.warning(f"⌛ Crop expiré Cam {camera_id}: {image_key}")
+                return {"success": False, "error": "Crop expiré"}
+
         # 1. Décodage avec gestion d'erreurs
         np_arr = np.frombuffer(image_bytes, np.uint8)
         img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
@@ -360,7 +401,8 @@ def run_ocr_task(image_bytes, camera_id):
             return {"success": False, "error": "Image corrompue (H.264?)"}
         
         # 2. Préprocessing robuste avec détection de corruption
-        processed_data = robust_preprocessing(img)
+        with timed("ocr_preprocess", camera_id):
+            processed_data = robust_preprocessing(img)
         
         if processed_data['corruption_detected']:
             logging.warning(f"🚨 Corruption H.264 détectée et corrigée pour Cam {camera_id}")
@@ -387,6 +429,7 @@ def run_ocr_task(image_bytes, camera_id):
         debug_results = []
         
         # 4. Test sur toutes les versions d'image
+        ocr_started = time.perf_counter()
         image_versions = [
             ('original', processed_data['original_processed']),
             ('otsu', processed_data['otsu']),
@@ -423,6 +466,8 @@ def run_ocr_task(image_bytes, camera_id):
                     logging.warning(f"Erreur OCR {img_name}/{config_data['lang']}: {e}")
                     continue
         
+        observe_stage("ocr", time.perf_counter() - ocr_started, camera_id, "tesseract")
+
         # 5. Debug complet
         logging.info(f"🔍 DEBUG Cam {camera_id} - H.264 corruption: {processed_data['corruption_detected']}")
         for result in debug_results[:8]:  # Limiter pour éviter spam
@@ -437,9 +482,10 @@ def run_ocr_task(image_bytes, camera_id):
             # Sauvegarder dans Redis
             r.set(f"detected_plate_{camera_id}", best_result, ex=30)
             
+            count("ocr_success", camera_id)
             # 🚨 NOUVEAU: Vérification et notification WebSocket
             detection, is_authorized = check_and_save_detection(
-            best_result, camera_id, best_score, image_bytes=image_bytes
+            best_result, camera_id, best_score, image_bytes=image_bytes, track_id=track_id
             )
 
             
@@ -450,9 +496,11 @@ def run_ocr_task(image_bytes, camera_id):
                 "h264_corruption": processed_data['corruption_detected'],
                 "detection_method": best_method,
                 "is_authorized": is_authorized,  # Nouveau champ
-                "detection_id": detection.id if detection else None  # Nouveau champ
+                "detection_id": detection.id if detection else None,  # Nouveau champ
+                "track_id": track_id
             }
         
+        count("ocr_failed", camera_id)
         logging.error(f"❌ Échec OCR Cam {camera_id} - Score: {best_score}, H.264: {processed_data['corruption_detected']}")
         return {"success": False, "error": f"OCR failed (score: {best_score}, H.264: {processed_data['corruption_detected']})"}
         
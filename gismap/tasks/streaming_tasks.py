@@ -2,39 +2,37 @@ from celery import shared_task
 import subprocess
 import redis
 import time
-import numpy as np
-import cv2
 from gismap.models import Camera
+from gismap.frame_bus import FramePublisher
+from gismap.ingest import build_ffmpeg_cmd
+from gismap.leases import LeaseRegistry, default_node_id
+from gismap.metrics import count, timed
 from gismap.tasks.yolo_detect_task import detect_from_redis
 from gismap.tasks.fire_clip_tasks import detect_fire_from_redis
 # Redis client
 redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
 
-# Track active streams and detections
-running_cameras = set()
-running_detections = set()
+# Camera ownership is shared across processes and nodes through Redis leases
+ingest_leases = LeaseRegistry("ingest")
+detection_leases = LeaseRegistry("yolo")
+fire_leases = LeaseRegistry("fire")
 
 
 @shared_task(name="gismap.streaming_tasks.stream_rtsp_camera")
-def stream_camera(camera_id, rtsp_url, width=640, height=480, fps=1):
-    if camera_id in running_cameras:
-        print(f"[{camera_id}] Already streaming, skipping duplicate task")
+def stream_camera(camera_id, rtsp_url, width=640, height=480, fps=1, decode_mode="all", lowres=0):
+    """
+    Single-camera capture inside a Celery worker (debug / legacy path).
+    Production capture runs in `python manage.py run_ingest`, which does
+    not hold a worker slot per camera.
+    """
+    lease = LeaseRegistry("ingest", node_id=default_node_id(unique=True))
+    if not lease.acquire(camera_id):
+        print(f"[{camera_id}] Already streaming on {lease.owner(camera_id)}, skipping duplicate task")
         return
-    running_cameras.add(camera_id)
 
     print(f"[{camera_id}] FFmpeg streaming started for {rtsp_url}")
 
-    ffmpeg_cmd = [
-        "ffmpeg",
-        "-rtsp_transport", "tcp",
-        "-i", rtsp_url,
-        "-s", f"{width}x{height}",
-        "-f", "rawvideo",
-        "-pix_fmt", "bgr24",
-        "-vf", f"fps={fps}",
-        "-an",
-        "pipe:1"
-    ]
+    ffmpeg_cmd = build_ffmpeg_cmd(rtsp_url, width, height, fps, decode_mode=decode_mode, lowres=lowres)
 
     process = subprocess.Popen(
         ffmpeg_cmd,
@@ -46,10 +44,15 @@ def stream_camera(camera_id, rtsp_url, width=640, height=480, fps=1):
     frame_size = width * height * 3
     detection_started = False
 
+    # Raw frames go to shared memory; JPEG only when a consumer asked for it
+    publisher = FramePublisher(camera_id, width, height)
+
     try:
-        while True:
-            raw_frame = process.stdout.read(frame_size)
+        while lease.keep(camera_id):
+            with timed("ffmpeg_read", camera_id):
+                raw_frame = process.stdout.read(frame_size)
             if len(raw_frame) != frame_size:
+                count("ffmpeg_incomplete_frames", camera_id)
                 err = process.stderr.read(4096).decode("utf-8", errors="ignore")
                 print(f"[{camera_id}] Incomplete frame ({len(raw_frame)} bytes)")
                 if err:
@@ -57,44 +60,33 @@ def stream_camera(camera_id, rtsp_url, width=640, height=480, fps=1):
                 time.sleep(1)
                 continue
 
-            # Convert raw frame to OpenCV image
-            frame = np.frombuffer(raw_frame, np.uint8).reshape((height, width, 3))
-
-            # Encode as JPEG
-            ret, buffer = cv2.imencode(".jpg", frame)
-            if not ret:
-                print(f"[{camera_id}] JPEG encoding failed")
-                continue
-
-            # ✅ Push raw JPEG bytes (not base64) into Redis
-            redis_client.set(f"camera:{camera_id}:frame", buffer.tobytes(), ex=5)
-            print(f"[{camera_id}] Frame pushed to Redis")
+            # Publish raw frame (zero-copy readers on this host)
+            with timed("publish", camera_id):
+                publisher.publish_raw(raw_frame)
 
-            # Start YOLO detection once
+            # Start YOLO detection once (the tasks skip themselves if already owned)
             if not detection_started:
-                if camera_id not in running_detections:
-                    detect_fire_from_redis.delay(camera_id)
-                    detect_from_redis.delay(camera_id)
-                    running_detections.add(camera_id)
-                    detection_started = True
-                    print(f"[{camera_id}] YOLO detection started")
+                detect_fire_from_redis.delay(camera_id)
+                detect_from_redis.delay(camera_id)
+                detection_started = True
+                print(f"[{camera_id}] YOLO detection started")
 
     except Exception as e:
         print(f"[{camera_id}] Exception: {e}")
     finally:
         process.kill()
-        running_cameras.remove(camera_id)
+        publisher.close()
+        lease.release(camera_id)
         print(f"[{camera_id}] FFmpeg stream ended")
-        if camera_id in running_detections:
-            running_detections.remove(camera_id)
 
 
 @shared_task(name="gismap.tasks.streaming_tasks.stream_all_cameras")
 def stream_all_cameras():
     cameras = Camera.objects.all()
     for camera in cameras:
-        if camera.id not in running_cameras:   # ✅ check directly
-            stream_camera.delay(camera.id, camera.rtsp_url)
+        if ingest_leases.owner(camera.id) is None:   # no node is ingesting it
+            stream_camera.delay(camera.id, camera.rtsp_url,
+                                decode_mode=camera.decode_mode, lowres=camera.decode_lowres)
 
 
 @shared_task(name="gismap.tasks.streaming_tasks.detect_all_cameras")
@@ -111,3 +103,24 @@ def start_fire_detection_all():
     cameras = Camera.objects.all()
     for cam in cameras:
         detect_fire_from_redis.delay(cam.id)
+
+
+@shared_task(name="gismap.tasks.streaming_tasks.ensure_detection_tasks")
+def ensure_detection_tasks():
+    """
+    Restart the analytics of every camera that is being ingested but has no
+    live analytic owner (worker died, task finished its iterations).
+    Workers that pick the tasks up take the leases, which spreads cameras
+    over the nodes currently alive.
+    """
+    started = []
+    for camera_id in Camera.objects.values_list("id", flat=True):
+        if ingest_leases.owner(camera_id) is None:
+            continue
+        # A task already queued but not started (busy workers) is not queued again
+        if detection_leases.owner(camera_id) is None and detection_leases.mark_pending(camera_id):
+            detect_from_redis.delay(camera_id)
+            started.append(camera_id)
+        if fire_leases.owner(camera_id) is None and fire_leases.mark_pending(camera_id):
+            detect_fire_from_redis.delay(camera_id)
+    return {"restarted": started}
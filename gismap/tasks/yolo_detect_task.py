@@ -1,79 +1,46 @@
 # ============================================================================
 # YOLO_DETECT_TASK.PY - Multi-model detection, OCR only on best.pt detections
-# Annotated frames pushed back to Redis at frame:{camera_id}:detection
+# Detections published as JSON overlays, one layer per model (overlays.py)
 # ============================================================================
 import cv2
 import numpy as np
-import torch
-from ultralytics import YOLO
 from celery import shared_task
+from django.conf import settings
 import redis
 import time
-import gc
-import os
 import logging
 from typing import Optional
 from gismap.tasks.ocr_task import run_ocr_task
+from gismap.tasks.notification_tasks import send_aggression_alert, send_fallen_alert
+from gismap.blob_store import put_image
+from gismap.budget import InferenceBudget
+from gismap.inference_server import MODEL_CONF, InferenceClient, run_models as run_models_on
+from gismap.model_registry import free_memory, registry
+from gismap.frame_buffer import LEVEL_FULL
+from gismap.frame_bus import FrameBusConsumer
+from gismap.leases import LeaseRegistry, default_node_id
+from gismap.metrics import count, observe_stage, timed
+from gismap.overlays import publish_overlays
+from gismap.motion import MotionDetector, inference_region, record_motion_stats
+from gismap.pose_events import EVENT_FALLEN, PoseEventEngine, keypoint_array, person_boxes
+from gismap.result_cache import frame_hash, result_cache
+from gismap.roi import RoiMask
+from gismap.schedule import AnalyticSchedule
+from gismap.tiling import TilePlanner, merge_detections, scale_detections
+from gismap.tracking import Tracker, crop_quality
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-current_dir = os.path.dirname(__file__)
-
 # ============================================================================
-# YOLO Detector Wrapper
+# Models
 # ============================================================================
-class YOLODetector:
-    def __init__(self, model_path: str):
-        self.model_path = model_path
-        self.model = None
-        self.load_model()
-
-    def load_model(self):
-        if not os.path.exists(self.model_path):
-            raise FileNotFoundError(f"Model not found: {self.model_path}")
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = YOLO(self.model_path).to(device)
-        logger.info(f"✅ YOLO loaded on {device.upper()}: {self.model_path}")
-
-    def detect(self, frame: np.ndarray, conf_threshold: float = 0.25):
-        try:
-            results = self.model.predict(
-                source=frame,
-                save=False,
-                conf=conf_threshold,
-                device="cuda" if torch.cuda.is_available() else "cpu",
-                imgsz=(640, 384),
-                verbose=False
-            )
-            detections = []
-            for result in results:
-                if result.boxes is not None:
-                    for box in result.boxes:
-                        x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-                        conf = float(box.conf[0])
-                        cls_id = int(box.cls[0])
-                        cls_name = self.model.names[cls_id] if hasattr(self.model, "names") else str(cls_id)
-                        detections.append({
-                            "bbox": (x1, y1, x2, y2),
-                            "confidence": conf,
-                            "class_name": cls_name
-                        })
-            return detections, results
-        except Exception as e:
-            logger.error(f"❌ YOLO detect() error: {e}")
-            return [], None
-
-# ============================================================================
-# Load Models
-# ============================================================================
-model_path_best = os.path.abspath(os.path.join(current_dir, "..", "yolo", "best.pt"))
-model_path_box = os.path.abspath(os.path.join(current_dir, "..", "yolo", "box.pt"))
-model_path_pose = os.path.abspath(os.path.join(current_dir, "..", "yolo", "yolov8s-pose.pt"))
-
-detector_best = YOLODetector(model_path_best)
-detector_box = YOLODetector(model_path_box)
-pose_detector = YOLO(model_path_pose)
+# INFERENCE_MODE="server": frames go to the batched inference server
+# (python manage.py run_inference), the worker loads no model.
+# INFERENCE_MODE="local": each worker runs the models itself (single node, debug),
+# loaded by the model registry on first use and shared by the pool threads.
+INFERENCE_MODE = getattr(settings, "INFERENCE_MODE", "server")
+inference = InferenceClient()
 
 # ============================================================================
 # Redis
@@ -98,113 +65,301 @@ def decode_frame_from_redis(jpeg_bytes: bytes) -> Optional[np.ndarray]:
         logger.error(f"❌ Frame decode error: {e}")
         return None
 
-def process_detections(frame, detections, camera_id, run_ocr=False):
-    """Draw bounding boxes and optionally run OCR on plates."""
-    annotated = frame.copy()
+def crop_full_resolution(full_frame: Optional[np.ndarray], frame: np.ndarray, bbox):
+    """
+    Crop a detect-level bbox from the full-resolution frame (scaled
+    coordinates), or from the detect frame when full resolution is gone.
+    """
+    x1, y1, x2, y2 = bbox
+    if full_frame is None:
+        return frame[y1:y2, x1:x2]
+    sx = full_frame.shape[1] / frame.shape[1]
+    sy = full_frame.shape[0] / frame.shape[0]
+    return full_frame[int(y1 * sy):int(np.ceil(y2 * sy)), int(x1 * sx):int(np.ceil(x2 * sx))]
+
+def process_detections(frame, detections, camera_id, run_ocr=False, full_frame=None, tracker=None):
+    """
+    Run OCR on plates (cropped at full resolution). With a tracker, a plate
+    is read once per confirmed track, and again only when its crop gets
+    clearly better (Tracker.should_ocr). Boxes are drawn by the viewer.
+    """
+    if not run_ocr:
+        return
     for det in detections:
-        x1, y1, x2, y2 = det["bbox"]
-        label = f"{det['class_name']} {det['confidence']:.2f}"
-        cv2.rectangle(annotated, (x1, y1), (x2, y2), (0, 255, 0), 2)
-        cv2.putText(annotated, label, (x1, y1 - 5),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-        if run_ocr and det["class_name"] == "plate":
-            roi = frame[y1:y2, x1:x2]
-            run_ocr_task.delay(camera_id, roi.tolist())
-    return annotated
-
-def classify_pose(result, frame_height):
-    """Classify person pose into Fallen / Aggression / Normal."""
-    persons = []
-    try:
-        if result.keypoints is not None:
-            for kp in result.keypoints:
-                kps = kp.xy.cpu().numpy()
-                y_coords = kps[:, 1]
-                if np.std(y_coords) < 20:
-                    label = "Fallen"
-                elif np.max(y_coords) - np.min(y_coords) > frame_height * 0.8:
-                    label = "Aggression"
-                else:
-                    label = "Normal"
-                persons.append((label, kps))
-    except Exception as e:
-        logger.error(f"❌ classify_pose error: {e}")
-    return persons
+        if det["class_name"] != "plate":
+            continue
+        track_id = det.get("track_id")
+        roi = crop_full_resolution(full_frame, frame, det["bbox"])
+        if tracker is not None and not (tracker.is_confirmed(track_id)
+                                        and tracker.should_ocr(track_id, crop_quality(roi))):
+            continue
+        # The crop goes through the blob store once, the task message only carries its key
+        with timed("blob_put", camera_id):
+            key = put_image(roi, kind="plate")
+        if key is not None:
+            run_ocr_task.delay(camera_id=camera_id, track_id=track_id, image_key=key)
+            count("ocr_dispatched", camera_id)
+
+def load_camera_config(camera_id: int) -> dict:
+    """Per-camera pipeline settings stored on the Camera row."""
+    from gismap.models import Camera
+    config = Camera.objects.filter(id=camera_id).values(
+        "motion_gating", "motion_threshold", "analytic_schedule", "roi_polygons", "tiling",
+        "inference_priority").first()
+    return config or {"motion_gating": False, "motion_threshold": 0.002, "analytic_schedule": {},
+                      "roi_polygons": [], "tiling": {}, "inference_priority": 1}
+
+def run_models(camera_id, entry, frame, plan):
+    """
+    Run the models of a schedule plan ({model: regions}) on one frame,
+    through the batched inference server or locally.
+    Returns ({model: results}, {model: ms} when measured), or None on failure.
+    """
+    if INFERENCE_MODE == "server":
+        # Round trip to the server: queue wait + batched inference (per model on the server side)
+        with timed("inference_request", camera_id):
+            results = inference.infer(camera_id, entry, frame, plan)
+        if results is None or results.get("error"):
+            if results is not None:
+                logger.warning(f"[{camera_id}] Inference error: {results['error']}")
+            return None
+        return results, None
+
+    request = {"frame": frame, "regions": plan, "results": {}, "error": None}
+    elapsed_ms = {}
+    for name in plan:
+        started = time.perf_counter()
+        run_models_on({name: registry.get(name)}, [request])
+        elapsed_ms[name] = (time.perf_counter() - started) * 1000
+        observe_stage("inference", elapsed_ms[name] / 1000, camera_id, name)
+    if request["error"]:
+        logger.warning(f"[{camera_id}] Inference error: {request['error']}")
+        return None
+    return request["results"], elapsed_ms
+
+def run_tiles(camera_id, entry, frame, full_frame, tiles):
+    """
+    Tiled pass ({model: tiles} on the full-resolution frame, one batch).
+    Returns ({model: detections in detect coordinates}, {model: ms}) or None.
+    """
+    outputs = run_models(camera_id, dict(entry, level=LEVEL_FULL), full_frame, tiles)
+    if outputs is None:
+        return None
+    results, elapsed_ms = outputs
+    sx = full_frame.shape[1] / frame.shape[1]
+    sy = full_frame.shape[0] / frame.shape[0]
+    return {name: scale_detections(dets, sx, sy) for name, dets in results.items()}, elapsed_ms
 
 # ============================================================================
 # Main Detection Task
 # ============================================================================
 @shared_task
 def detect_from_redis(camera_id: int, max_iterations: int = 1000):
+    # One "yolo" owner per camera across all workers / nodes
+    lease = LeaseRegistry("yolo", node_id=default_node_id(unique=True))
+    lease.clear_pending(camera_id)
+    if not lease.acquire(camera_id):
+        logger.info(f"[{camera_id}] Detection already owned by {lease.owner(camera_id)}, skipping")
+        return {"camera_id": camera_id, "iterations_completed": 0, "status": "already_running"}
+
     logger.info(f"🚀 Start detection cam {camera_id}")
     iterations = 0
-    consecutive_errors = 0
-    max_consecutive_errors = 10
+
+    config = load_camera_config(camera_id)
+    motion = MotionDetector(min_area_ratio=config["motion_threshold"]) if config["motion_gating"] else None
+    schedule = AnalyticSchedule(camera_id, config["analytic_schedule"])
+    # Static image-space ROI: models only see its rectangles, detections outside are dropped
+    roi = RoiMask(config["roi_polygons"])
+    if motion is not None and roi:
+        motion.roi_mask = roi.mask((384, 640))
+    # Stable ids for plates / vehicles (best) and boxes across frames; a detection kept by
+    # the model starts a track (plates are often read around 0.3, below the default 0.5)
+    trackers = {name: Tracker(camera_id, high_conf=MODEL_CONF[name]) for name in ("best", "box")}
+    # Pose persons get their own track ids; their keypoints feed the temporal fall / aggression engine
+    person_tracker = Tracker(camera_id, high_conf=MODEL_CONF["pose"])
+    pose_events = PoseEventEngine(camera_id)
+    # Sliced inference on the full-resolution level (overview cameras)
+    tiler = TilePlanner(camera_id, config["tiling"])
+    # Frame rate of this camera within the inference budget shared by all cameras
+    budget = InferenceBudget(camera_id, priority=config["inference_priority"])
+    # Consecutive inference failures (server down / timing out): growing back-off
+    failures = 0
+    bus = None
 
     try:
+        # Each frame of the camera is delivered once to the "yolo" group
+        bus = FrameBusConsumer(camera_id, group="yolo")
         while iterations < max_iterations:
-            jpeg_bytes = r.get(f"camera:{camera_id}:frame")
-            if not jpeg_bytes:
-                logger.warning(f"[{camera_id}] No frame found in Redis")
-                time.sleep(0.5)
+            if not lease.keep(camera_id):
+                logger.warning(f"[{camera_id}] Detection lease lost, stopping")
+                break
+
+            budget.wait()
+            # Paced below the camera frame rate: newest frame, older ones skipped
+            with timed("bus_read", camera_id):
+                entry = bus.read(latest=True)
+            if entry is None:
+                logger.warning(f"[{camera_id}] No new frame on the bus")
                 continue
+            frame_started = time.perf_counter()
+            # Capture to analysis: ingest, bus and budget pacing
+            observe_stage("frame_age", max(time.time() - entry["timestamp"], 0.0), camera_id)
+
+            seq = entry["seq"]
+            full_frame = None
+            # Detect level is already 640x384; own copy so the shared-memory view is never written to
+            frame = entry["frame"]
+            frame = frame.copy() if frame.shape[:2] == (384, 640) else cv2.resize(frame, (640, 384))
+            # Acknowledged only once its results are published: a frame left pending by
+            # a dead worker is reclaimed (XAUTOCLAIM) and processed by another one
+
+            logger.debug(f"[{camera_id}] Iteration {iterations+1}: frame {seq} ready")
 
-            frame = decode_frame_from_redis(jpeg_bytes)
-            if frame is None:
-                consecutive_errors += 1
-                logger.warning(f"[{camera_id}] Frame decode failed, consecutive errors: {consecutive_errors}")
-                if consecutive_errors > max_consecutive_errors:
-                    logger.error(f"[{camera_id}] Too many decode errors, stopping detection")
-                    break
-                time.sleep(0.2)
+            # --- Motion gate ---
+            region = None
+            if motion is not None:
+                with timed("motion", camera_id):
+                    motion_result = motion.update(frame)
+                record_motion_stats(camera_id, motion_result["static"])
+                if motion_result["static"]:
+                    logger.debug(f"[{camera_id}] Static frame {seq}, inference skipped")
+                    count("frames_static", camera_id)
+                    budget.observe(0)
+                    bus.ack(entry["id"])
+                    iterations += 1
+                    continue
+                region = inference_region(motion_result["boxes"], frame.shape)
+
+            # --- Which models run on this frame, and where ---
+            plan = roi.restrict_plan(schedule.plan(frame.shape, region), frame.shape)
+            if not plan:
+                schedule.record(plan)
+                budget.observe(0)
+                bus.ack(entry["id"])
+                iterations += 1
                 continue
 
-            consecutive_errors = 0
-            frame = cv2.resize(frame, (640, 384))
-            annotated_frame = frame.copy()
+            # --- Unchanged scene: last results of these models reused, no inference ---
+            scene_hash = frame_hash(frame)
+            cached = result_cache.get(camera_id, "yolo", scene_hash, require=plan)
+            if cached is not None:
+                results = {name: cached[name] for name in plan}
+                # Budget stats: no model actually ran on this frame
+                schedule.record({})
+            else:
+                # --- YOLO best / box / pose (one batched pass across cameras) ---
+                outputs = run_models(camera_id, entry, frame, plan)
+                if outputs is None:
+                    bus.ack(entry["id"])
+                    iterations += 1
+                    failures += 1
+                    # Counted so the loop still ends; no tight retry while the server is unavailable
+                    time.sleep(min(0.5 * 2 ** (failures - 1), 10.0))
+                    continue
+                failures = 0
+                results, elapsed_ms = outputs
 
-            logger.info(f"[{camera_id}] Iteration {iterations+1}: frame decoded successfully")
+                # --- Tiled pass: small objects lost by the 640x384 downscale ---
+                tiles = {}
+                if tiler.due(time.time() - entry["timestamp"]):
+                    full_frame = bus.read_level(entry, LEVEL_FULL)
+                    if full_frame is not None:
+                        tiles = tiler.plan(plan, full_frame.shape, frame.shape)
+                if tiles:
+                    with timed("tiles", camera_id):
+                        tiled = run_tiles(camera_id, entry, frame, full_frame, tiles)
+                    if tiled is not None:
+                        tile_results, tile_ms = tiled
+                        for name, dets in tile_results.items():
+                            # Cross-tile NMS, with the detect-level boxes of the same objects
+                            results[name] = merge_detections(results.get(name, []) + dets)
+                        if elapsed_ms is not None and tile_ms is not None:
+                            for name, ms in tile_ms.items():
+                                elapsed_ms[name] = elapsed_ms.get(name, 0.0) + ms
+                schedule.record(plan, elapsed_ms, tiles)
+                # Raw model outputs (before ROI / tracking, which run on every frame)
+                result_cache.put(camera_id, "yolo", scene_hash, results)
+            for name in ("best", "box"):
+                if name in results:
+                    results[name] = roi.filter(results[name], frame.shape)
+            if "pose" in results:
+                # All persons of the frame as one (P, 17, 2) array; persons without keypoints dropped
+                persons = keypoint_array(results["pose"])
+                person_bboxes = person_boxes(persons)
+                keep = (persons > 0).any(axis=(1, 2)) & roi.filter_boxes(person_bboxes, frame.shape)
+                persons, person_bboxes = persons[keep], person_bboxes[keep]
+                results["pose"] = [person for person, k in zip(results["pose"], keep) if k]
+            # Tracks only advance on frames where their model ran
+            with timed("tracking", camera_id):
+                for name, tracker in trackers.items():
+                    if name in results:
+                        results[name] = tracker.update(results[name])
+            for name, found in results.items():
+                count("detections", camera_id, name, value=len(found))
+            detections_best = results.get("best", [])
+            detections_box = results.get("box", [])
+            schedule.observe("best", detections_best)
+            schedule.observe("box", detections_box)
+            if "pose" in results:
+                schedule.observe_persons(results["pose"])
 
-            # --- YOLO best ---
-            detections_best, _ = detector_best.detect(frame)
-            logger.info(f"[{camera_id}] YOLO best detections: {len(detections_best)}")
+            logger.debug(f"[{camera_id}] YOLO best detections: {len(detections_best)}")
             if detections_best:
-                annotated_frame = process_detections(annotated_frame, detections_best, camera_id, run_ocr=True)
-
-            # --- YOLO box ---
-            detections_box, _ = detector_box.detect(frame)
-            logger.info(f"[{camera_id}] YOLO box detections: {len(detections_box)}")
-            if detections_box:
-                annotated_frame = process_detections(annotated_frame, detections_box, camera_id, run_ocr=False)
-
-            # --- Pose ---
-            pose_results = pose_detector.predict(
-                source=frame,
-                conf=0.5,
-                device="cuda" if torch.cuda.is_available() else "cpu",
-                verbose=False
-            )
-            persons = classify_pose(pose_results[0], frame.shape[0])
-            for label, _ in persons:
-                logger.info(f"[{camera_id}] Pose detected: {label}")
-            if not persons:
-                logger.info(f"[{camera_id}] No persons detected in this frame")
-
-            # --- Push annotated frame back to Redis ---
-            try:
-                _, buffer = cv2.imencode(".jpg", annotated_frame)
-                r.set(f"frame:{camera_id}:detection", buffer.tobytes(), ex=5)
-                print(f"[{camera_id}] ✅ Detection frame pushed to Redis as frame:{camera_id}:detection")
-            except Exception as e:
-                logger.error(f"[{camera_id}] Redis push error: {e}")
-
-            torch.cuda.empty_cache()
-            gc.collect()
-            time.sleep(0.1)
+                # Plates are cropped from the full-resolution level of the same frame
+                if full_frame is None and any(det["class_name"] == "plate" for det in detections_best):
+                    full_frame = bus.read_level(entry, LEVEL_FULL)
+                process_detections(frame, detections_best, camera_id, run_ocr=True,
+                                   full_frame=full_frame, tracker=trackers["best"])
+
+            logger.debug(f"[{camera_id}] YOLO box detections: {len(detections_box)}")
+
+            # --- Pose (only when scheduled) ---
+            overlay_persons = None
+            if "pose" in results:
+                with timed("pose_events", camera_id):
+                    tracked = person_tracker.update([
+                        {"bbox": tuple(box), "confidence": 1.0, "class_name": "person"}
+                        for box in person_bboxes.astype(int).tolist()])
+                    person_ids = [det["track_id"] for det in tracked]
+                    events = pose_events.update(person_ids, persons, entry["timestamp"])
+                    postures = pose_events.postures(person_ids)
+                for track_id, posture in postures.items():
+                    logger.debug(f"[{camera_id}] Pose #{track_id}: {posture}")
+                overlay_persons = [{"track": track_id, "keypoints": person, "posture": postures.get(track_id)}
+                                   for track_id, person in zip(person_ids, persons.round().astype(int).tolist())]
+                if not person_ids:
+                    logger.debug(f"[{camera_id}] No persons detected in this frame")
+                for event in events:
+                    logger.warning(f"[{camera_id}] 🚨 Pose event {event['type']} on person #{event['track_id']}")
+                    count(f"alert_{event['type']}", camera_id, "pose")
+                    budget.observe(alert=True)
+                    alert = send_fallen_alert if event["type"] == EVENT_FALLEN else send_aggression_alert
+                    alert.delay(camera_id=camera_id, camera_name=f"Caméra {camera_id}",
+                                details={"track_id": event["track_id"], **event["features"]})
+
+            # --- Detections as JSON: the viewer draws them over the raw frame ---
+            # (only the layers of the models that ran: the others keep their last boxes)
+            with timed("overlay_publish", camera_id):
+                publish_overlays(camera_id, seq, frame.shape,
+                                 {name: results[name] for name in ("best", "box") if name in results},
+                                 persons=overlay_persons, timestamp=entry["timestamp"])
+            bus.ack(entry["id"])
+
+            # Activity drives this camera's share of the budget (moving region counts as one object)
+            objects = len(detections_best) + len(detections_box) + len(results.get("pose", []))
+            budget.observe(max(objects, int(region is not None)))
+
+            free_memory()
+            observe_stage("frame_total", time.perf_counter() - frame_started, camera_id)
+            count("frames_processed", camera_id)
             iterations += 1
 
     except Exception as e:
         logger.error(f"[{camera_id}] Main detection loop error: {e}")
     finally:
+        if bus is not None:
+            bus.close()
+        budget.close()
+        lease.release(camera_id)
         logger.info(f"🧹 End detection cam {camera_id}, iterations completed: {iterations}")
         return {"camera_id": camera_id, "iterations_completed": iterations, "status": "completed"}
@@ -0,0 +1,171 @@
+# ============================================================================
+# TILING.PY - Sliced inference for high-resolution overview cameras
+# The detect level (640x384) loses small plates and distant people on 4K
+# cameras. In tiled mode, on top of the normal detect-level pass, the
+# full-resolution level is cut into overlapping tiles that go through the
+# models in one batch; tile results are scaled back to detect coordinates
+# and merged with the detect-level ones by a vectorized cross-tile NMS.
+# Config per camera in Camera.tiling, merged with DEFAULT_TILING:
+#     enabled      tiled pass on/off
+#     size         tile side in full-resolution pixels
+#     overlap      fraction shared by neighbouring tiles
+#     every        tiled pass on 1 scheduled frame out of N
+#     models       models run on tiles (pose keeps its person crops)
+#     max_lag_s    frame older than this: tiles skipped to catch up (realtime)
+#     source_size  [w, h] of the full level for this camera (ingest), None: global
+# ============================================================================
+import copy
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from gismap.tracking import box_iou
+
+logger = logging.getLogger(__name__)
+
+Box = Tuple[int, int, int, int]
+
+DEFAULT_TILING = {
+    "enabled": False,
+    "size": 640,
+    "overlap": 0.2,
+    "every": 1,
+    "models": ["best", "box"],
+    "max_lag_s": 1.0,
+    "source_size": None,
+}
+
+
+def merge_tiling(overrides: Optional[Dict]) -> Dict:
+    tiling = copy.deepcopy(DEFAULT_TILING)
+    tiling.update(overrides or {})
+    return tiling
+
+
+def _starts(length: int, size: int, stride: int) -> np.ndarray:
+    if length <= size:
+        return np.zeros(1, dtype=int)
+    starts = np.arange(0, length - size, stride)
+    # Last tile flush with the border instead of running past it
+    return np.append(starts, length - size)
+
+
+def tile_grid(shape, size: int = 640, overlap: float = 0.2) -> List[Box]:
+    """Overlapping size x size tiles covering a frame (clipped for small frames)."""
+    h, w = shape[:2]
+    stride = max(int(size * (1 - overlap)), 1)
+    xs, ys = np.meshgrid(_starts(w, size, stride), _starts(h, size, stride))
+    x1, y1 = xs.ravel(), ys.ravel()
+    tiles = np.stack([x1, y1, np.minimum(x1 + size, w), np.minimum(y1 + size, h)], axis=1)
+    return [tuple(t) for t in tiles.tolist()]
+
+
+def tiles_in_regions(tiles: List[Box], regions: Optional[List[Box]], scale: Tuple[float, float]) -> List[Box]:
+    """Tiles touching any region (detect coordinates, `scale` = full / detect); None keeps all."""
+    if regions is None or not tiles:
+        return list(tiles)
+    if not regions:
+        return []
+    scaled = np.asarray(regions, dtype=np.float64) * np.array([scale[0], scale[1], scale[0], scale[1]])
+    t = np.asarray(tiles, dtype=np.float64)
+    overlaps = ((t[:, None, 0] < scaled[None, :, 2]) & (scaled[None, :, 0] < t[:, None, 2])
+                & (t[:, None, 1] < scaled[None, :, 3]) & (scaled[None, :, 1] < t[:, None, 3]))
+    return [tile for tile, keep in zip(tiles, overlaps.any(axis=1)) if keep]
+
+
+def scale_detections(detections: List[Dict], sx: float, sy: float) -> List[Dict]:
+    """Detections divided by (sx, sy): full-resolution boxes back to detect coordinates."""
+    for det in detections:
+        x1, y1, x2, y2 = det["bbox"]
+        det["bbox"] = (int(x1 / sx), int(y1 / sy), int(np.ceil(x2 / sx)), int(np.ceil(y2 / sy)))
+    return detections
+
+
+def box_ios(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Intersection over the smaller box: a box cut by a tile border is mostly inside the whole one."""
+    wh = np.maximum(np.minimum(a[:, None, 2:], b[None, :, 2:]) - np.maximum(a[:, None, :2], b[None, :, :2]), 0)
+    inter = wh[..., 0] * wh[..., 1]
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(np.minimum(area_a[:, None], area_b[None, :]), 1e-6)
+
+
+def merge_detections(detections: List[Dict], iou_threshold: float = 0.5, ios_threshold: float = 0.7) -> List[Dict]:
+    """
+    Cross-tile NMS, per class: the best-scoring box of each cluster is kept
+    and grown to the union of the boxes it suppresses (an object cut by a
+    tile border gets its full extent back). Overlaps are computed once as
+    matrices; suppression is one vectorized row update per kept box.
+    """
+    if len(detections) < 2:
+        return detections
+    boxes = np.array([det["bbox"] for det in detections], dtype=np.float64)
+    scores = np.array([det["confidence"] for det in detections])
+    classes = np.array([det["class_name"] for det in detections])
+
+    order = np.argsort(-scores, kind="stable")
+    boxes, classes = boxes[order], classes[order]
+    same = (box_iou(boxes, boxes) >= iou_threshold) | (box_ios(boxes, boxes) >= ios_threshold)
+    same &= classes[:, None] == classes[None, :]
+    # Only lower-scored boxes can be suppressed by a box
+    same = np.triu(same, k=1)
+
+    alive = np.ones(len(boxes), dtype=bool)
+    merged = []
+    for i in range(len(boxes)):
+        if not alive[i]:
+            continue
+        group = np.flatnonzero(same[i] & alive)
+        alive[group] = False
+        det = dict(detections[order[i]])
+        if len(group):
+            members = boxes[np.append(group, i)]
+            det["bbox"] = (int(members[:, 0].min()), int(members[:, 1].min()),
+                           int(members[:, 2].max()), int(members[:, 3].max()))
+        merged.append(det)
+    return merged
+
+
+class TilePlanner:
+    """Which frames get a tiled pass, and on which tiles."""
+
+    def __init__(self, camera_id, tiling: Optional[Dict] = None):
+        self.camera_id = camera_id
+        self.config = merge_tiling(tiling)
+        self.enabled = bool(self.config["enabled"])
+        self.frame_index = 0
+        self._grids: Dict[Tuple[int, int], List[Box]] = {}
+
+    def grid(self, full_shape) -> List[Box]:
+        key = tuple(full_shape[:2])
+        if key not in self._grids:
+            self._grids[key] = tile_grid(full_shape, int(self.config["size"]), float(self.config["overlap"]))
+            logger.info(f"[{self.camera_id}] Tiled inference: {len(self._grids[key])} tiles "
+                        f"of {self.config['size']}px on {key[1]}x{key[0]}")
+        return self._grids[key]
+
+    def due(self, frame_age_s: float) -> bool:
+        """Tiled pass on this frame? Counts scheduled frames; skipped when behind realtime."""
+        if not self.enabled:
+            return False
+        index = self.frame_index
+        self.frame_index += 1
+        if index % max(int(self.config["every"]), 1):
+            return False
+        if frame_age_s > float(self.config["max_lag_s"]):
+            logger.debug(f"[{self.camera_id}] Frame {frame_age_s:.2f}s old, tiles skipped")
+            return False
+        return True
+
+    def plan(self, plan: Dict[str, Optional[List[Box]]], full_shape, detect_shape) -> Dict[str, List[Box]]:
+        """{model: tiles} (full-resolution coordinates) for the tiled models of a schedule plan."""
+        scale = (full_shape[1] / detect_shape[1], full_shape[0] / detect_shape[0])
+        grid = self.grid(full_shape)
+        tiled = {}
+        for model in self.config["models"]:
+            if model in plan:
+                tiles = tiles_in_regions(grid, plan[model], scale)
+                if tiles:
+                    tiled[model] = tiles
+        return tiled
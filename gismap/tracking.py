@@ -0,0 +1,239 @@
+# ============================================================================
+# TRACKING.PY - Per-camera multi-object tracker (SORT / ByteTrack style)
+# Constant-velocity Kalman filter on (cx, cy, w, h), all tracks predicted
+# and updated at once with batched NumPy; detections are associated to the
+# predicted boxes by IoU (same class only), confident detections first, then
+# the weak ones to the tracks left over (ByteTrack).
+# Track IDs come from a per-camera Redis counter, so they stay unique when
+# the detection task restarts; they are attached to detections ("track_id")
+# and to the alerts raised from them.
+# The tracker also decides when a plate deserves OCR: on a new track, then
+# only when the crop gets clearly better.
+# ============================================================================
+import itertools
+import logging
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+import redis
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+NEXT_ID_KEY = "tracks:{camera_id}:next_id"
+
+# Kalman noise, relative to the box size (as in ByteTrack)
+STD_POSITION = 1.0 / 20
+STD_VELOCITY = 1.0 / 160
+
+_F = np.eye(8, dtype=np.float64)
+_F[:4, 4:] = np.eye(4)
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU matrix between (N, 4) and (M, 4) xyxy boxes."""
+    if not len(a) or not len(b):
+        return np.zeros((len(a), len(b)), np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def greedy_match(scores: np.ndarray, threshold: float):
+    """(rows, cols) pairs, best score first, each row and column used once."""
+    rows, cols = np.nonzero(scores >= threshold)
+    order = np.argsort(-scores[rows, cols], kind="stable")
+    used_rows, used_cols, pairs = set(), set(), []
+    for i, j in zip(rows[order].tolist(), cols[order].tolist()):
+        if i not in used_rows and j not in used_cols:
+            used_rows.add(i)
+            used_cols.add(j)
+            pairs.append((i, j))
+    return pairs
+
+
+def _xyxy_to_cxcywh(boxes: np.ndarray) -> np.ndarray:
+    wh = boxes[:, 2:] - boxes[:, :2]
+    return np.concatenate([boxes[:, :2] + wh / 2, wh], axis=1)
+
+
+def _cxcywh_to_xyxy(state: np.ndarray) -> np.ndarray:
+    half = state[:, 2:4] / 2
+    return np.concatenate([state[:, :2] - half, state[:, :2] + half], axis=1)
+
+
+def _noise(wh: np.ndarray, std: float) -> np.ndarray:
+    """(N, 4) standard deviations for (x, y, w, h)-like components, from box w / h."""
+    return np.stack([wh[:, 0], wh[:, 1], wh[:, 0], wh[:, 1]], axis=1) * std
+
+
+def crop_quality(crop: np.ndarray) -> float:
+    """Crop size x sharpness (variance of the Laplacian): bigger and less blurred reads better."""
+    if crop is None or crop.size == 0:
+        return 0.0
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+    return float(np.sqrt(gray.shape[0] * gray.shape[1]) * np.sqrt(sharpness))
+
+
+class Tracker:
+    """
+    update(detections) returns the detections with a "track_id" (None for a
+    weak detection that extends no track: it does not start one either).
+    """
+
+    def __init__(self, camera_id, iou_threshold: float = 0.3, high_conf: float = 0.5,
+                 max_age: int = 15, min_hits: int = 2):
+        self.camera_id = camera_id
+        self.iou_threshold = iou_threshold
+        # Detections below high_conf only extend existing tracks
+        self.high_conf = high_conf
+        # Updates without a match before a track is dropped
+        self.max_age = max_age
+        # Hits before a track counts as confirmed
+        self.min_hits = min_hits
+
+        self.x = np.zeros((0, 8))
+        self.P = np.zeros((0, 8, 8))
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.classes: List[str] = []
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.misses = np.zeros(0, dtype=np.int64)
+        # Per track id: OCR runs and best crop quality sent so far
+        self.meta: Dict[int, Dict] = {}
+        self._local_ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ------------------------------------------------------------------
+    # Kalman
+    # ------------------------------------------------------------------
+    def _predict(self):
+        if not len(self.ids):
+            return
+        std = np.concatenate([_noise(self.x[:, 2:4], STD_POSITION), _noise(self.x[:, 2:4], STD_VELOCITY)], axis=1)
+        self.x = self.x @ _F.T
+        self.P = _F @ self.P @ _F.T + std[:, :, None] ** 2 * np.eye(8)
+        # Boxes never shrink below a pixel
+        self.x[:, 2:4] = np.maximum(self.x[:, 2:4], 1.0)
+
+    def _correct(self, index: np.ndarray, measured: np.ndarray):
+        """Kalman update of tracks `index` with (M, 4) cxcywh measurements."""
+        x, P = self.x[index], self.P[index]
+        R = _noise(measured[:, 2:4], STD_POSITION)[:, :, None] ** 2 * np.eye(4)
+        S = P[:, :4, :4] + R
+        # K = P H^T S^-1, S symmetric
+        K = np.linalg.solve(S, P[:, :4, :]).transpose(0, 2, 1)
+        innovation = measured - x[:, :4]
+        self.x[index] = x + (K @ innovation[:, :, None])[:, :, 0]
+        self.P[index] = P - K @ P[:, :4, :]
+
+    def _new_id(self) -> int:
+        try:
+            return int(redis_client.incr(NEXT_ID_KEY.format(camera_id=self.camera_id)))
+        except redis.RedisError as e:
+            logger.warning(f"[{self.camera_id}] Track id counter unavailable ({e}), local id used")
+            return -next(self._local_ids)
+
+    # ------------------------------------------------------------------
+    # Association
+    # ------------------------------------------------------------------
+    def _associate(self, tracks: np.ndarray, dets: np.ndarray, boxes: np.ndarray, det_classes: List[str],
+                   predicted: np.ndarray):
+        """Greedy IoU matching between track indices and detection indices of the same class."""
+        if not len(tracks) or not len(dets):
+            return []
+        iou = box_iou(predicted[tracks], boxes[dets])
+        same_class = np.array([[self.classes[t] == det_classes[d] for d in dets] for t in tracks])
+        pairs = greedy_match(np.where(same_class, iou, 0.0), self.iou_threshold)
+        return [(tracks[i], dets[j]) for i, j in pairs]
+
+    def update(self, detections: List[Dict]) -> List[Dict]:
+        self._predict()
+        predicted = _cxcywh_to_xyxy(self.x[:, :4]) if len(self.ids) else np.zeros((0, 4))
+
+        boxes = np.array([det["bbox"] for det in detections], dtype=np.float64).reshape(-1, 4)
+        confs = np.array([det["confidence"] for det in detections], dtype=np.float64)
+        det_classes = [det["class_name"] for det in detections]
+        strong = np.flatnonzero(confs >= self.high_conf)
+        weak = np.flatnonzero(confs < self.high_conf)
+
+        all_tracks = np.arange(len(self.ids))
+        matches = self._associate(all_tracks, strong, boxes, det_classes, predicted)
+        left = np.setdiff1d(all_tracks, [t for t, _ in matches])
+        matches += self._associate(left, weak, boxes, det_classes, predicted)
+
+        matched_tracks = np.array([t for t, _ in matches], dtype=np.int64)
+        matched_dets = np.array([d for _, d in matches], dtype=np.int64)
+        if len(matches):
+            self._correct(matched_tracks, _xyxy_to_cxcywh(boxes[matched_dets]))
+        self.hits[matched_tracks] += 1
+        self.misses += 1
+        self.misses[matched_tracks] = 0
+
+        kept = {}
+        for t, d in matches:
+            kept[d] = dict(detections[d], track_id=int(self.ids[t]))
+
+        # Unmatched confident detections start tracks
+        new = np.setdiff1d(strong, matched_dets)
+        if len(new):
+            measured = _xyxy_to_cxcywh(boxes[new])
+            std = np.concatenate([_noise(measured[:, 2:4], 2 * STD_POSITION),
+                                  _noise(measured[:, 2:4], 10 * STD_VELOCITY)], axis=1)
+            new_ids = np.array([self._new_id() for _ in new], dtype=np.int64)
+            self.x = np.concatenate([self.x, np.concatenate([measured, np.zeros_like(measured)], axis=1)])
+            self.P = np.concatenate([self.P, std[:, :, None] ** 2 * np.eye(8)])
+            self.ids = np.concatenate([self.ids, new_ids])
+            self.classes.extend(det_classes[d] for d in new)
+            self.hits = np.concatenate([self.hits, np.ones(len(new), dtype=np.int64)])
+            self.misses = np.concatenate([self.misses, np.zeros(len(new), dtype=np.int64)])
+            for d, track_id in zip(new.tolist(), new_ids.tolist()):
+                self.meta[track_id] = {"ocr_runs": 0, "ocr_quality": 0.0, "started": time.time()}
+                kept[d] = dict(detections[d], track_id=track_id)
+
+        self._drop_stale()
+        return [kept.get(d) or dict(det, track_id=None) for d, det in enumerate(detections)]
+
+    def _drop_stale(self):
+        alive = self.misses <= self.max_age
+        if alive.all():
+            return
+        for track_id in self.ids[~alive].tolist():
+            self.meta.pop(track_id, None)
+        self.x, self.P, self.ids = self.x[alive], self.P[alive], self.ids[alive]
+        self.hits, self.misses = self.hits[alive], self.misses[alive]
+        self.classes = [c for c, keep in zip(self.classes, alive) if keep]
+
+    # ------------------------------------------------------------------
+    # OCR gating
+    # ------------------------------------------------------------------
+    def is_confirmed(self, track_id: Optional[int]) -> bool:
+        if track_id is None:
+            return False
+        index = np.flatnonzero(self.ids == track_id)
+        return bool(len(index)) and int(self.hits[index[0]]) >= self.min_hits
+
+    def should_ocr(self, track_id: int, quality: float, improvement: float = 1.3, max_runs: int = 3) -> bool:
+        """
+        True for the first crop of a track, then only for a crop at least
+        `improvement` times better than the best one already read (at most
+        max_runs per track). A True answer is counted as a run.
+        """
+        meta = self.meta.get(track_id)
+        if meta is None or quality <= 0:
+            return False
+        if meta["ocr_runs"] and (meta["ocr_runs"] >= max_runs or quality < meta["ocr_quality"] * improvement):
+            return False
+        meta["ocr_runs"] += 1
+        meta["ocr_quality"] = quality
+        return True
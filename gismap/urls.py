@@ -31,6 +31,17 @@ urlpatterns = [
    # path('api/stats/', views.get_dashboard_stats, name='dashboard_stats'),
 
 path('alertes/', notification_dashboard, name='notification_dashboard'),
+    path('api/motion-stats/', views.motion_stats, name='motion_stats'),
+    path('api/fire-cascade/', views.fire_cascade_stats, name='fire_cascade_stats'),
+    path('api/frame-bus/lag/', views.frame_bus_lag, name='frame_bus_lag'),
+    path('api/analytic-budget/', views.analytic_budget, name='analytic_budget'),
+    path('api/result-cache/', views.result_cache_stats, name='result_cache_stats'),
+    path('api/inference-budget/', views.inference_budget, name='inference_budget'),
+    path('api/inference-workers/', views.inference_workers, name='inference_workers'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('api/cameras/<int:camera_id>/priority/', views.camera_priority, name='camera_priority'),
+    path('camera/<int:camera_id>/roi/', views.camera_roi_editor, name='camera_roi_editor'),
+    path('api/cameras/<int:camera_id>/roi/', views.camera_roi, name='camera_roi'),
 
 ]
 
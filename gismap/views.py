@@ -16,12 +16,8 @@ from urllib.parse import urlparse
 import subprocess
 #from tasks.streaming_tasks import stream_camera
 import os
-import cv2
-import threading
-import time
 from datetime import datetime
 from gismap.models import DetectionMatricule
-import redis
 
 def alertes_matricules(request):
     alertes = DetectionMatricule.objects.filter(est_autorise=False)\
@@ -53,56 +49,6 @@ def generate_hls_url(rtsp_url):
     stream_name = parsed.path.split('/')[-1]  # Récupère le nom du flux (ex: 'stream1')
     return f"http://192.168.1.30:8888/{stream_name}/index.m3u8"
 
-# Connect to Redis
-redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
-
-def process_camera_stream(camera_id, rtsp_url):
-    print(f"[{camera_id}] Started processing thread for {rtsp_url}")
-    cap = cv2.VideoCapture(rtsp_url)
-
-    if not cap.isOpened():
-        print(f"[{camera_id}] Failed to connect to stream")
-        return
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print(f"[{camera_id}] Frame not received, retrying in 1s")
-            time.sleep(1)
-            continue
-
-        # Convert frame to JPEG bytes
-        ret, buffer = cv2.imencode('.jpg', frame)
-        if not ret:
-            print(f"[{camera_id}] Failed to encode frame")
-            continue
-
-        frame_bytes = buffer.tobytes()
-
-        # Store frame in Redis (key: camera:<id>:frame)
-        redis_client.set(f"camera:{camera_id}:frame", frame_bytes)
-
-        # Limit to ~1 FPS
-        time.sleep(1)
-
-
-running_threads = {}
-def start_camera_thread(camera_id, rtsp_url):
-    if camera_id not in running_threads or not running_threads[camera_id].is_alive():
-        t = threading.Thread(
-            target=process_camera_stream, 
-            args=(camera_id, rtsp_url), 
-            daemon=True
-        )
-        t.start()
-        running_threads[camera_id] = t
-        print(f"[INFO] Camera thread {camera_id} started. Active threads: {threading.active_count()}")
-    else:
-        print(f"[INFO] Camera thread {camera_id} already running")
-
-
-
-
 def index(request):
     return render(request, 'map/index.html')
 
@@ -219,6 +165,26 @@ def save_camera(request):
         if not name or not rtsp_url or not coordinates:
             return JsonResponse({'error': 'Name, URL, and coordinates are required'}, status=400)
 
+        if data.get('decode_mode', 'all') not in dict(Camera.DECODE_MODES):
+            return JsonResponse({'error': 'Invalid decode_mode'}, status=400)
+
+        from .roi import validate_polygons
+        try:
+            roi_polygons = validate_polygons(data.get('roi_polygons', []))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        try:
+            decode_lowres = int(data.get('decode_lowres', 0))
+        except (TypeError, ValueError):
+            decode_lowres = -1
+        if not 0 <= decode_lowres <= 3:
+            return JsonResponse({'error': 'decode_lowres must be between 0 and 3'}, status=400)
+
+        tiling = data.get('tiling', {})
+        if not isinstance(tiling, dict):
+            return JsonResponse({'error': 'tiling must be an object'}, status=400)
+
         point = Point(coordinates[0], coordinates[1])
 
         # Verify camera is inside a department
@@ -236,11 +202,14 @@ def save_camera(request):
             rtsp_url=rtsp_url,
             hls_url=generate_hls_url(rtsp_url),
             location=point,
-            department=department
+            department=department,
+            decode_mode=data.get('decode_mode', 'all'),
+            decode_lowres=decode_lowres,
+            roi_polygons=roi_polygons,
+            tiling=tiling,
         )
 
-        # Start camera thread
-        start_camera_thread(camera.id, rtsp_url)
+        # Capture starts on the ingest supervisor's next camera refresh
 
         return JsonResponse({'status': 'success', 'id': camera.id, 'department_id': department.id})
 
@@ -302,9 +271,6 @@ def all_cameras_stream(request):
 
     cameras = Camera.objects.filter(department_id=departement_id) if departement_id else Camera.objects.all()
 
-    for camera in cameras:
-        start_camera_thread(camera.id, camera.rtsp_url)
-
     context = {
         'cameras': cameras,
         'departements': departements,
@@ -415,3 +381,171 @@ def get_dashboard_stats(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+
+
+def motion_stats(request):
+    """Part des frames sautées par l'étage mouvement, par caméra (dimensionnement matériel)"""
+    from .motion import get_motion_stats
+    try:
+        cameras = Camera.objects.values_list('id', 'name', 'motion_gating')
+        stats = get_motion_stats([cam_id for cam_id, _, _ in cameras])
+        data = [
+            {'camera_id': cam_id, 'camera': name, 'motion_gating': gating, **stats[cam_id]}
+            for cam_id, name, gating in cameras
+        ]
+        return JsonResponse({'cameras': data})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def fire_cascade_stats(request):
+    """Taux de passage de chaque étage de la cascade feu (pré-filtre, YOLO, CLIP), par caméra"""
+    from .fire_prefilter import get_cascade_stats
+    try:
+        cameras = Camera.objects.values_list('id', 'name')
+        stats = get_cascade_stats([cam_id for cam_id, _ in cameras])
+        data = [{'camera_id': cam_id, 'camera': name, **stats[cam_id]} for cam_id, name in cameras]
+        return JsonResponse({'cameras': data})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def analytic_budget(request):
+    """Budget de chaque modèle par caméra: exécutions, frames sautées, crops, temps"""
+    from .schedule import get_schedule_stats, merge_schedule
+    try:
+        cameras = Camera.objects.values_list('id', 'name', 'analytic_schedule')
+        stats = get_schedule_stats([cam_id for cam_id, _, _ in cameras])
+        data = [
+            {'camera_id': cam_id, 'camera': name, 'schedule': merge_schedule(schedule), **stats[cam_id]}
+            for cam_id, name, schedule in cameras
+        ]
+        return JsonResponse({'cameras': data})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def result_cache_stats(request):
+    """Taux de réutilisation des résultats (scène inchangée) par caméra et par analytique"""
+    from .result_cache import get_cache_stats
+    try:
+        cameras = Camera.objects.values_list('id', 'name')
+        stats = get_cache_stats([cam_id for cam_id, _ in cameras])
+        data = [
+            {'camera_id': cam_id, 'camera': name, 'analytics': stats[cam_id]}
+            for cam_id, name in cameras
+        ]
+        return JsonResponse({'cameras': data})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def inference_budget(request):
+    """FPS cible et FPS effectif de chaque caméra dans le budget d'inférence partagé"""
+    from .budget import get_budget_stats
+    try:
+        cameras = Camera.objects.values_list('id', 'name', 'inference_priority')
+        stats = get_budget_stats([cam_id for cam_id, _, _ in cameras])
+        data = [
+            {'camera_id': cam_id, 'camera': name, 'priority': priority, 'running': stats[cam_id] is not None,
+             **(stats[cam_id] or {})}
+            for cam_id, name, priority in cameras
+        ]
+        return JsonResponse({'cameras': data})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def inference_workers(request):
+    """Débit en régime établi de chaque processus d'inférence épinglé (images/s, par cœur)"""
+    from .worker_pool import get_worker_stats
+    try:
+        return JsonResponse(get_worker_stats())
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def metrics(request):
+    """Latence par étape et compteurs du pipeline, au format texte Prometheus (tous les processus)"""
+    from django.http import HttpResponse
+    from .metrics import render as render_metrics
+    try:
+        return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+    except Exception as e:
+        return HttpResponse(f"# error: {e}\n", status=500, content_type="text/plain; charset=utf-8")
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def camera_priority(request, camera_id):
+    """POST {"priority": 0|1|2}: priorité opérateur de la caméra, appliquée en direct"""
+    from .budget import set_priority
+    try:
+        camera = Camera.objects.get(pk=camera_id)
+    except Camera.DoesNotExist:
+        return JsonResponse({'error': 'Camera not found'}, status=404)
+    try:
+        priority = int(json.loads(request.body).get('priority'))
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except (TypeError, ValueError, AttributeError):
+        return JsonResponse({'error': 'priority must be an integer'}, status=400)
+    if priority not in dict(Camera.INFERENCE_PRIORITIES):
+        return JsonResponse({'error': 'Invalid priority'}, status=400)
+    camera.inference_priority = priority
+    camera.save(update_fields=['inference_priority'])
+    # Running detection loops pick it up on their next budget refresh
+    set_priority(camera.id, priority)
+    return JsonResponse({'camera_id': camera.id, 'priority': priority})
+
+
+def frame_bus_lag(request):
+    """Retard de chaque groupe de consommateurs (analytique) sur le frame bus, par caméra"""
+    from .frame_bus import consumer_lag
+    try:
+        data = [
+            {'camera_id': cam_id, 'camera': name, 'groups': consumer_lag(cam_id)}
+            for cam_id, name in Camera.objects.values_list('id', 'name')
+        ]
+        return JsonResponse({'cameras': data})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def camera_roi_editor(request, camera_id):
+    """Éditeur des zones d'inférence (ROI) dessinées sur l'image de la caméra"""
+    try:
+        camera = Camera.objects.get(pk=camera_id)
+    except Camera.DoesNotExist:
+        return redirect('all_cameras_stream')
+    return render(request, 'camera_roi.html', {'camera': camera})
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def camera_roi(request, camera_id):
+    """GET: polygones ROI de la caméra; POST {"roi_polygons": [...]}: les remplacer ([] = toute l'image)"""
+    from .roi import RoiMask, validate_polygons
+    try:
+        camera = Camera.objects.get(pk=camera_id)
+    except Camera.DoesNotExist:
+        return JsonResponse({'error': 'Camera not found'}, status=404)
+
+    if request.method == 'POST':
+        try:
+            camera.roi_polygons = validate_polygons(json.loads(request.body).get('roi_polygons', []))
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        except (ValueError, AttributeError) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        camera.save(update_fields=['roi_polygons'])
+
+    # Part de l'image réellement analysée, au niveau détection (640x384)
+    compiled = RoiMask(camera.roi_polygons).compile((384, 640))
+    return JsonResponse({
+        'camera_id': camera.id,
+        'roi_polygons': camera.roi_polygons,
+        'coverage': round(compiled['coverage'], 4) if compiled else 1.0,
+        'rects': compiled['rects'] if compiled else None,
+    })
+
@@ -0,0 +1,255 @@
+# ============================================================================
+# WORKER_POOL.PY - Inference processes pinned to their own cores
+# Threads of one process share the GIL, and every torch / OpenCV call opens
+# its own pool of intra-op threads (one per core): four inference threads
+# on an 8-core node run 32+ compute threads. Inference runs instead in
+# processes, each pinned to a disjoint core set with its runtimes limited
+# to that many threads:
+#     python manage.py run_inference --workers 4          batched servers
+#     CELERY_WORKER_KIND=inference celery -A smartVision worker   (prefork, OCR)
+# Notification and I/O tasks, and the per-camera detection loops (which
+# would each hold a pinned process for their whole run), keep the cheap
+# threaded Celery pool.
+# Each process publishes its steady-state throughput (frames/s, per core)
+# in the hash stats:inference:workers.
+# ============================================================================
+import json
+import logging
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, socket_timeout=5)
+
+WORKERS_KEY = "stats:inference:workers"  # worker name -> JSON throughput
+WORKER_TTL = 30.0  # secondes sans publication: processus considéré arrêté
+THREAD_ENV = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+# Threads granted to this process by pin_process() (0: not pinned)
+_process_threads = 0
+
+
+def available_cores() -> List[int]:
+    """Cores this process may run on (cgroup / taskset aware when the OS tells)."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def core_sets(workers: int, cores: Optional[Sequence[int]] = None) -> List[List[int]]:
+    """Split the cores in `workers` contiguous, disjoint sets (sizes differ by at most one)."""
+    cores = list(cores if cores is not None else available_cores())
+    workers = max(1, min(workers, len(cores)))
+    size, extra = divmod(len(cores), workers)
+    sets, start = [], 0
+    for index in range(workers):
+        end = start + size + (1 if index < extra else 0)
+        sets.append(cores[start:end])
+        start = end
+    return sets
+
+
+def default_workers(workers: Optional[int] = None) -> int:
+    """`workers` (default INFERENCE_WORKERS), or when 0 as many workers of INFERENCE_CORES_PER_WORKER cores as the node holds."""
+    from django.conf import settings
+    if workers is None:
+        workers = getattr(settings, "INFERENCE_WORKERS", 1)
+    if workers > 0:
+        return workers
+    cores_per_worker = getattr(settings, "INFERENCE_CORES_PER_WORKER", 4)
+    return max(len(available_cores()) // max(cores_per_worker, 1), 1)
+
+
+def pin_process(cores: Sequence[int]) -> int:
+    """
+    Pin this process to `cores` and size the torch / OpenCV / BLAS thread
+    pools to match. Call it before the first model is loaded: OpenMP reads
+    its environment once. Returns the thread count.
+    """
+    global _process_threads
+    threads = max(len(cores), 1)
+    try:
+        os.sched_setaffinity(0, set(cores))
+    except (AttributeError, OSError) as e:
+        logger.warning(f"⚠️ CPU pinning unavailable ({e}), only thread counts are limited")
+    for name in THREAD_ENV:
+        os.environ[name] = str(threads)
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+    # torch is only touched in processes that run it (detectors.py imports it on first load)
+    torch = sys.modules.get("torch")
+    if torch is None:
+        try:
+            import torch
+        except ImportError:
+            torch = None
+    if torch is not None:
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # already set once parallel work started in this process
+    _process_threads = threads
+    logger.info(f"📌 Process {os.getpid()} pinned to cores {list(cores)} ({threads} threads)")
+    return threads
+
+
+def process_threads() -> int:
+    """Intra-op threads granted to this process by pin_process() (0 when not pinned)."""
+    return _process_threads
+
+
+# ============================================================================
+# Throughput
+# ============================================================================
+class ThroughputMeter:
+    """
+    Frames per second of one worker once warmed up: the first warmup_s
+    seconds (model load, first batches, allocator growth) are left out,
+    then rates are taken over the last window_s seconds:
+        fps            frames served per second (bounded by the load)
+        capacity_fps   frames per second of busy time (what the cores can do)
+    """
+
+    def __init__(self, worker: str, cores: Sequence[int], warmup_s: float = 30.0,
+                 window_s: float = 60.0, publish_s: float = 5.0):
+        self.worker = worker
+        self.cores = list(cores)
+        self.warmup_s = warmup_s
+        self.window_s = window_s
+        self.publish_s = publish_s
+        self.started = time.monotonic()
+        self.frames = 0
+        self.busy_s = 0.0
+        # (monotonic time, total frames, total busy seconds) samples inside the window
+        self._samples: List = []
+        self._published_at = 0.0
+
+    def add(self, frames: int, busy_s: float = 0.0):
+        now = time.monotonic()
+        self.frames += frames
+        self.busy_s += busy_s
+        if now - self.started >= self.warmup_s:
+            self._samples.append((now, self.frames, self.busy_s))
+            while len(self._samples) > 2 and now - self._samples[0][0] > self.window_s:
+                self._samples.pop(0)
+        if now - self._published_at >= self.publish_s:
+            self.publish(now)
+
+    def fps(self) -> Optional[float]:
+        """Steady-state frames served per second, None while warming up."""
+        if len(self._samples) < 2:
+            return None
+        (t0, f0, _), (t1, f1, _) = self._samples[0], self._samples[-1]
+        return (f1 - f0) / (t1 - t0) if t1 > t0 else None
+
+    def capacity(self) -> Optional[float]:
+        """Steady-state frames per busy second, None while warming up or idle."""
+        if len(self._samples) < 2:
+            return None
+        (_, f0, b0), (_, f1, b1) = self._samples[0], self._samples[-1]
+        return (f1 - f0) / (b1 - b0) if b1 > b0 else None
+
+    def stats(self) -> Dict:
+        fps, capacity = self.fps(), self.capacity()
+        cores = max(len(self.cores), 1)
+        return {
+            "pid": os.getpid(),
+            "cores": self.cores,
+            "threads": process_threads(),
+            "frames": self.frames,
+            "steady": fps is not None,
+            "fps": round(fps, 2) if fps is not None else None,
+            "capacity_fps": round(capacity, 2) if capacity is not None else None,
+            "capacity_per_core": round(capacity / cores, 2) if capacity is not None else None,
+            "ts": time.time(),
+        }
+
+    def publish(self, now: Optional[float] = None):
+        self._published_at = now or time.monotonic()
+        try:
+            redis_client.hset(WORKERS_KEY, self.worker, json.dumps(self.stats()))
+        except redis.RedisError as e:
+            logger.error(f"[{self.worker}] Redis throughput publish error: {e}")
+
+    def close(self):
+        try:
+            redis_client.hdel(WORKERS_KEY, self.worker)
+        except redis.RedisError:
+            pass
+
+
+def get_worker_stats() -> Dict:
+    """{worker: throughput} of the live inference processes, plus the node totals."""
+    try:
+        raw = redis_client.hgetall(WORKERS_KEY)
+    except redis.RedisError as e:
+        logger.error(f"Redis worker stats error: {e}")
+        raw = {}
+    now = time.time()
+    workers = {}
+    for worker, value in raw.items():
+        state = json.loads(value)
+        if now - state["ts"] <= WORKER_TTL:
+            workers[worker.decode()] = state
+    measured = [state for state in workers.values() if state["capacity_fps"] is not None]
+    cores = sum(len(state["cores"]) for state in measured)
+    capacity = sum(state["capacity_fps"] for state in measured)
+    return {
+        "workers": workers,
+        "fps": round(sum(state["fps"] or 0.0 for state in workers.values()), 2),
+        "capacity_fps": round(capacity, 2),
+        "capacity_per_core": round(capacity / cores, 2) if cores else None,
+    }
+
+
+# ============================================================================
+# Process pool (run_inference --workers N)
+# ============================================================================
+def _worker_main(target: Callable, index: int, cores: List[int]):
+    pin_process(cores)
+    target(index, cores)
+
+
+def run_pinned(target: Callable, workers: int, cores: Optional[Sequence[int]] = None,
+               restart_delay: float = 5.0):
+    """
+    Run target(index, cores) in `workers` processes, one per core set, and
+    restart any that dies until interrupted. Processes are forked before
+    any model is loaded: each one loads its own.
+    """
+    import multiprocessing
+    context = multiprocessing.get_context("fork")
+    sets = core_sets(workers, cores)
+    processes: Dict[int, multiprocessing.Process] = {}
+
+    def start(index: int):
+        process = context.Process(target=_worker_main, args=(target, index, sets[index]),
+                                  name=f"inference-{index}", daemon=True)
+        process.start()
+        processes[index] = process
+        logger.info(f"🚀 Inference worker {index} (pid {process.pid}) on cores {sets[index]}")
+
+    for index in range(len(sets)):
+        start(index)
+    try:
+        while True:
+            time.sleep(restart_delay)
+            for index, process in list(processes.items()):
+                if not process.is_alive():
+                    logger.error(f"❌ Inference worker {index} exited ({process.exitcode}), restarting")
+                    start(index)
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(timeout=10)
@@ -1,6 +1,8 @@
 import os
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_process_init, worker_ready
+from kombu import Queue
 
 # Set default Django settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smartVision.settings')
@@ -8,6 +10,27 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smartVision.settings')
 # Create Celery app
 app = Celery('smartVision')
 
+# Two kinds of workers (CELERY_WORKER_KIND):
+#   "io" (défaut)   pool de threads: notifications, supervision, boucles de détection
+#   "inference"     processus épinglés sur des cœurs disjoints (gismap/worker_pool.py),
+#                   file "inference" uniquement: tâches OCR courtes
+# Les boucles de détection (une par caméra, jusqu'à max_iterations) restent sur le
+# pool de threads: routées dans le petit pool épinglé, elles occuperaient chacune
+# un processus et OCR et caméras suivantes attendraient indéfiniment. En mode
+# local, préférer le serveur batché (run_inference --workers) pour l'inférence.
+# Un worker "io" lancé seul consomme les deux files; avec un worker "inference"
+# dédié, le lancer avec `-Q celery`.
+WORKER_KIND = os.getenv("CELERY_WORKER_KIND", "io")
+INFERENCE_QUEUE = "inference"
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """Short OCR tasks only: the long-running detection loops stay on the default queue."""
+    if name == "gismap.tasks.ocr_task.run_ocr_task":
+        return {"queue": INFERENCE_QUEUE}
+    return None
+
+
 # General Celery configuration
 app.conf.update(
     worker_pool='threads',
@@ -15,7 +38,17 @@ app.conf.update(
     task_acks_late=True,
     worker_max_tasks_per_child=1000,
     worker_concurrency=4,
+    task_default_queue="celery",
+    task_queues=(Queue("celery"), Queue(INFERENCE_QUEUE)),
+    task_routes=(route_task,),
 )
+if WORKER_KIND == "inference":
+    from gismap.worker_pool import default_workers
+    app.conf.update(
+        worker_pool='prefork',
+        worker_concurrency=default_workers(),
+        task_queues=(Queue(INFERENCE_QUEUE),),
+    )
 
 # Read config from Django settings, namespace='CELERY'
 app.config_from_object('django.conf:settings', namespace='CELERY')
@@ -23,10 +56,35 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Auto-discover tasks from all installed apps
 app.autodiscover_tasks()
 
+# Inference worker: each pool process gets its own core set before any model loads
+@worker_process_init.connect
+def pin_inference_process(**kwargs):
+    if WORKER_KIND != "inference":
+        return
+    from billiard import current_process
+    from gismap.worker_pool import core_sets, pin_process
+    from gismap.model_registry import warmup_from_settings
+    sets = core_sets(app.conf.worker_concurrency)
+    pin_process(sets[(current_process().index or 0) % len(sets)])
+    warmup_from_settings()
+
+
+# Models load on first use (gismap/model_registry.py); MODEL_WARMUP ones at worker start
+@worker_ready.connect
+def warmup_models(**kwargs):
+    if WORKER_KIND == "inference":
+        return  # per process, after pinning (above)
+    from gismap.model_registry import warmup_from_settings
+    warmup_from_settings()
+
+
 # --- Celery Beat Schedule ---
+# Camera capture is no longer scheduled here: it runs in the ingest
+# supervisor (`python manage.py run_ingest`), outside of the worker pool.
 app.conf.beat_schedule = {
-    "stream-all-cameras-every-10-seconds": {
-        "task": "gismap.tasks.streaming_tasks.stream_all_cameras",
-        "schedule": 10.0,  # every 10 seconds for testing; adjust as needed
+    # Re-dispatch analytics whose owner died (leases in gismap/leases.py)
+    "ensure-detection-tasks-every-10-seconds": {
+        "task": "gismap.tasks.streaming_tasks.ensure_detection_tasks",
+        "schedule": 10.0,
     },
 }
@@ -182,3 +182,69 @@ EMAIL_HOST_PASSWORD = 'cgev gbwc hugo bxtz'
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+
+
+# Camera ingest (python manage.py run_ingest)
+# "rawvideo": ffmpeg décode en bgr24 -> ring buffer mémoire partagée, JPEG à la demande
+# "mjpeg": ffmpeg encode directement en JPEG (image2pipe), aucun pixel traité en Python
+INGEST_OUTPUT_FORMAT = os.getenv("INGEST_OUTPUT_FORMAT", "rawvideo")
+# Résolution de décodage = niveau "full" de la pyramide (crops OCR);
+# les niveaux detect (640x384) et thumb (320x192) en sont dérivés
+INGEST_FRAME_WIDTH = int(os.getenv("INGEST_FRAME_WIDTH", 1280))
+INGEST_FRAME_HEIGHT = int(os.getenv("INGEST_FRAME_HEIGHT", 720))
+
+# Frame bus: un Redis Stream plafonné par caméra (camera:{id}:frames)
+FRAME_BUS_MAXLEN = int(os.getenv("FRAME_BUS_MAXLEN", 100))
+# True si des analytiques tournent sur un autre hôte (pas d'accès à la mémoire partagée)
+FRAME_BUS_EMBED_JPEG = os.getenv("FRAME_BUS_EMBED_JPEG", "false").lower() == "true"
+
+# Inférence YOLO: "server" = serveur batché multi-caméras (manage.py run_inference),
+# "local" = chaque worker Celery charge ses propres modèles
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "server")
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", 16))
+INFERENCE_MAX_DELAY_MS = int(os.getenv("INFERENCE_MAX_DELAY_MS", 50))
+
+# Runtime des modèles YOLO: "torch", "onnx" (ONNX Runtime) ou "openvino";
+# les exports sont mis en cache dans gismap/yolo/exported/
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+INFERENCE_INT8 = os.getenv("INFERENCE_INT8", "false").lower() == "true"
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", 0))  # 0 = valeur par défaut du runtime
+
+# Processus d'inférence épinglés sur des cœurs disjoints (gismap/worker_pool.py):
+# run_inference --workers et worker Celery CELERY_WORKER_KIND=inference (prefork, OCR).
+# INFERENCE_WORKERS = 0: autant de processus de INFERENCE_CORES_PER_WORKER cœurs que le nœud en compte
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", 1))
+INFERENCE_CORES_PER_WORKER = int(os.getenv("INFERENCE_CORES_PER_WORKER", 4))
+
+# Registre de modèles (gismap/model_registry.py): chargés au premier usage.
+# MODEL_WARMUP: modèles préchargés au démarrage du worker Celery, ex. "best,box,pose"
+MODEL_WARMUP = [name for name in os.getenv("MODEL_WARMUP", "").split(",") if name]
+# Déchargement des modèles inutilisés depuis N secondes (0 = jamais, défaut).
+# Les modèles du serveur d'inférence (run_inference) ne sont jamais déchargés.
+MODEL_IDLE_TIMEOUT = float(os.getenv("MODEL_IDLE_TIMEOUT", 0))
+
+# Cache des résultats (gismap/result_cache.py): une scène inchangée (hash perceptuel
+# à moins de RESULT_CACHE_MAX_DISTANCE bits sur 256) réutilise le dernier résultat
+# YOLO / CLIP pendant au plus RESULT_CACHE_MAX_AGE secondes (0 = désactivé)
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 256))
+RESULT_CACHE_MAX_AGE = float(os.getenv("RESULT_CACHE_MAX_AGE", 2.0))
+RESULT_CACHE_MAX_DISTANCE = int(os.getenv("RESULT_CACHE_MAX_DISTANCE", 6))
+
+# Prompts CLIP de confirmation du feu (gismap/clip_prompts.py), séparés par "|";
+# leurs embeddings texte sont calculés une fois au chargement du modèle.
+# Un crop YOLO est confirmé quand son prompt le plus probable est un prompt "feu"
+CLIP_FIRE_PROMPTS = [prompt.strip() for prompt in os.getenv("CLIP_FIRE_PROMPTS", "").split("|") if prompt.strip()]
+CLIP_NO_FIRE_PROMPTS = [prompt.strip() for prompt in os.getenv("CLIP_NO_FIRE_PROMPTS", "").split("|") if prompt.strip()]
+
+# Pré-filtre feu (gismap/fire_prefilter.py): part minimale de pixels couleur flamme
+# (image réduite) et part minimale de ces pixels qui scintillent avant YOLO feu
+FIRE_PREFILTER_MIN_RATIO = float(os.getenv("FIRE_PREFILTER_MIN_RATIO", 0.0005))
+FIRE_PREFILTER_MIN_FLICKER = float(os.getenv("FIRE_PREFILTER_MIN_FLICKER", 0.1))
+
+# Budget d'inférence partagé par toutes les caméras (gismap/budget.py), en frames/s:
+# caméras calmes au rythme BUDGET_HEARTBEAT_FPS, caméras actives (objets, alerte
+# récente, priorité haute) jusqu'à BUDGET_MAX_FPS selon le budget restant
+INFERENCE_BUDGET_FPS = float(os.getenv("INFERENCE_BUDGET_FPS", 40))
+BUDGET_MAX_FPS = float(os.getenv("BUDGET_MAX_FPS", 10))
+BUDGET_HEARTBEAT_FPS = float(os.getenv("BUDGET_HEARTBEAT_FPS", 1))
+BUDGET_ALERT_HOLD_S = float(os.getenv("BUDGET_ALERT_HOLD_S", 300))